@@ -1,6 +1,6 @@
 import os
 
-from flask import Flask
+from flask import Flask, request
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_login import LoginManager
@@ -36,9 +36,32 @@ def create_app():
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
 
-    # Initialize CSRF Protection
+    # Initialize CSRF Protection. Requests authenticated with an API token
+    # carry no session cookie, so the check runs in csrf_protect() below
+    # instead of for every request
+    app.config["WTF_CSRF_CHECK_DEFAULT"] = False
     csrf = CSRFProtect(app)
 
+    # Probe sudo, init system and Samba binaries once, routes use the cache
+    from .capabilities import capabilities
+
+    capabilities.refresh()
+    app.capabilities = capabilities
+
+    # Keep a history of connections and locked files for the analytics
+    if capabilities.sudo and capabilities.has("smbstatus"):
+        from .connection_history import connection_history
+        from .locks import history
+
+        connection_history.start()
+        history.start()
+
+    # Watch smbd and nmbd memory, CPU and fds for the dashboard alerts
+    if capabilities.samba_installed:
+        from .process_monitor import monitor
+
+        monitor.start()
+
     from .routes import bp as main_bp
 
     app.register_blueprint(main_bp)
@@ -47,10 +70,23 @@ def create_app():
 
     app.register_blueprint(auth_bp)
 
+    from .auth import User, token_user
+
     @login_manager.user_loader
     def load_user(user_id):
-        from .auth import User
-
         return User.get(user_id)
 
+    @login_manager.request_loader
+    def load_user_from_request(request):
+        return token_user()
+
+    @app.before_request
+    def csrf_protect():
+        if not app.config["WTF_CSRF_ENABLED"]:
+            return
+        if request.method not in app.config["WTF_CSRF_METHODS"]:
+            return
+        if token_user() is None:
+            csrf.protect()
+
     return app
@@ -0,0 +1,272 @@
+import shlex
+
+from .smbconf import normalize_key
+
+# Prefixes Samba accepts in front of group names in user lists:
+# @ (Unix group or netgroup), + (Unix group) and & (netgroup)
+GROUP_PREFIXES = ("+&", "&+", "@", "+", "&")
+
+
+def split_principals(value):
+    """Split a Samba user list such as 'alice, @staff "+domain users"'"""
+    if not value:
+        return []
+    lexer = shlex.shlex(value, posix=True)
+    lexer.whitespace = " \t,"
+    lexer.whitespace_split = True
+    try:
+        return [item for item in lexer if item]
+    except ValueError:  # unbalanced quotes
+        return [item.strip() for item in value.replace(",", " ").split() if item]
+
+
+def parse_principal(item):
+    """Return ("group", name) or ("user", name) for one user list entry"""
+    for prefix in GROUP_PREFIXES:
+        if item.startswith(prefix):
+            return "group", item[len(prefix) :]
+    return "user", item
+
+
+# Share keys holding user lists, which can reference users and groups
+PRINCIPAL_KEYS = ["valid_users", "write_list"]
+
+
+def format_principals(items):
+    """Join user list entries back into a Samba value, quoting names with spaces"""
+    return ",".join(f'"{item}"' if " " in item else item for item in items)
+
+
+def build_reference_index(shares):
+    """Map ("user" | "group", name) to the names of the shares referencing it"""
+    index = {}
+    for share in shares:
+        for key in PRINCIPAL_KEYS:
+            for item in split_principals(share.get(key, "")):
+                index.setdefault(parse_principal(item), set()).add(share["name"])
+    return index
+
+
+def strip_principal(share, principal):
+    """Remove every reference to a principal from a share's user lists.
+
+    The last entry of valid users is kept, since an empty list would open
+    the share to every user. Returns the keys that still reference it.
+    """
+    kept = []
+    for key in PRINCIPAL_KEYS:
+        items = split_principals(share.get(key, ""))
+        remaining = [item for item in items if parse_principal(item) != principal]
+        if len(remaining) == len(items):
+            continue
+        if key == "valid_users" and not remaining:
+            kept.append(key)
+            continue
+        share[key] = format_principals(remaining)
+    return kept
+
+
+def _is_yes(value):
+    return str(value).strip().lower() in ("yes", "true", "1")
+
+
+# Normalized Samba parameters that decide who can use a share, with the
+# synonyms Samba accepts. "writable" and "writeable" are inverted "read only".
+ACCESS_PARAMETERS = {
+    "validusers": "valid_users",
+    "invalidusers": "invalid_users",
+    "readlist": "read_list",
+    "writelist": "write_list",
+    "readonly": "read_only",
+    "writable": "writable",
+    "writeable": "writable",
+    "guestok": "guest_ok",
+    "public": "guest_ok",
+}
+
+# Samba's own defaults for the access parameters
+ACCESS_DEFAULTS = {
+    "valid_users": "",
+    "invalid_users": "",
+    "read_list": "",
+    "write_list": "",
+    "read_only": "yes",
+    "guest_ok": "no",
+}
+
+
+def access_settings(*sections):
+    """Return the access parameters of a share from raw config sections.
+
+    Sections are applied in order, so pass [global] first and the share's
+    own sections after it; as in Samba, the last value of a parameter wins.
+    """
+    settings = dict(ACCESS_DEFAULTS)
+    for section in sections:
+        for key, value in section.items():
+            name = ACCESS_PARAMETERS.get(normalize_key(key))
+            if name == "writable":
+                settings["read_only"] = "no" if _is_yes(value) else "yes"
+            elif name is not None:
+                settings[name] = value
+    return settings
+
+
+class AccessMatrix:
+    """Effective read and write access of every Samba user to every share.
+
+    Each share has a read mask and a write mask: Python ints used as bitsets
+    where bit i stands for users[i]. Group membership, including groups
+    nested inside other groups, is expanded into one mask per group, so
+    resolving a share costs one OR per entry in its user lists.
+
+    shares is a list of (name, settings) pairs, settings being the result
+    of access_settings() for the share.
+    """
+
+    def __init__(self, users, shares, identity):
+        self.users = list(users)
+        self.user_bits = {name: 1 << i for i, name in enumerate(self.users)}
+        self.all_users = (1 << len(self.users)) - 1
+        self._identity = identity
+        self._group_masks = self._build_group_masks()
+        self._closures = {}
+
+        self.shares = []
+        self.read = {}
+        self.write = {}
+        self.guest = {}
+        for name, settings in shares:
+            self.shares.append(name)
+            self.read[name], self.write[name], self.guest[name] = self._resolve(
+                name, settings
+            )
+
+    def _build_group_masks(self):
+        """Direct members of every group, as bitsets over self.users"""
+        snapshot = self._identity.snapshot()
+        masks = {}
+        for name, bit in self.user_bits.items():
+            for group in snapshot.user_groups.get(name, ()):
+                masks[group] = masks.get(group, 0) | bit
+        return masks
+
+    def _nested_groups(self, group):
+        """Groups listed as members of a group ("@name", or a non-user name)"""
+        snapshot = self._identity.snapshot()
+        entry = snapshot.groups.get(group)
+        if entry is None:
+            return []
+        nested = []
+        for member in entry.gr_mem:
+            kind, name = parse_principal(member)
+            if kind == "group" or (
+                member not in snapshot.users and member in snapshot.groups
+            ):
+                nested.append(name)
+        return nested
+
+    def group_mask(self, group, _visiting=None):
+        """All users in a group and, recursively, in the groups it contains"""
+        mask = self._closures.get(group)
+        if mask is not None:
+            return mask
+
+        visiting = _visiting if _visiting is not None else set()
+        visiting.add(group)
+        mask = self._group_masks.get(group, 0)
+        for nested in self._nested_groups(group):
+            if nested not in visiting:
+                mask |= self.group_mask(nested, visiting)
+        visiting.discard(group)
+
+        # Results computed inside a cycle are incomplete, only cache at the top
+        if _visiting is None:
+            self._closures[group] = mask
+        return mask
+
+    def principals_mask(self, value, share_name):
+        mask = 0
+        for item in split_principals(value):
+            kind, name = parse_principal(item)
+            if kind == "group":
+                mask |= self.group_mask(name)
+            else:
+                # %S stands for the share name, as in the [homes] section
+                mask |= self.user_bits.get(name.replace("%S", share_name), 0)
+        return mask
+
+    def _resolve(self, name, settings):
+        """Return (read mask, write mask, guest access) for a share.
+
+        Without valid users every user may connect; invalid users are
+        always refused. Users in read list lose write access and users in
+        write list gain it, write list winning when a user is in both.
+        """
+        valid_users = settings["valid_users"]
+        if split_principals(valid_users):
+            readers = self.principals_mask(valid_users, name)
+        else:
+            readers = self.all_users
+        readers &= ~self.principals_mask(settings["invalid_users"], name)
+
+        read_only = _is_yes(settings["read_only"])
+        writers = 0 if read_only else readers
+        writers &= ~self.principals_mask(settings["read_list"], name)
+        writers |= readers & self.principals_mask(settings["write_list"], name)
+
+        guest = None
+        if _is_yes(settings["guest_ok"]) and not split_principals(valid_users):
+            guest = "read" if read_only else "write"
+        return readers, writers, guest
+
+    def members(self, mask):
+        """Names of the users set in a mask"""
+        names = []
+        while mask:
+            low = mask & -mask
+            names.append(self.users[low.bit_length() - 1])
+            mask ^= low
+        return names
+
+    def for_user(self, username):
+        """Return [{share, read, write}] for one user, or None if unknown"""
+        bit = self.user_bits.get(username)
+        if bit is None:
+            return None
+        return [
+            {
+                "share": share,
+                "read": bool(self.read[share] & bit),
+                "write": bool(self.write[share] & bit),
+            }
+            for share in self.shares
+        ]
+
+    def for_share(self, share):
+        """Return the readers, writers and guest access of one share, or None"""
+        if share not in self.read:
+            return None
+        return {
+            "share": share,
+            "readers": self.members(self.read[share]),
+            "writers": self.members(self.write[share]),
+            "guest": self.guest[share],
+        }
+
+    def to_dict(self):
+        """Whole matrix with one hex bitmask per share, bit i being users[i]"""
+        return {
+            "users": self.users,
+            "shares": [
+                {
+                    "name": share,
+                    "read": format(self.read[share], "x"),
+                    "write": format(self.write[share], "x"),
+                    "readers": bin(self.read[share]).count("1"),
+                    "writers": bin(self.write[share]).count("1"),
+                    "guest": self.guest[share],
+                }
+                for share in self.shares
+            ],
+        }
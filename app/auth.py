@@ -1,8 +1,24 @@
+import hashlib
+import hmac
 import json
 import os
-import fcntl
-
-from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import (
+    Blueprint,
+    flash,
+    g,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
 from flask_limiter import Limiter
 from flask_login import (
     LoginManager,
@@ -16,13 +32,281 @@ from werkzeug.security import check_password_hash, generate_password_hash
 
 bp = Blueprint("auth", __name__)
 
-# Path to store user data
-USERS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "users.json")
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+# Admin accounts are stored in SQLite
+USERS_DB = os.environ.get("SAMBA_MANAGER_USERS_DB", os.path.join(BASE_DIR, "users.db"))
+
+# Legacy JSON store, imported into USERS_DB once
+USERS_FILE = os.path.join(BASE_DIR, "users.json")
+
+# Number of loaded accounts kept in memory for the per-request user_loader
+USER_CACHE_SIZE = 256
+
+_MISSING = object()
+
+
+class UserStore:
+    """Admin accounts in a SQLite database in WAL mode.
+
+    Loaded accounts are kept in a small LRU so the per-request user lookup
+    is a dict hit. The LRU is cleared on writes and whenever SQLite reports
+    a commit from another process (PRAGMA data_version), so edits made by a
+    second worker are not missed.
+
+    API tokens have the form "<id>.<secret>". Only an HMAC-SHA256 of the
+    secret is stored, keyed with a random key kept in the database, so a
+    token is checked with one primary key lookup and one HMAC.
+    """
+
+    def __init__(self, path, cache_size=USER_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        # One connection shared by all request threads, guarded by the lock
+        self._lock = threading.RLock()
+        self._conn = None
+        self._data_version = None
+        self._cache = OrderedDict()
+        self._token_key = None
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+
+        if not os.path.exists(self.path):
+            # Password hashes, readable by the service account only
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema(conn)
+        self._conn = conn
+        return conn
+
+    def _create_schema(self, conn):
+        with conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    password TEXT NOT NULL,
+                    is_admin INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS api_tokens (
+                    id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    created REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS api_tokens_username ON api_tokens (username)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('token_hmac_key', ?)",
+                (secrets.token_hex(32),),
+            )
+            key = conn.execute(
+                "SELECT value FROM meta WHERE key = 'token_hmac_key'"
+            ).fetchone()[0]
+            self._token_key = bytes.fromhex(key)
+            migrated = conn.execute(
+                "SELECT value FROM meta WHERE key = 'users_json_migrated'"
+            ).fetchone()
+            if migrated is None:
+                self._migrate_json(conn)
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('users_json_migrated', '1')"
+                )
+
+    def _migrate_json(self, conn):
+        """Import the accounts of the legacy users.json"""
+        try:
+            with open(USERS_FILE, "r") as f:
+                users = json.load(f)
+        except (OSError, ValueError):
+            return
+        for username, data in users.items():
+            conn.execute(
+                "INSERT OR IGNORE INTO users (username, password, is_admin) VALUES (?, ?, ?)",
+                (username, data["password"], int(bool(data.get("is_admin", False)))),
+            )
+        if users:
+            print(f"Imported {len(users)} users from {USERS_FILE} into {self.path}")
+
+    def _check_version(self, conn):
+        """Drop the cache if another process committed since our last look"""
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._cache.clear()
+            self._data_version = version
+
+    def invalidate(self, username=None):
+        with self._lock:
+            if username is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(username, None)
+
+    def get(self, username):
+        """Return {"password", "is_admin"} for an account, or None"""
+        with self._lock:
+            conn = self._connect()
+            self._check_version(conn)
+            data = self._cache.get(username, _MISSING)
+            if data is not _MISSING:
+                self._cache.move_to_end(username)
+                return data
+
+            row = conn.execute(
+                "SELECT password, is_admin FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            data = (
+                {"password": row["password"], "is_admin": bool(row["is_admin"])}
+                if row
+                else None
+            )
+            self._cache[username] = data
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return data
+
+    def all(self):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT username, password, is_admin FROM users ORDER BY username"
+            )
+            return {
+                row["username"]: {
+                    "password": row["password"],
+                    "is_admin": bool(row["is_admin"]),
+                }
+                for row in rows
+            }
+
+    def count(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def _write(self, username, sql, params):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    return conn.execute(sql, params).rowcount
+            finally:
+                self._cache.pop(username, None)
+
+    def add(self, username, password_hash, is_admin=False):
+        """Insert an account, returning False if the username is taken"""
+        try:
+            self._write(
+                username,
+                "INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
+                (username, password_hash, int(bool(is_admin))),
+            )
+        except sqlite3.IntegrityError:
+            return False
+        return True
 
-# Ensure users file exists (but don't create default admin)
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, "w") as f:
-        json.dump({}, f)  # Start with empty users
+    def set_password(self, username, password_hash):
+        return (
+            self._write(
+                username,
+                "UPDATE users SET password = ? WHERE username = ?",
+                (password_hash, username),
+            )
+            > 0
+        )
+
+    def delete(self, username):
+        """Delete an account together with its API tokens"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM api_tokens WHERE username = ?", (username,))
+                deleted = conn.execute(
+                    "DELETE FROM users WHERE username = ?", (username,)
+                ).rowcount
+            self._cache.clear()
+        return deleted > 0
+
+    def _token_digest(self, secret):
+        return hmac.new(self._token_key, secret.encode(), hashlib.sha256).hexdigest()
+
+    def create_token(self, username, name):
+        """Create an API token for a user and return it; only its HMAC is stored"""
+        token_id = secrets.token_hex(8)
+        secret = secrets.token_urlsafe(32)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO api_tokens (id, username, name, digest, created)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (token_id, username, name, self._token_digest(secret), time.time()),
+                )
+        return f"{token_id}.{secret}"
+
+    def list_tokens(self, username):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, name, created FROM api_tokens WHERE username = ?"
+                " ORDER BY created",
+                (username,),
+            )
+            return [dict(row) for row in rows]
+
+    def revoke_token(self, token_id, username):
+        """Delete one of a user's tokens, returning False if there is none"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                deleted = conn.execute(
+                    "DELETE FROM api_tokens WHERE id = ? AND username = ?",
+                    (token_id, username),
+                ).rowcount
+            self._cache.pop(("token", token_id), None)
+        return deleted > 0
+
+    def verify_token(self, token):
+        """Return the username a token belongs to, or None if it is not valid"""
+        token_id, _, secret = token.partition(".")
+        if not token_id or not secret:
+            return None
+
+        key = ("token", token_id)
+        with self._lock:
+            conn = self._connect()
+            self._check_version(conn)
+            entry = self._cache.get(key, _MISSING)
+            if entry is _MISSING:
+                row = conn.execute(
+                    "SELECT username, digest FROM api_tokens WHERE id = ?", (token_id,)
+                ).fetchone()
+                entry = (row["username"], row["digest"]) if row else None
+                self._cache[key] = entry
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(key)
+
+        # Hash the secret even for unknown ids so both cases take as long
+        digest = self._token_digest(secret)
+        if entry is None or not hmac.compare_digest(digest, entry[1]):
+            return None
+        return entry[0]
+
+
+store = UserStore(USERS_DB)
 
 
 class User(UserMixin):
@@ -33,58 +317,49 @@ class User(UserMixin):
 
     @staticmethod
     def get(user_id):
-        users = User.get_users()
-        if user_id in users:
-            user_data = users[user_id]
-            return User(user_id, user_data.get("is_admin", False))
+        user_data = store.get(user_id)
+        if user_data is not None:
+            return User(user_id, user_data["is_admin"])
         return None
 
     @staticmethod
     def get_users():
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "r") as f:
-                fcntl.flock(f.fileno(), fcntl.LOCK_SH)  # Shared lock for reading
-                try:
-                    return json.load(f)
-                finally:
-                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-        return {}
+        return store.all()
 
     @staticmethod
-    def save_users(users):
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-        
-        with open(USERS_FILE, "w") as f:
-            fcntl.flock(f.fileno(), fcntl.LOCK_EX)  # Exclusive lock for writing
-            try:
-                json.dump(users, f, indent=4)
-            finally:
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    def from_token(token):
+        username = store.verify_token(token)
+        return User.get(username) if username else None
 
     @staticmethod
     def add_user(username, password, is_admin=False):
-        users = User.get_users()
-        if username in users:
-            return False
-
-        users[username] = {
-            "password": generate_password_hash(password),
-            "is_admin": is_admin,
-        }
-        User.save_users(users)
-        return True
+        return store.add(username, generate_password_hash(password), is_admin)
 
     @staticmethod
     def verify_password(username, password):
-        users = User.get_users()
-        if username in users and check_password_hash(
-            users[username]["password"], password
+        user_data = store.get(username)
+        if user_data is not None and check_password_hash(
+            user_data["password"], password
         ):
             return True
         return False
 
 
+def token_user():
+    """Return the User of a valid bearer token on an /api/ request, or None.
+
+    Used as the Flask-Login request_loader and to skip the CSRF check, which
+    only protects cookie sessions.
+    """
+    if "token_user" not in g:
+        user = None
+        header = request.headers.get("Authorization", "")
+        if request.path.startswith("/api/") and header[:7].lower() == "bearer ":
+            user = User.from_token(header[7:].strip())
+        g.token_user = user
+    return g.token_user
+
+
 @bp.route("/login", methods=["GET", "POST"])
 def login():
     from flask import current_app
@@ -123,8 +398,7 @@ def logout():
 @bp.route("/register", methods=["GET", "POST"])
 def register():
     # Allow access if no users exist (first-time setup) or if user is admin
-    users = User.get_users()
-    is_first_user_setup = len(users) == 0
+    is_first_user_setup = store.count() == 0
     
     if not is_first_user_setup and (not current_user.is_authenticated or not current_user.is_admin):
         flash("You do not have permission to register new users", "error")
@@ -164,14 +438,10 @@ def reset_password(username):
         flash("Please provide a new password", "error")
         return redirect(url_for("auth.register"))
 
-    users = User.get_users()
-    if username not in users:
+    if not store.set_password(username, generate_password_hash(password)):
         flash(f"User {username} does not exist", "error")
         return redirect(url_for("auth.register"))
 
-    users[username]["password"] = generate_password_hash(password)
-    User.save_users(users)
-
     flash(f"Password for {username} has been reset", "success")
     return redirect(url_for("auth.register"))
 
@@ -187,13 +457,85 @@ def delete_user(username):
         flash("You cannot delete your own account", "error")
         return redirect(url_for("auth.register"))
 
-    users = User.get_users()
-    if username not in users:
+    if not store.delete(username):
         flash(f"User {username} does not exist", "error")
         return redirect(url_for("auth.register"))
 
-    del users[username]
-    User.save_users(users)
-
     flash(f"User {username} has been deleted", "success")
     return redirect(url_for("auth.register"))
+
+
+@bp.route("/api-tokens", methods=["GET"])
+@login_required
+def api_tokens():
+    if not current_user.is_admin:
+        flash("You do not have permission to manage API tokens", "error")
+        return redirect(url_for("main.index"))
+
+    return render_template(
+        "api_tokens.html", tokens=store.list_tokens(current_user.username)
+    )
+
+
+@bp.route("/api-tokens/create", methods=["POST"])
+@login_required
+def create_api_token():
+    if not current_user.is_admin:
+        flash("You do not have permission to manage API tokens", "error")
+        return redirect(url_for("main.index"))
+
+    name = request.form.get("name", "").strip()
+    if not name:
+        flash("Please give the token a name", "error")
+        return redirect(url_for("auth.api_tokens"))
+
+    token = store.create_token(current_user.username, name)
+    flash(f"API token {name} created", "success")
+    # The token is only shown once, it cannot be recovered from its hash
+    return render_template(
+        "api_tokens.html",
+        tokens=store.list_tokens(current_user.username),
+        new_token=token,
+    )
+
+
+@bp.route("/api-tokens/revoke/<token_id>", methods=["POST"])
+@login_required
+def revoke_api_token(token_id):
+    if not current_user.is_admin:
+        flash("You do not have permission to manage API tokens", "error")
+        return redirect(url_for("main.index"))
+
+    if store.revoke_token(token_id, current_user.username):
+        flash("API token revoked", "success")
+    else:
+        flash("API token not found", "error")
+    return redirect(url_for("auth.api_tokens"))
+
+
+@bp.route("/api/tokens", methods=["GET", "POST"])
+@login_required
+def api_token_collection():
+    """List the caller's API tokens, or create one from {"name": ...}"""
+    if not current_user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
+
+    if request.method == "GET":
+        return jsonify(store.list_tokens(current_user.username))
+
+    data = request.get_json(silent=True) or {}
+    name = str(data.get("name", "")).strip()
+    if not name:
+        return jsonify({"error": "Token name is required"}), 400
+    token = store.create_token(current_user.username, name)
+    return jsonify({"id": token.split(".")[0], "name": name, "token": token}), 201
+
+
+@bp.route("/api/tokens/<token_id>", methods=["DELETE"])
+@login_required
+def api_token_revoke(token_id):
+    if not current_user.is_admin:
+        return jsonify({"error": "Admin access required"}), 403
+    if not store.revoke_token(token_id, current_user.username):
+        return jsonify({"error": "Token not found"}), 404
+    return jsonify({"success": True})
@@ -0,0 +1,116 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from . import privileged
+
+# How long probed capabilities are trusted before they are probed again
+CAPABILITY_TTL = float(os.environ.get("SAMBA_MANAGER_CAPABILITY_TTL", "300"))
+
+# Samba programs whose presence is recorded
+SAMBA_BINARIES = [
+    "smbd",
+    "nmbd",
+    "testparm",
+    "smbcontrol",
+    "smbstatus",
+    "pdbedit",
+    "smbpasswd",
+    "net",
+]
+
+
+def _probe_sudo():
+    """True if privileged operations work, through the helper or sudo -n"""
+    if privileged.client.available():
+        return True
+    try:
+        result = subprocess.run(
+            ["sudo", "-n", "true"], capture_output=True, check=False, timeout=10
+        )
+        return result.returncode == 0
+    except Exception:
+        return False
+
+
+def _probe_init_system():
+    """Return "systemd", "service", "initd" or None"""
+    # systemctl is often installed in containers where systemd is not running
+    if shutil.which("systemctl") and os.path.isdir("/run/systemd/system"):
+        return "systemd"
+    if shutil.which("service"):
+        return "service"
+    if os.path.exists("/etc/init.d/smbd"):
+        return "initd"
+    return None
+
+
+class Capabilities:
+    """Facts about the host that are expensive to discover and rarely change.
+
+    Everything is probed together on first use and cached for
+    CAPABILITY_TTL seconds; refresh() forces a new probe.
+    """
+
+    def __init__(self, ttl=CAPABILITY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._probed_at = None
+        self._values = {}
+
+    def refresh(self):
+        binaries = {name: shutil.which(name) for name in SAMBA_BINARIES}
+        values = {
+            "sudo": _probe_sudo(),
+            "init_system": _probe_init_system(),
+            "binaries": binaries,
+            "samba_installed": binaries["smbd"] is not None,
+        }
+        with self._lock:
+            self._values = values
+            self._probed_at = time.monotonic()
+        print(
+            f"Probed capabilities: sudo={values['sudo']}, init={values['init_system']}"
+        )
+        return values
+
+    def _fresh(self):
+        with self._lock:
+            return (
+                self._probed_at is not None
+                and time.monotonic() - self._probed_at < self.ttl
+            )
+
+    def snapshot(self):
+        """Return the cached capabilities, probing again once they have expired"""
+        if not self._fresh():
+            # Only one thread probes, the others wait for its result
+            with self._refresh_lock:
+                if not self._fresh():
+                    return self.refresh()
+        with self._lock:
+            return self._values
+
+    @property
+    def sudo(self):
+        return self.snapshot()["sudo"]
+
+    @property
+    def init_system(self):
+        return self.snapshot()["init_system"]
+
+    @property
+    def samba_installed(self):
+        return self.snapshot()["samba_installed"]
+
+    def has(self, binary):
+        return self.snapshot()["binaries"].get(binary) is not None
+
+    def to_dict(self):
+        return dict(self.snapshot())
+
+
+capabilities = Capabilities()
@@ -0,0 +1,303 @@
+import os
+import sqlite3
+import threading
+import time
+
+from . import smbstatus
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
+# Connection counts over time are stored in SQLite
+HISTORY_DB = os.environ.get(
+    "SAMBA_MANAGER_HISTORY_DB", os.path.join(BASE_DIR, "history.db")
+)
+
+# Seconds between two samples of the connection history
+HISTORY_SAMPLE_INTERVAL = float(
+    os.environ.get("SAMBA_MANAGER_HISTORY_SAMPLE_INTERVAL", "30")
+)
+
+# Rollup resolutions in seconds, and how many days of each are kept
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+RETENTION_DAYS = {60: 7, 3600: 180, 86400: 1825}
+
+# What the counts are broken down by; "total" has the single value "all"
+DIMENSIONS = ("total", "share", "user", "client", "protocol", "encryption")
+METRICS = ("sessions", "connections")
+
+# Upper bound on the length of the returned vectors
+MAX_BUCKETS = 20000
+
+
+def count_snapshot(snapshot):
+    """Count sessions and share connections per dimension value.
+
+    Returns {(dimension, value): [sessions, connections]}. A share
+    connection is attributed to the user, client and protocol of the
+    session of its smbd process.
+    """
+    counts = {("total", "all"): [len(snapshot.sessions), len(snapshot.connections)]}
+    sessions = {}
+
+    def add(dimension, value, position):
+        entry = counts.setdefault((dimension, value or "unknown"), [0, 0])
+        entry[position] += 1
+
+    for session in snapshot.sessions:
+        sessions[session.pid] = session
+        add("user", session.username, 0)
+        add("client", session.machine_ip or session.machine, 0)
+        add("protocol", session.protocol, 0)
+        add("encryption", _encryption(session.encryption), 0)
+
+    share_pids = {}
+    for connection in snapshot.connections:
+        share_pids.setdefault(connection.service, set()).add(connection.pid)
+        add("share", connection.service, 1)
+        session = sessions.get(connection.pid)
+        if session is not None:
+            add("user", session.username, 1)
+            add("protocol", session.protocol, 1)
+        add("client", connection.machine_ip or connection.machine, 1)
+        add("encryption", _encryption(connection.encryption), 1)
+
+    # Sessions of a share are the client processes connected to it
+    for service, pids in share_pids.items():
+        counts[("share", service or "unknown")][0] = len(pids)
+    return counts
+
+
+def _encryption(value):
+    return "none" if value in ("", "-") else value
+
+
+class ConnectionHistory:
+    """Sampled session and share connection counts, rolled up in SQLite.
+
+    Every sample is added to the 1-minute, 1-hour and 1-day rollup of its
+    time with an upsert, so each rollup row holds the number of samples,
+    the sum and the peak of both counts. Averages divide the sum by the
+    samples of the "total" row of the same bucket, which is written on
+    every sample, so values that were absent count as zero.
+    """
+
+    def __init__(self, path=HISTORY_DB, interval=HISTORY_SAMPLE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        # One connection shared by the sampler and request threads
+        self._lock = threading.RLock()
+        self._conn = None
+        self._last_taken_at = None
+        self._last_pruned = 0
+        self._sampler = None
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS rollups (
+                    resolution INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    dimension TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    samples INTEGER NOT NULL,
+                    sessions_sum INTEGER NOT NULL,
+                    sessions_max INTEGER NOT NULL,
+                    connections_sum INTEGER NOT NULL,
+                    connections_max INTEGER NOT NULL,
+                    PRIMARY KEY (resolution, dimension, bucket, value)
+                ) WITHOUT ROWID""")
+        self._conn = conn
+        return conn
+
+    def record(self, snapshot):
+        """Add one smbstatus snapshot to every rollup"""
+        # The collector hands out the same snapshot until it expires
+        if snapshot.error or snapshot.taken_at == self._last_taken_at:
+            return
+        self._last_taken_at = snapshot.taken_at
+
+        now = int(snapshot.taken_at)
+        rows = [
+            (resolution, now - now % resolution, dimension, value, s, s, c, c)
+            for resolution in RESOLUTIONS.values()
+            for (dimension, value), (s, c) in count_snapshot(snapshot).items()
+        ]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    """INSERT INTO rollups VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+                    ON CONFLICT (resolution, dimension, bucket, value) DO UPDATE SET
+                        samples = samples + 1,
+                        sessions_sum = sessions_sum + excluded.sessions_sum,
+                        sessions_max = max(sessions_max, excluded.sessions_max),
+                        connections_sum = connections_sum + excluded.connections_sum,
+                        connections_max = max(connections_max, excluded.connections_max)
+                    """,
+                    rows,
+                )
+            if now - self._last_pruned >= 3600:
+                self.prune(now)
+
+    def prune(self, now=None):
+        """Drop rollup rows older than their retention"""
+        now = int(time.time()) if now is None else now
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for resolution, days in RETENTION_DAYS.items():
+                    conn.execute(
+                        "DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+                        (resolution, now - days * 86400),
+                    )
+            self._last_pruned = now
+
+    def query(
+        self,
+        dimension="share",
+        metric="connections",
+        resolution=None,
+        since=None,
+        until=None,
+        limit=20,
+    ):
+        """Aggregates of one dimension between since and until.
+
+        Returns column vectors aligned on "buckets" with the average and the
+        peak of every value (None where nothing was sampled), the peak of
+        each value over the whole range and its bucket, and per value a 7x24
+        hour-of-week heatmap (Sunday first, server local time) of the average
+        hourly peak. Only the limit values with the highest peaks are kept.
+        """
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Invalid dimension: {dimension}")
+        if metric not in METRICS:
+            raise ValueError(f"Invalid metric: {metric}")
+
+        until = int(time.time() if until is None else until)
+        since = int(until - 86400 if since is None else since)
+        if since >= until:
+            raise ValueError("since must be before until")
+        if resolution is None:
+            span = until - since
+            if span <= 6 * 3600:
+                resolution = "minute"
+            elif span <= 14 * 86400:
+                resolution = "hour"
+            else:
+                resolution = "day"
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Invalid resolution: {resolution}")
+        step = RESOLUTIONS[resolution]
+        first = since - since % step
+        if (until - first) // step > MAX_BUCKETS:
+            raise ValueError("Too many buckets, use a coarser resolution")
+
+        total, peak = f"{metric}_sum", f"{metric}_max"
+        weekday = "CAST(strftime('%w', bucket, 'unixepoch', 'localtime') AS INTEGER)"
+        hour = "CAST(strftime('%H', bucket, 'unixepoch', 'localtime') AS INTEGER)"
+        first_hour = since - since % 3600
+        with self._lock:
+            conn = self._connect()
+            # A bare column next to max() comes from the row holding the max
+            peaks = conn.execute(
+                f"""SELECT value, max({peak}), bucket FROM rollups
+                WHERE resolution = ? AND dimension = ? AND bucket BETWEEN ? AND ?
+                GROUP BY value ORDER BY max({peak}) DESC, value LIMIT ?""",
+                (step, dimension, first, until, limit),
+            ).fetchall()
+            values = [value for value, _, _ in peaks]
+            placeholders = ",".join("?" * len(values))
+
+            sampled = dict(
+                conn.execute(
+                    """SELECT bucket, samples FROM rollups
+                    WHERE resolution = ? AND dimension = 'total' AND value = 'all'
+                    AND bucket BETWEEN ? AND ?""",
+                    (step, first, until),
+                )
+            )
+            rows = conn.execute(
+                f"""SELECT value, bucket, {total}, {peak} FROM rollups
+                WHERE resolution = ? AND dimension = ? AND bucket BETWEEN ? AND ?
+                AND value IN ({placeholders})""",
+                (step, dimension, first, until, *values),
+            ).fetchall()
+
+            sampled_hours = conn.execute(
+                f"""SELECT {weekday}, {hour}, count(*) FROM rollups
+                WHERE resolution = 3600 AND dimension = 'total' AND value = 'all'
+                AND bucket BETWEEN ? AND ? GROUP BY 1, 2""",
+                (first_hour, until),
+            ).fetchall()
+            hourly = conn.execute(
+                f"""SELECT value, {weekday}, {hour}, sum({peak}) FROM rollups
+                WHERE resolution = 3600 AND dimension = ? AND bucket BETWEEN ? AND ?
+                AND value IN ({placeholders}) GROUP BY 1, 2, 3""",
+                (dimension, first_hour, until, *values),
+            ).fetchall()
+
+        buckets = list(range(first, until + 1, step))
+        positions = {bucket: i for i, bucket in enumerate(buckets)}
+        empty = [0 if bucket in sampled else None for bucket in buckets]
+        series = {value: {"avg": list(empty), "max": list(empty)} for value in values}
+        for value, bucket, value_sum, value_max in rows:
+            i = positions[bucket]
+            series[value]["avg"][i] = round(value_sum / sampled[bucket], 2)
+            series[value]["max"][i] = value_max
+
+        # Hours that were sampled but where a value was absent count as zero
+        hours = [[None] * 24 for _ in range(7)]
+        for day, hour_of_day, count in sampled_hours:
+            hours[day][hour_of_day] = count
+        heatmaps = {
+            value: [[0 if count else None for count in day] for day in hours]
+            for value in values
+        }
+        for value, day, hour_of_day, peak_sum in hourly:
+            heatmaps[value][day][hour_of_day] = round(
+                peak_sum / hours[day][hour_of_day], 2
+            )
+
+        return {
+            "dimension": dimension,
+            "metric": metric,
+            "resolution": resolution,
+            "step": step,
+            "since": since,
+            "until": until,
+            "buckets": buckets,
+            "series": series,
+            "peaks": {
+                value: {"max": value_max, "bucket": bucket}
+                for value, value_max, bucket in peaks
+            },
+            "heatmaps": heatmaps,
+        }
+
+    def start(self):
+        """Start sampling in the background, if it is not running yet"""
+        with self._lock:
+            if self._sampler is not None and self._sampler.is_alive():
+                return
+            self._sampler = threading.Thread(
+                target=self._run, name="connection-history", daemon=True
+            )
+            self._sampler.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.record(smbstatus.collector.snapshot(max_age=self.interval))
+            except Exception as e:
+                print(f"Error recording connection history: {e}")
+            time.sleep(self.interval)
+
+
+connection_history = ConnectionHistory()
@@ -0,0 +1,200 @@
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+
+from . import smbstatus
+from .samba_utils import get_samba_status
+
+# How often the sampler looks at smbstatus while anyone is subscribed
+SAMPLE_INTERVAL = float(os.environ.get("SAMBA_MANAGER_EVENT_INTERVAL", "1"))
+
+# smbd/nmbd state is checked less often, it forks systemctl
+SERVICE_INTERVAL = float(os.environ.get("SAMBA_MANAGER_SERVICE_INTERVAL", "5"))
+
+# Longest pause between sampling attempts while sampling keeps failing
+MAX_SAMPLE_BACKOFF = 60
+
+# Seconds between keepalive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+# Events buffered per subscriber; a browser that falls this far behind is
+# disconnected and resynchronizes from a fresh snapshot when it reconnects
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+def session_key(session):
+    return f"{session['pid']}|{session['username']}|{session['machine']}"
+
+
+def connection_key(connection):
+    return f"{connection['pid']}|{connection['service']}|{connection['machine']}"
+
+
+class Subscription:
+    def __init__(self):
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def get(self, timeout=KEEPALIVE_INTERVAL):
+        """Return the next encoded event, or None after timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """Fans Server-Sent Events out to every open dashboard.
+
+    One background sampler polls the shared smbstatus snapshot and the
+    service state while there are subscribers, and publishes only what
+    changed: sessions and share connections that opened or closed, and
+    smbd/nmbd state changes. Other modules publish their own events, such
+    as apply job progress. New subscribers first receive a "snapshot" event
+    with the current state; state updates and fan-out happen under one lock,
+    so the deltas that follow always apply to that snapshot. When sampling
+    fails a "sampler_error" event is published and the sampler backs off, doubling
+    its pause up to MAX_SAMPLE_BACKOFF until a sample succeeds again.
+    """
+
+    def __init__(self, sample_interval=SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._sampler = None
+        self._version = None
+        self._sessions = None
+        self._connections = None
+        self._services = None
+        self._services_checked = 0
+
+    @staticmethod
+    def _encode(event_id, event_type, data):
+        return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+    def _publish(self, event_type, data):
+        """Queue an event for every subscriber; the caller holds the lock"""
+        message = self._encode(next(self._ids), event_type, data)
+        for subscription in list(self._subscribers):
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.closed = True
+                self._subscribers.discard(subscription)
+
+    def publish(self, event_type, data):
+        with self._lock:
+            if self._subscribers:
+                self._publish(event_type, data)
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+    def subscribe(self):
+        subscription = Subscription()
+        error = None
+        while True:
+            with self._lock:
+                if self._sessions is not None:
+                    snapshot = {
+                        "version": self._version,
+                        "processes": list(self._sessions.values()),
+                        "connections": list(self._connections.values()),
+                        "services": self._services,
+                    }
+                    if error is not None:
+                        snapshot["error"] = error
+                    subscription.queue.put_nowait(
+                        self._encode(next(self._ids), "snapshot", snapshot)
+                    )
+                    self._subscribers.add(subscription)
+
+                    if self._sampler is None:
+                        self._sampler = threading.Thread(
+                            target=self._run, name="event-sampler", daemon=True
+                        )
+                        self._sampler.start()
+                    return subscription
+            # Nobody was subscribed, so there is no current state to start from
+            error = self._try_sample()
+            if error is not None:
+                with self._lock:
+                    # Start from an empty state; the sampler keeps retrying and
+                    # reports what is open as deltas once a sample succeeds
+                    if self._sessions is None:
+                        self._sessions = {}
+                        self._connections = {}
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _diff(self, event_prefix, previous, current):
+        for key in previous.keys() - current.keys():
+            self._publish(f"{event_prefix}_closed", {"key": key, **previous[key]})
+        for key in current.keys() - previous.keys():
+            self._publish(f"{event_prefix}_opened", {"key": key, **current[key]})
+
+    def _sample(self):
+        snapshot = smbstatus.collector.snapshot(max_age=self.sample_interval)
+        if snapshot.error is not None:
+            # Do not report every session as closed because smbstatus failed
+            raise RuntimeError(snapshot.error)
+        status = snapshot.to_dict()
+        sessions = {session_key(s): s for s in status["processes"]}
+        connections = {connection_key(c): c for c in status["connections"]}
+
+        services = None
+        if time.monotonic() - self._services_checked >= SERVICE_INTERVAL:
+            services = get_samba_status()
+            self._services_checked = time.monotonic()
+
+        with self._lock:
+            if self._sessions is not None:
+                self._diff("session", self._sessions, sessions)
+                self._diff("connection", self._connections, connections)
+            self._version = status["version"]
+            self._sessions = sessions
+            self._connections = connections
+
+            if services is not None and services != self._services:
+                if self._services is not None:
+                    self._publish("service", services)
+                self._services = services
+
+    def _try_sample(self):
+        """Sample once, returning None, or the error after publishing it as an event"""
+        try:
+            self._sample()
+            return None
+        except Exception as e:
+            print(f"Error sampling Samba status for events: {e}")
+            with self._lock:
+                self._publish("sampler_error", {"message": str(e)})
+            return str(e)
+
+    def _run(self):
+        delay = self.sample_interval
+        while True:
+            time.sleep(delay)
+            with self._lock:
+                if not self._subscribers:
+                    # Stop sampling, the next subscriber starts a new sampler
+                    self._sampler = None
+                    self._sessions = None
+                    self._connections = None
+                    self._services = None
+                    self._services_checked = 0
+                    return
+            if self._try_sample() is None:
+                delay = self.sample_interval
+            else:
+                delay = min(delay * 2, MAX_SAMPLE_BACKOFF)
+
+
+broker = EventBroker()
@@ -0,0 +1,128 @@
+import grp
+import os
+import pwd
+import threading
+
+PASSWD_FILE = "/etc/passwd"
+GROUP_FILE = "/etc/group"
+
+# Ids below this belong to system accounts, which the UI does not list
+MIN_REGULAR_ID = 1000
+
+
+class _Snapshot:
+    """Users and groups as returned by NSS at one point in time"""
+
+    def __init__(self, users, groups):
+        self.users = {user.pw_name: user for user in users}
+        self.users_by_uid = {}
+        for user in users:
+            self.users_by_uid.setdefault(user.pw_uid, user)
+
+        self.groups = {group.gr_name: group for group in groups}
+        self.groups_by_gid = {}
+        for group in groups:
+            self.groups_by_gid.setdefault(group.gr_gid, group)
+
+        # Primary group members only appear in passwd, not in gr_mem
+        self.primary_members = {name: [] for name in self.groups}
+        self.members = {name: set(group.gr_mem) for name, group in self.groups.items()}
+        self.user_groups = {name: set() for name in self.users}
+        for user in users:
+            group = self.groups_by_gid.get(user.pw_gid)
+            if group is not None:
+                self.primary_members[group.gr_name].append(user.pw_name)
+                self.members[group.gr_name].add(user.pw_name)
+        for name, members in self.members.items():
+            for username in members:
+                self.user_groups.setdefault(username, set()).add(name)
+
+
+class IdentityIndex:
+    """In-process index of system users and groups.
+
+    Built from pwd.getpwall() and grp.getgrall() and rebuilt only when the
+    modification time of /etc/passwd or /etc/group changes, so lookups do
+    not fork getent. Accounts from other NSS sources (LDAP, sssd) are picked
+    up whenever the local files change.
+    """
+
+    def __init__(self, passwd_file=PASSWD_FILE, group_file=GROUP_FILE):
+        self.files = (passwd_file, group_file)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._snapshot = None
+
+    def _file_signature(self):
+        signature = []
+        for path in self.files:
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def snapshot(self):
+        """Return the current snapshot, rebuilding it if the files changed"""
+        signature = self._file_signature()
+        with self._lock:
+            if self._snapshot is None or signature != self._signature:
+                self._snapshot = _Snapshot(pwd.getpwall(), grp.getgrall())
+                self._signature = signature
+            return self._snapshot
+
+    def user(self, username):
+        """Return the passwd entry of a user, or None"""
+        return self.snapshot().users.get(username)
+
+    def uid(self, username):
+        user = self.user(username)
+        return user.pw_uid if user is not None else None
+
+    def group(self, group_name):
+        """Return the group entry of a group, or None"""
+        return self.snapshot().groups.get(group_name)
+
+    def user_by_uid(self, uid):
+        return self.snapshot().users_by_uid.get(uid)
+
+    def group_by_gid(self, gid):
+        return self.snapshot().groups_by_gid.get(gid)
+
+    def users(self, min_uid=MIN_REGULAR_ID):
+        """Names of users with a uid of at least min_uid, in passwd order"""
+        return [
+            name
+            for name, user in self.snapshot().users.items()
+            if user.pw_uid >= min_uid
+        ]
+
+    def groups(self, min_gid=MIN_REGULAR_ID):
+        """Names of groups with a gid of at least min_gid, in group order"""
+        return [
+            name
+            for name, group in self.snapshot().groups.items()
+            if group.gr_gid >= min_gid
+        ]
+
+    def groups_of(self, username):
+        """Names of all groups a user belongs to, including the primary group"""
+        return set(self.snapshot().user_groups.get(username, ()))
+
+    def members_of(self, group_name, primary=True):
+        """Names of the members of a group.
+
+        With primary=False only supplementary members (gr_mem) are returned.
+        """
+        snapshot = self.snapshot()
+        if primary:
+            return set(snapshot.members.get(group_name, ()))
+        group = snapshot.groups.get(group_name)
+        return set(group.gr_mem) if group is not None else set()
+
+    def primary_members(self, group_name):
+        """Names of users whose primary group is group_name"""
+        return list(self.snapshot().primary_members.get(group_name, ()))
+
+
+identity = IdentityIndex()
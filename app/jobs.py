@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .events import broker
+from .samba_utils import commit_share_changes
+
+# Mutations arriving within this many seconds of each other are applied
+# together with a single config write and a single reload
+APPLY_WINDOW = float(os.environ.get("SAMBA_MANAGER_APPLY_WINDOW", "0.5"))
+
+# Upper bound on how long a steady stream of mutations can delay an apply
+APPLY_MAX_DELAY = float(os.environ.get("SAMBA_MANAGER_APPLY_MAX_DELAY", "5"))
+
+# Number of finished jobs kept around for status queries
+JOB_HISTORY_SIZE = 1000
+
+
+def _mutation_name(action, payload):
+    if action == "delete":
+        return payload
+    if action == "unreference":
+        return payload[1]
+    return payload["name"]
+
+
+class Job:
+    """A group of share mutations submitted together, applied in one batch.
+
+    The mutations of an atomic job are applied all or nothing.
+    """
+
+    def __init__(self, mutations, atomic=False):
+        self.id = uuid.uuid4().hex
+        self.mutations = list(mutations)
+        self.atomic = atomic
+        self.status = "queued"
+        self.results = []
+        self.created = time.time()
+        self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def success(self):
+        return self.status == "done" and all(ok for ok, _ in self.results)
+
+    def wait(self, timeout=None):
+        """Block until the job has been applied, returning True on success"""
+        self._done.wait(timeout)
+        return self.success
+
+    def finish(self, results):
+        self.results = results
+        self.status = "done" if any(ok for ok, _ in results) else "failed"
+        self.finished = time.time()
+        self._done.set()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "success": self.success,
+            "created": self.created,
+            "finished": self.finished,
+            "results": [
+                {
+                    "action": action,
+                    "name": _mutation_name(action, payload),
+                    "success": ok,
+                    "message": message,
+                }
+                for (action, payload), (ok, message) in zip(
+                    self.mutations, self.results
+                )
+            ],
+        }
+
+
+class ApplyScheduler:
+    """Debounces share mutations and commits them in batches.
+
+    Mutations are queued as jobs. A worker thread waits until no new job has
+    arrived for APPLY_WINDOW seconds (or APPLY_MAX_DELAY has passed since the
+    first one), then commits every queued mutation with commit_share_changes()
+    so the whole burst costs one validation and one reload.
+    """
+
+    def __init__(self, window=APPLY_WINDOW, max_delay=APPLY_MAX_DELAY):
+        self.window = window
+        self.max_delay = max_delay
+        self._pending = []
+        self._jobs = OrderedDict()
+        self._lock = threading.Condition()
+        self._worker = None
+
+    def submit(self, mutations, atomic=False):
+        """Queue a list of ("upsert", share) / ("delete", name) mutations.
+
+        With atomic, either all of them are applied or none is.
+        """
+        job = Job(mutations, atomic)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > JOB_HISTORY_SIZE:
+                self._jobs.popitem(last=False)
+
+            self._pending.append(job)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="samba-apply", daemon=True
+                )
+                self._worker.start()
+            self._lock.notify()
+        broker.publish("job", job.to_dict())
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _next_batch(self):
+        """Wait for the debounce window to close and take the queued jobs"""
+        with self._lock:
+            while not self._pending:
+                self._lock.wait()
+
+            first = time.monotonic()
+            while True:
+                count = len(self._pending)
+                now = time.monotonic()
+                remaining = min(self.window, first + self.max_delay - now)
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+                if len(self._pending) == count:
+                    break
+
+            batch, self._pending = self._pending, []
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            for job in batch:
+                job.status = "running"
+                broker.publish("job", job.to_dict())
+
+            mutations = []
+            transactions = []
+            for job in batch:
+                if job.atomic:
+                    start = len(mutations)
+                    transactions.append((start, start + len(job.mutations)))
+                mutations.extend(job.mutations)
+            print(f"Applying {len(mutations)} share changes from {len(batch)} jobs")
+            try:
+                _, results = commit_share_changes(mutations, transactions)
+            except Exception as e:
+                print(f"Error applying share changes: {e}")
+                results = [(False, str(e))] * len(mutations)
+
+            for job in batch:
+                count = len(job.mutations)
+                job.finish(results[:count])
+                results = results[count:]
+                broker.publish("job", job.to_dict())
+
+
+scheduler = ApplyScheduler()
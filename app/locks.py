@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict
+
+from . import smbstatus
+
+# Seconds between two lock samples of the hot file history
+LOCK_SAMPLE_INTERVAL = float(os.environ.get("SAMBA_MANAGER_LOCK_SAMPLE_INTERVAL", "15"))
+
+# Samples are merged into buckets of this many seconds
+LOCK_BUCKET_SECONDS = 60
+
+# How far back the hot file history goes
+LOCK_HISTORY_WINDOW = float(os.environ.get("SAMBA_MANAGER_LOCK_HISTORY", "86400"))
+
+# Caching rights granted by each oplock level; leases list theirs as letters
+_OPLOCK_RIGHTS = {
+    "BATCH": "RWH",
+    "EXCLUSIVE": "RW",
+    "LEVEL_II": "R",
+    "NONE": "",
+}
+
+
+def lock_path(lock):
+    """Full path of a locked file; directory opens are listed with name "." """
+    if not lock.name or lock.name == ".":
+        return lock.share_path
+    return f"{lock.share_path.rstrip('/')}/{lock.name}"
+
+
+def caching_rights(oplock):
+    """Set of R(ead), W(rite) and H(andle) caching rights of an oplock or lease"""
+    value = oplock.upper()
+    if value.startswith("LEASE(") or set(value) <= set("RWH"):
+        return set(value.replace("LEASE", "").strip("()"))
+    rights = set()
+    for level in value.split("+"):
+        rights.update(_OPLOCK_RIGHTS.get(level.strip(), ""))
+    return rights
+
+
+def is_denying(deny_mode):
+    """True if an open keeps others from reading or writing the file.
+
+    The text output uses DENY_NONE, DENY_WRITE...; the JSON output lists the
+    access shared with other opens as letters, so a missing R or W denies it.
+    """
+    if deny_mode.upper().startswith("DENY_"):
+        return deny_mode.upper() != "DENY_NONE"
+    return bool(deny_mode) and not {"R", "W"} <= set(deny_mode.upper())
+
+
+class LockIndex:
+    """Open files of one smbstatus snapshot, indexed by share, path, pid and user"""
+
+    def __init__(self, snapshot, shares, identity):
+        self.taken_at = snapshot.taken_at
+        share_names = {
+            share.get("path", "").rstrip("/"): share["name"]
+            for share in shares
+            if share.get("path")
+        }
+        machines = {session.pid: session.machine for session in snapshot.sessions}
+        usernames = {session.pid: session.username for session in snapshot.sessions}
+
+        self.records = []
+        self.by_share = {}
+        self.by_path = {}
+        self.by_pid = {}
+        self.by_user = {}
+        for lock in snapshot.locks:
+            user = usernames.get(lock.pid)
+            if not user and lock.uid.isdigit():
+                entry = identity.user_by_uid(int(lock.uid))
+                user = entry.pw_name if entry is not None else lock.uid
+            record = asdict(lock)
+            record.update(
+                path=lock_path(lock),
+                share=share_names.get(lock.share_path.rstrip("/"), lock.share_path),
+                user=user or lock.uid,
+                machine=machines.get(lock.pid, ""),
+            )
+
+            position = len(self.records)
+            self.records.append(record)
+            self.by_share.setdefault(record["share"], []).append(position)
+            self.by_path.setdefault(record["path"], []).append(position)
+            self.by_pid.setdefault(record["pid"], []).append(position)
+            self.by_user.setdefault(record["user"], []).append(position)
+
+    def search(self, q=None, share=None, path=None, pid=None, user=None):
+        """Return the records matching every given filter.
+
+        share, path, pid and user are exact matches answered from the
+        indexes; q is a case-insensitive substring of the path, user or
+        machine.
+        """
+        positions = None
+        for index, value in (
+            (self.by_share, share),
+            (self.by_path, path),
+            (self.by_pid, pid),
+            (self.by_user, user),
+        ):
+            if value:
+                matches = set(index.get(value, ()))
+                positions = matches if positions is None else positions & matches
+
+        if positions is None:
+            records = self.records
+        else:
+            records = [self.records[position] for position in sorted(positions)]
+
+        if q:
+            needle = q.lower()
+            records = [
+                record
+                for record in records
+                if needle in record["path"].lower()
+                or needle in record["user"].lower()
+                or needle in record["machine"].lower()
+            ]
+        return records
+
+
+class _FileStats:
+    __slots__ = ("samples", "opens", "max_opens", "max_clients", "breaks", "denied")
+
+    def __init__(self):
+        self.samples = 0
+        self.opens = 0
+        self.max_opens = 0
+        self.max_clients = 0
+        self.breaks = 0
+        self.denied = 0
+
+
+class LockHistory:
+    """Sampled history of open files, used to rank contended files.
+
+    Every sample counts, per file, the concurrent opens, the distinct smbd
+    processes (clients) holding it, the opens with a deny mode, and the
+    oplock breaks since the previous sample: opens whose caching rights
+    shrank, e.g. BATCH to LEVEL_II or a lease losing W. Samples are merged
+    into per-minute buckets and kept for LOCK_HISTORY_WINDOW seconds.
+    """
+
+    SORT_KEYS = {
+        "opens": lambda f: (f["max_opens"], f["breaks"], f["denied"]),
+        "clients": lambda f: (f["max_clients"], f["max_opens"], f["breaks"]),
+        "breaks": lambda f: (f["breaks"], f["max_opens"], f["denied"]),
+        "denied": lambda f: (f["denied"], f["max_opens"], f["breaks"]),
+    }
+
+    def __init__(
+        self,
+        interval=LOCK_SAMPLE_INTERVAL,
+        bucket_seconds=LOCK_BUCKET_SECONDS,
+        window=LOCK_HISTORY_WINDOW,
+    ):
+        self.interval = interval
+        self.bucket_seconds = bucket_seconds
+        self._lock = threading.Lock()
+        self._buckets = deque(maxlen=max(1, int(window // bucket_seconds)))
+        self._rights = {}
+        self._last_taken_at = None
+        self._samples = 0
+        self._sampler = None
+
+    def record(self, snapshot):
+        """Add one smbstatus snapshot to the history"""
+        # The collector hands out the same snapshot until it expires
+        if snapshot.error or snapshot.taken_at == self._last_taken_at:
+            return
+        self._last_taken_at = snapshot.taken_at
+
+        files = {}
+        rights = {}
+        for lock in snapshot.locks:
+            path = lock_path(lock)
+            opens, pids, denied, breaks = files.setdefault(path, [0, set(), 0, 0])
+            current = caching_rights(lock.oplock)
+            previous = self._rights.get((lock.pid, path))
+            files[path] = [
+                opens + 1,
+                pids | {lock.pid},
+                denied + is_denying(lock.deny_mode),
+                breaks + (previous is not None and not previous <= current),
+            ]
+            rights[(lock.pid, path)] = current
+
+        start = snapshot.taken_at - snapshot.taken_at % self.bucket_seconds
+        with self._lock:
+            self._rights = rights
+            self._samples += 1
+            if not self._buckets or self._buckets[-1][0] != start:
+                self._buckets.append((start, {}))
+            bucket = self._buckets[-1][1]
+            for path, (opens, pids, denied, breaks) in files.items():
+                stats = bucket.get(path)
+                if stats is None:
+                    stats = bucket[path] = _FileStats()
+                stats.samples += 1
+                stats.opens += opens
+                stats.max_opens = max(stats.max_opens, opens)
+                stats.max_clients = max(stats.max_clients, len(pids))
+                stats.breaks += breaks
+                stats.denied += denied
+
+    def hot_files(self, window=3600, sort="opens", limit=20):
+        """Rank the files of the last window seconds by sort"""
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"Invalid sort: {sort}")
+        since = time.time() - window
+
+        totals = {}
+        with self._lock:
+            buckets = [
+                (start, bucket)
+                for start, bucket in self._buckets
+                if start + self.bucket_seconds > since
+            ]
+            for start, bucket in buckets:
+                for path, stats in bucket.items():
+                    total = totals.get(path)
+                    if total is None:
+                        total = totals[path] = {
+                            "path": path,
+                            "samples": 0,
+                            "opens": 0,
+                            "max_opens": 0,
+                            "max_clients": 0,
+                            "breaks": 0,
+                            "denied": 0,
+                        }
+                    total["samples"] += stats.samples
+                    total["opens"] += stats.opens
+                    total["max_opens"] = max(total["max_opens"], stats.max_opens)
+                    total["max_clients"] = max(total["max_clients"], stats.max_clients)
+                    total["breaks"] += stats.breaks
+                    total["denied"] += stats.denied
+                    total["last_seen"] = start
+
+        files = sorted(totals.values(), key=self.SORT_KEYS[sort], reverse=True)
+        for total in files[:limit]:
+            total["avg_opens"] = round(total.pop("opens") / total["samples"], 2)
+        return {
+            "files": files[:limit],
+            "since": buckets[0][0] if buckets else None,
+            "samples": self._samples,
+        }
+
+    def start(self):
+        """Start sampling in the background, if it is not running yet"""
+        with self._lock:
+            if self._sampler is not None and self._sampler.is_alive():
+                return
+            self._sampler = threading.Thread(
+                target=self._run, name="lock-history", daemon=True
+            )
+            self._sampler.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.record(smbstatus.collector.snapshot(max_age=self.interval))
+            except Exception as e:
+                print(f"Error sampling locked files: {e}")
+            time.sleep(self.interval)
+
+
+history = LockHistory()
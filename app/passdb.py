@@ -0,0 +1,184 @@
+import hashlib
+import os
+import struct
+import time
+
+try:
+    import tdb
+except ImportError:  # python3-tdb is optional
+    tdb = None
+
+# Samba's tdbsam database, usually only readable by root
+PASSDB_TDB = os.environ.get(
+    "SAMBA_MANAGER_PASSDB_TDB", "/var/lib/samba/private/passdb.tdb"
+)
+
+# Layout of a SAMU record in tdbsam versions 3 and 4 (TDB_FORMAT_STRING_V3)
+SAMU_FORMAT_V3 = "dddddddBBBBBBBBBBBBddBBBdwdBwwd"
+TDBSAM_VERSIONS = (3, 4)
+
+USER_PREFIX = b"USER_"
+
+
+def parse_account_flags(flags):
+    """Return the letters of an account control field such as "[UX         ]" """
+    return flags.strip().strip("[]").replace(" ", "")
+
+
+def parse_smbpasswd(lines):
+    """Yield user records from smbpasswd formatted lines (pdbedit -L -w).
+
+    Each line looks like "name:uid:LM hash:NT hash:[UX         ]:LCT-...:".
+    """
+    for line in lines:
+        if not line.strip() or line.startswith("#"):
+            continue
+        parts = line.split(":")
+        flags = parse_account_flags(parts[4]) if len(parts) > 4 else "U"
+        yield {
+            "username": parts[0].strip(),
+            "uid": int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None,
+            "enabled": "D" not in flags,
+            "flags": flags or "U",
+        }
+
+
+def _unpack_samu(data, fmt=SAMU_FORMAT_V3):
+    """Unpack a tdb_pack() buffer: d is a uint32, w a uint16, B a length-prefixed blob"""
+    values = []
+    offset = 0
+    for code in fmt:
+        if code == "d":
+            values.append(struct.unpack_from("<I", data, offset)[0])
+            offset += 4
+        elif code == "w":
+            values.append(struct.unpack_from("<H", data, offset)[0])
+            offset += 2
+        elif code == "B":
+            length = struct.unpack_from("<I", data, offset)[0]
+            offset += 4
+            values.append(bytes(data[offset : offset + length]))
+            offset += length
+    return values
+
+
+# ACB_* bits of acct_ctrl and the letters pdbedit shows for them
+ACCOUNT_FLAG_BITS = [
+    (0x0001, "D"),  # disabled
+    (0x0002, "H"),  # home directory required
+    (0x0004, "N"),  # no password required
+    (0x0008, "T"),  # temporary duplicate account
+    (0x0010, "U"),  # normal user account
+    (0x0020, "M"),  # MNS logon user account
+    (0x0040, "I"),  # interdomain trust account
+    (0x0080, "W"),  # workstation trust account
+    (0x0100, "S"),  # server trust account
+    (0x0200, "X"),  # password does not expire
+    (0x0400, "L"),  # account auto-locked
+]
+
+
+def account_flags_from_ctrl(acct_ctrl):
+    return "".join(letter for bit, letter in ACCOUNT_FLAG_BITS if acct_ctrl & bit)
+
+
+def read_passdb_tdb(path=PASSDB_TDB):
+    """Read user records straight from passdb.tdb.
+
+    Returns None when the tdb module is missing, the file is not readable or
+    the database version is unknown, so callers can fall back to pdbedit.
+    """
+    if tdb is None or not os.access(path, os.R_OK):
+        return None
+
+    db = tdb.open(path, flags=os.O_RDONLY)
+    try:
+        version = db.get(b"INFO/version\0")
+        if (
+            version is None
+            or struct.unpack("<i", version[:4])[0] not in TDBSAM_VERSIONS
+        ):
+            return None
+
+        users = []
+        for key in db.keys():
+            if not key.startswith(USER_PREFIX):
+                continue
+            values = _unpack_samu(db.get(key))
+            # 7 time fields, 12 strings, 2 rids and 3 password blobs precede acct_ctrl
+            username = values[7].rstrip(b"\0").decode("utf-8", "replace")
+            flags = account_flags_from_ctrl(values[24])
+            users.append(
+                {
+                    "username": username,
+                    "uid": None,
+                    "enabled": "D" not in flags,
+                    "flags": flags or "U",
+                }
+            )
+        return users
+    finally:
+        db.close()
+
+
+def _md4(data):
+    """MD4 digest (RFC 1320) for OpenSSL builds that no longer provide it"""
+
+    def rotl(x, n):
+        x &= 0xFFFFFFFF
+        return ((x << n) | (x >> (32 - n))) & 0xFFFFFFFF
+
+    def f(x, y, z):
+        return (x & y) | (~x & z)
+
+    def g(x, y, z):
+        return (x & y) | (x & z) | (y & z)
+
+    def h(x, y, z):
+        return x ^ y ^ z
+
+    bit_length = len(data) * 8
+    data = data + b"\x80" + b"\0" * ((55 - len(data)) % 64)
+    data += struct.pack("<Q", bit_length & 0xFFFFFFFFFFFFFFFF)
+
+    a, b, c, d = 0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476
+    for offset in range(0, len(data), 64):
+        x = struct.unpack("<16I", data[offset : offset + 64])
+        aa, bb, cc, dd = a, b, c, d
+        for i in (0, 4, 8, 12):
+            a = rotl(a + f(b, c, d) + x[i], 3)
+            d = rotl(d + f(a, b, c) + x[i + 1], 7)
+            c = rotl(c + f(d, a, b) + x[i + 2], 11)
+            b = rotl(b + f(c, d, a) + x[i + 3], 19)
+        for i in (0, 1, 2, 3):
+            a = rotl(a + g(b, c, d) + x[i] + 0x5A827999, 3)
+            d = rotl(d + g(a, b, c) + x[i + 4] + 0x5A827999, 5)
+            c = rotl(c + g(d, a, b) + x[i + 8] + 0x5A827999, 9)
+            b = rotl(b + g(c, d, a) + x[i + 12] + 0x5A827999, 13)
+        for i in (0, 2, 1, 3):
+            a = rotl(a + h(b, c, d) + x[i] + 0x6ED9EBA1, 3)
+            d = rotl(d + h(a, b, c) + x[i + 8] + 0x6ED9EBA1, 9)
+            c = rotl(c + h(d, a, b) + x[i + 4] + 0x6ED9EBA1, 11)
+            b = rotl(b + h(c, d, a) + x[i + 12] + 0x6ED9EBA1, 15)
+        a = (a + aa) & 0xFFFFFFFF
+        b = (b + bb) & 0xFFFFFFFF
+        c = (c + cc) & 0xFFFFFFFF
+        d = (d + dd) & 0xFFFFFFFF
+    return struct.pack("<4I", a, b, c, d)
+
+
+def nt_hash(password):
+    """Return the NT hash of a password (MD4 of its UTF-16LE encoding) in hex"""
+    data = password.encode("utf-16-le")
+    try:
+        digest = hashlib.new("md4", data).digest()
+    except ValueError:  # MD4 is disabled in OpenSSL 3 by default
+        digest = _md4(data)
+    return digest.hex().upper()
+
+
+def format_smbpasswd(username, uid, password, flags="U"):
+    """Return an smbpasswd line for "pdbedit -i smbpasswd:<file>" """
+    return "{}:{}:{}:{}:[{:<11}]:LCT-{:08X}:".format(
+        username, uid, "X" * 32, nt_hash(password), flags, int(time.time())
+    )
@@ -0,0 +1,875 @@
+"""Privileged helper for Samba Manager.
+
+A small root process that listens on a Unix socket and performs a narrow,
+allow-listed set of operations for the web app (read and atomically write
+Samba config files, create share directories, signal and sample smbd
+processes, run the Samba admin tools). The web app keeps one connection open and can send several
+operations per round-trip, instead of forking a sudo process for every call.
+
+Start it as root:
+
+    python3 -m app.privileged --uid <web app user>
+
+When the helper is not running, every function here falls back to sudo,
+so the web app works the same either way.
+"""
+
+import argparse
+import errno
+import grp
+import json
+import os
+import pwd
+import re
+import shutil
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+
+HELPER_SOCKET = os.environ.get(
+    "SAMBA_MANAGER_HELPER_SOCKET", "/run/samba-manager/helper.sock"
+)
+
+# Files the helper may read, write or remove
+ALLOWED_PATH_PREFIXES = ("/etc/samba/",)
+
+# Largest request line accepted from a client
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class HelperError(Exception):
+    """An operation was rejected or failed inside the helper"""
+
+
+# Server side
+
+
+def _check_path(path):
+    real = os.path.realpath(path)
+    if not real.startswith(ALLOWED_PATH_PREFIXES):
+        raise HelperError(f"Path not allowed: {path}")
+    return real
+
+
+def _process_name(pid):
+    try:
+        with open(f"/proc/{int(pid)}/comm") as f:
+            return f.read().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _parent_pid(pid):
+    with open(f"/proc/{int(pid)}/stat") as f:
+        # The command name may contain spaces, the fields after it do not
+        return int(f.read().rsplit(")", 1)[1].split()[1])
+
+
+def op_read_file(path):
+    with open(_check_path(path)) as f:
+        return f.read()
+
+
+def _stage_file(real, content, mode):
+    """Write content to a temporary file next to real, returning its path"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(real), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path
+
+
+def op_write_file(path, content, mode=0o644, backup=False):
+    """Replace a file atomically, optionally keeping the old one as path.bak"""
+    return op_write_files({path: content}, mode, backup)
+
+
+def op_write_files(files, mode=0o644, backup=False):
+    """Replace several files together, optionally keeping path.bak copies.
+
+    Every file is written to a temporary file first; the originals are only
+    replaced, each with an atomic rename, once all of them were written.
+    """
+    staged = []
+    try:
+        for path, content in files.items():
+            real = _check_path(path)
+            staged.append((_stage_file(real, content, mode), real))
+    except BaseException:
+        for temp_path, _ in staged:
+            os.unlink(temp_path)
+        raise
+
+    for temp_path, real in staged:
+        if backup and os.path.exists(real):
+            shutil.copy2(real, real + ".bak")
+        os.replace(temp_path, real)
+    return True
+
+
+def op_remove_file(path):
+    try:
+        os.unlink(_check_path(path))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def op_make_dir(path, mode=0o755):
+    real = _check_path(path + "/")
+    os.makedirs(real, exist_ok=True)
+    os.chmod(real, mode)
+    return True
+
+
+def op_stat_path(path):
+    exists = os.path.exists(path)
+    return {
+        "exists": exists,
+        "is_dir": os.path.isdir(path),
+        "readable": exists and os.access(path, os.R_OK),
+        "writable": exists and os.access(path, os.W_OK),
+    }
+
+
+# System directories a share directory may not be created in, as in the
+# path checks of the web app
+SHARE_DIR_DENIED = (
+    "/etc",
+    "/var",
+    "/usr",
+    "/bin",
+    "/sbin",
+    "/boot",
+    "/sys",
+    "/proc",
+    "/dev",
+    "/root",
+)
+
+
+def _share_dir(path):
+    real = os.path.realpath(path)
+    if (
+        not os.path.isabs(path)
+        or real == "/"
+        or any(
+            real == denied or real.startswith(denied + "/")
+            for denied in SHARE_DIR_DENIED
+        )
+    ):
+        raise HelperError(f"Path not allowed: {path}")
+    return real
+
+
+def op_make_share_dir(path, owner=None):
+    """Create a share directory and set its owner and mode.
+
+    New shares are owned by root:smbusers with mode 2775; a directory in
+    the home of owner is owned by owner:owner with mode 0755. Ownership
+    and mode are only set on a directory that did not exist yet, never on
+    an existing tree. Returns whether the directory was created.
+    """
+    real = _share_dir(path)
+    if owner is None:
+        uid, gid, mode = 0, grp.getgrnam("smbusers").gr_gid, 0o2775
+    else:
+        entry = pwd.getpwnam(owner)
+        if not real.startswith(f"/home/{owner}/"):
+            raise HelperError(f"Path is not in the home of {owner}: {path}")
+        uid, gid, mode = entry.pw_uid, entry.pw_gid, 0o755
+
+    if os.path.exists(real):
+        return False
+    os.makedirs(real)
+    os.chown(real, uid, gid)
+    os.chmod(real, mode)
+    return True
+
+
+def op_remove_dir(path):
+    """Remove an empty share directory, returning False if it is gone or not empty"""
+    try:
+        os.rmdir(_share_dir(path))
+        return True
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.ENOTEMPTY, errno.EEXIST):
+            return False
+        raise
+
+
+def _is_smbd(name):
+    # Samba 4.18 and later name connection processes "smbd[<client address>]"
+    return name is not None and (name == "smbd" or name.startswith("smbd["))
+
+
+def _connection_process_error(pid):
+    """Why a pid may not be signalled, or None for an smbd connection process"""
+    if not _is_smbd(_process_name(pid)):
+        return f"Process {pid} is not an smbd process"
+    try:
+        parent = _parent_pid(pid)
+    except (OSError, ValueError, IndexError):
+        return f"Process {pid} is not an smbd process"
+    # Connection processes are forked by the main smbd, which must never be hit
+    if not _is_smbd(_process_name(parent)):
+        return f"Process {pid} is the main smbd process"
+    return None
+
+
+def _proc_stat(pid):
+    """Fields of /proc/<pid>/stat, or None if the process is gone"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The fields after the name start at field 3 (state) of proc(5)
+    fields = data.rsplit(")", 1)[1].split()
+    return {
+        "name": data[data.find("(") + 1 : data.rfind(")")],
+        "ppid": fields[1],
+        "cpu_ticks": int(fields[11]) + int(fields[12]),
+        "threads": int(fields[17]),
+        "start": int(fields[19]),
+        "rss": int(fields[21]) * PAGE_SIZE,
+    }
+
+
+def _proc_io(pid):
+    """I/O counters of a process, or None if they are not readable"""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            return {
+                key: int(value)
+                for key, value in (line.split(":") for line in f if ":" in line)
+            }
+    except (OSError, ValueError):
+        return None
+
+
+def _samba_stats(prefixes):
+    """stat of every process whose name starts with one of prefixes, by pid"""
+    stats = {}
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
+            stat = _proc_stat(pid)
+            if stat is not None and stat["name"].startswith(prefixes):
+                stats[pid] = stat
+    return stats
+
+
+def _read_smbd_processes():
+    """CPU time and I/O counters of every smbd connection process.
+
+    One walk over /proc: the stat file of every process gives its name,
+    parent, CPU ticks and start time, and the io file is read only for smbd
+    processes whose parent is smbd. io is None where it is not readable.
+    """
+    stats = {
+        pid: stat
+        for pid, stat in _samba_stats(("smbd",)).items()
+        if _is_smbd(stat["name"])
+    }
+    processes = {}
+    for pid, stat in stats.items():
+        if stat["ppid"] not in stats:
+            continue  # the main smbd
+        processes[pid] = {
+            "cpu_ticks": stat["cpu_ticks"],
+            "start": stat["start"],
+            "io": _proc_io(pid),
+        }
+    return processes
+
+
+def _read_samba_processes():
+    """Name, parent, RSS, CPU ticks, threads and open fds of smbd and nmbd.
+
+    Covers the main daemons, connection processes and helpers such as
+    smbd-notifyd. fds is None where /proc/<pid>/fd is not readable.
+    """
+    processes = _samba_stats(("smbd", "nmbd"))
+    for pid, stat in processes.items():
+        try:
+            stat["fds"] = len(os.listdir(f"/proc/{pid}/fd"))
+        except OSError:
+            stat["fds"] = None
+    return processes
+
+
+def op_kill(pid, sig="TERM"):
+    """Signal an smbd connection process, never the main smbd daemon"""
+    pid = int(pid)
+    error = _connection_process_error(pid)
+    if error:
+        raise HelperError(error)
+
+    signum = {"TERM": signal.SIGTERM, "KILL": signal.SIGKILL}.get(sig)
+    if signum is None:
+        raise HelperError(f"Signal not allowed: {sig}")
+    os.kill(pid, signum)
+    return True
+
+
+def op_smbd_processes():
+    return _read_smbd_processes()
+
+
+def op_samba_processes():
+    return _read_samba_processes()
+
+
+def _plain(value):
+    """An argument that cannot be mistaken for an option and has one line"""
+    return (
+        isinstance(value, str)
+        and value != ""
+        and not value.startswith("-")
+        and "\n" not in value
+        and "\0" not in value
+    )
+
+
+def _config_path(value):
+    return _plain(value) and os.path.realpath(value).startswith(ALLOWED_PATH_PREFIXES)
+
+
+def _username(value):
+    return _plain(value) and re.fullmatch(r"[A-Za-z0-9._$-]+", value) is not None
+
+
+def _share_parameter(value):
+    return _plain(value) and "".join(value.split()).lower() in SHARE_PARAMETERS
+
+
+def _parameter_value(value):
+    # Values may be empty, e.g. to clear "valid users"
+    return value == "" or _plain(value)
+
+
+def _smbpasswd_import(value):
+    # A file created by import_samba_users with mkstemp, see samba_utils
+    if not isinstance(value, str) or not value.startswith("smbpasswd:"):
+        return False
+    path = value[len("smbpasswd:") :]
+    return (
+        _plain(path)
+        and os.path.dirname(path) in (tempfile.gettempdir(), "/tmp", "/var/tmp")
+        and os.path.basename(path).startswith("samba-import-")
+    )
+
+
+# Share parameters the web app sets in the registry. Parameters such as
+# "root preexec" run commands as root, so anything else is refused.
+SHARE_PARAMETERS = {
+    "path",
+    "comment",
+    "browseable",
+    "browsable",
+    "readonly",
+    "guestok",
+    "validusers",
+    "writelist",
+    "createmask",
+    "directorymask",
+    "forcegroup",
+    "maxconnections",
+}
+
+# Programs the helper may run, always without a shell, with the argument
+# lists each may be run with: a string must match literally, a function
+# must accept the argument. These are exactly the calls the web app makes.
+COMMAND_SHAPES = {
+    "net": [
+        ("conf", "list"),
+        ("conf", "import", _config_path, _plain),
+        ("conf", "setparm", _plain, _share_parameter, _parameter_value),
+        ("conf", "delshare", _plain),
+    ],
+    "smbcontrol": [("smbd", "reload-config"), ("nmbd", "reload-config")],
+    "smbstatus": [(), ("--json",)],
+    "testparm": [("-s",), ("-s", _config_path)],
+    "pdbedit": [("-L", "-w"), ("-i", _smbpasswd_import)],
+    "smbpasswd": [
+        ("-x", _username),
+        ("-e", _username),
+        ("-d", _username),
+        ("-s", _username),
+        ("-s", "-a", _username),
+    ],
+}
+ALLOWED_COMMANDS = set(COMMAND_SHAPES)
+
+
+def _command_error(args):
+    """Why a command may not be run, or None if it has an allowed shape"""
+    if not isinstance(args, list) or not args:
+        return "No command given"
+    for shape in COMMAND_SHAPES.get(args[0], ()):
+        if len(shape) == len(args) - 1 and all(
+            arg == part if isinstance(part, str) else part(arg)
+            for part, arg in zip(shape, args[1:])
+        ):
+            return None
+    return f"Command not allowed: {' '.join(map(str, args[:3]))}"
+
+
+def op_run(args, input=None):
+    error = _command_error(args)
+    if error:
+        raise HelperError(error)
+    result = subprocess.run(
+        args, input=input, capture_output=True, text=True, check=False
+    )
+    return {
+        "returncode": result.returncode,
+        "stdout": result.stdout,
+        "stderr": result.stderr,
+    }
+
+
+OPERATIONS = {
+    "read_file": op_read_file,
+    "write_file": op_write_file,
+    "write_files": op_write_files,
+    "remove_file": op_remove_file,
+    "make_dir": op_make_dir,
+    "stat_path": op_stat_path,
+    "make_share_dir": op_make_share_dir,
+    "remove_dir": op_remove_dir,
+    "kill": op_kill,
+    "smbd_processes": op_smbd_processes,
+    "samba_processes": op_samba_processes,
+    "run": op_run,
+}
+
+
+def execute(ops):
+    """Run a list of {"op": name, "args": {...}} and return one result per op"""
+    results = []
+    for request in ops:
+        try:
+            handler = OPERATIONS.get(request.get("op"))
+            if handler is None:
+                raise HelperError(f"Unknown operation: {request.get('op')}")
+            results.append({"ok": True, "result": handler(**request.get("args", {}))})
+        except Exception as e:
+            results.append({"ok": False, "error": str(e)})
+    return results
+
+
+class HelperRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        creds = self.request.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        pid, uid, gid = struct.unpack("3i", creds)
+        if uid not in self.server.allowed_uids:
+            print(f"Rejected helper connection from pid {pid} (uid {uid})")
+            return
+
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_SIZE)
+            if not line:
+                return
+            try:
+                ops = json.loads(line)["ops"]
+                response = {"results": execute(ops)}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": f"Malformed request: {e}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, allowed_uids):
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = HelperServer(socket_path, HelperRequestHandler)
+    server.allowed_uids = set(allowed_uids)
+    # Access is checked per connection with SO_PEERCRED
+    os.chmod(socket_path, 0o666)
+    print(f"Samba Manager helper listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        os.unlink(socket_path)
+
+
+# Client side
+
+
+class HelperClient:
+    """Persistent connection to the privileged helper"""
+
+    def __init__(self, socket_path=HELPER_SOCKET):
+        self.socket_path = socket_path
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        return os.path.exists(self.socket_path)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        self._sock = sock
+        self._file = sock.makefile("rwb")
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    def batch(self, ops):
+        """Send several (op, args) pairs in one round-trip.
+
+        Returns a list of {"ok": bool, "result"|"error": ...}. Raises OSError
+        if the helper cannot be reached.
+        """
+        request = json.dumps(
+            {"ops": [{"op": op, "args": args} for op, args in ops]}
+        ).encode()
+
+        with self._lock:
+            # Reconnect once if the helper was restarted since the last call
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._file.write(request + b"\n")
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("Helper closed the connection")
+                    break
+                except OSError:
+                    self._close()
+                    if attempt:
+                        raise
+
+        response = json.loads(line)
+        if "error" in response:
+            raise HelperError(response["error"])
+        return response["results"]
+
+    def call(self, op, **args):
+        result = self.batch([(op, args)])[0]
+        if not result["ok"]:
+            raise HelperError(result["error"])
+        return result["result"]
+
+
+client = HelperClient()
+
+
+def _use_helper():
+    return client.available()
+
+
+def _sudo(args, input=None, check=False):
+    return subprocess.run(
+        ["sudo", *args], input=input, capture_output=True, text=True, check=check
+    )
+
+
+def run(args, input=None):
+    """Run an admin command as root, returning a CompletedProcess"""
+    if args[0] in ALLOWED_COMMANDS and _use_helper():
+        try:
+            result = client.call("run", args=list(args), input=input)
+            return subprocess.CompletedProcess(
+                args, result["returncode"], result["stdout"], result["stderr"]
+            )
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    return _sudo(args, input=input)
+
+
+def read_file(path):
+    """Read a file that is only readable by root"""
+    if _use_helper():
+        try:
+            return client.call("read_file", path=path)
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    return _sudo(["cat", path], check=True).stdout
+
+
+def write_file(path, content, mode=0o644, backup=True):
+    """Replace a root-owned file, keeping a .bak copy of the old one"""
+    if _use_helper():
+        try:
+            return client.call(
+                "write_file", path=path, content=content, mode=mode, backup=backup
+            )
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+
+    if backup and os.path.exists(path):
+        try:
+            _sudo(["cp", path, f"{path}.bak"], check=True)
+            print(f"Backed up {path} to {path}.bak")
+        except Exception as e:
+            print(f"Warning: Could not backup {path}: {e}")
+
+    with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp_file:
+        temp_file.write(content)
+        temp_path = temp_file.name
+    try:
+        _sudo(["cp", temp_path, path], check=True)
+        _sudo(["chmod", format(mode, "o"), path], check=True)
+    finally:
+        os.unlink(temp_path)
+    return True
+
+
+def write_files(files, mode=0o644, backup=False):
+    """Write several {path: content} files together, in one round-trip if possible.
+
+    All files are written next to their destination first and only moved
+    into place once every one of them was written, so a failure leaves all
+    originals untouched. The final renames are atomic one by one, not as a
+    group.
+    """
+    if _use_helper():
+        try:
+            return client.call("write_files", files=files, mode=mode, backup=backup)
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+
+    staged = {}
+    try:
+        for path, content in files.items():
+            staged[path] = f"{path}.samba-manager-new"
+            write_file(staged[path], content, mode=mode, backup=False)
+    except BaseException:
+        _sudo(["rm", "-f", *staged.values()])
+        raise
+
+    for path, temp_path in staged.items():
+        if backup and os.path.exists(path):
+            _sudo(["cp", path, f"{path}.bak"], check=True)
+        _sudo(["mv", "-f", temp_path, path], check=True)
+    return True
+
+
+def remove_files(paths):
+    """Remove several root-owned files, in one round-trip if possible"""
+    paths = list(paths)
+    if not paths:
+        return True
+    if _use_helper():
+        try:
+            failed = [
+                r["error"]
+                for r in client.batch([("remove_file", {"path": p}) for p in paths])
+                if not r["ok"]
+            ]
+            if failed:
+                raise HelperError("; ".join(failed))
+            return True
+        except (OSError, HelperError) as e:
+            # rm -f skips the files the helper already removed
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    _sudo(["rm", "-f", *paths], check=True)
+    return True
+
+
+def make_dir(path, mode=0o755):
+    if _use_helper():
+        try:
+            return client.call("make_dir", path=path, mode=mode)
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    _sudo(["mkdir", "-p", path], check=True)
+    _sudo(["chmod", format(mode, "o"), path], check=True)
+    return True
+
+
+def stat_path(path):
+    """Whether a path exists, is a directory and is readable and writable as root"""
+    if _use_helper():
+        try:
+            return client.call("stat_path", path=path)
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    readable = _sudo(["test", "-r", path]).returncode == 0
+    writable = _sudo(["test", "-w", path]).returncode == 0
+    return {
+        "exists": readable or writable or os.path.exists(path),
+        "is_dir": os.path.isdir(path),
+        "readable": readable,
+        "writable": writable,
+    }
+
+
+def make_share_dir(path, owner=None):
+    """Create a share directory owned by root:smbusers, or by owner in their home.
+
+    Ownership and mode are only set on a directory this call creates.
+    Raises CalledProcessError if the directory cannot be created; failing
+    to set its owner or mode is only a warning.
+    """
+    if _use_helper():
+        try:
+            return client.call("make_share_dir", path=path, owner=owner)
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+
+    if os.path.exists(path):
+        return False
+    _sudo(["mkdir", "-p", path], check=True)
+    if owner is None:
+        owner_group, mode = "root:smbusers", "2775"
+    else:
+        owner_group, mode = f"{owner}:{owner}", "0755"
+    result = _sudo(["chown", "-R", owner_group, path])
+    if result.returncode != 0:
+        print(f"Warning: Could not set ownership to {owner_group}: {result.stderr}")
+    result = _sudo(["chmod", "-R", mode, path])
+    if result.returncode != 0:
+        print(f"Warning: Could not set permissions: {result.stderr}")
+    return True
+
+
+def remove_dirs(paths):
+    """Remove several empty share directories in order, leaving non-empty ones"""
+    paths = list(paths)
+    if not paths:
+        return True
+    if _use_helper():
+        try:
+            failed = [
+                r["error"]
+                for r in client.batch([("remove_dir", {"path": p}) for p in paths])
+                if not r["ok"]
+            ]
+            if failed:
+                raise HelperError("; ".join(failed))
+            return True
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    _sudo(["rmdir", "--ignore-fail-on-non-empty", *paths])
+    return True
+
+
+def process_name(pid):
+    """Return the command name of a process, or None if it does not exist"""
+    # /proc/<pid>/comm is world-readable, no privileges needed
+    return _process_name(pid)
+
+
+def connection_process_error(pid):
+    """Return why pid is not an smbd connection process, or None if it is"""
+    # /proc/<pid>/comm and stat are world-readable, no privileges needed
+    return _connection_process_error(pid)
+
+
+def kill_many(pids, sig="TERM"):
+    """Send SIGTERM or SIGKILL to several smbd connection processes at once.
+
+    One helper round-trip, or a single sudo kill. Returns the pids that
+    could not be signalled.
+    """
+    pids = [int(pid) for pid in pids]
+    if not pids:
+        return []
+    if _use_helper():
+        try:
+            results = client.batch([("kill", {"pid": pid, "sig": sig}) for pid in pids])
+            failed = []
+            for pid, result in zip(pids, results):
+                if not result["ok"]:
+                    error = result["error"]
+                    print(f"Privileged helper refused to signal {pid}: {error}")
+                    failed.append(pid)
+            return failed
+        except OSError as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    if _sudo(["kill", f"-{sig}", *map(str, pids)]).returncode == 0:
+        return []
+    # kill signals every pid it can and fails if any of them is gone
+    return [pid for pid in pids if _process_name(pid) is not None]
+
+
+def kill(pid, sig="TERM"):
+    """Send SIGTERM or SIGKILL to an smbd connection process"""
+    if _use_helper():
+        try:
+            return client.call("kill", pid=int(pid), sig=sig)
+        except HelperError as e:
+            print(f"Privileged helper refused to signal {pid}: {e}")
+            return False
+        except OSError as e:
+            print(f"Privileged helper failed, falling back to sudo: {e}")
+    return _sudo(["kill", f"-{sig}", str(pid)]).returncode == 0
+
+
+def smbd_processes():
+    """CPU ticks and I/O counters of every smbd connection process, by pid"""
+    if _use_helper():
+        try:
+            return client.call("smbd_processes")
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, reading /proc directly: {e}")
+    # Without the helper, /proc/<pid>/io of root's processes is only
+    # readable when running as root; CPU time is readable by everyone
+    return _read_smbd_processes()
+
+
+def samba_processes():
+    """RSS, CPU ticks, threads and open fds of every smbd and nmbd process"""
+    if _use_helper():
+        try:
+            return client.call("samba_processes")
+        except (OSError, HelperError) as e:
+            print(f"Privileged helper failed, reading /proc directly: {e}")
+    # Open fds of root's processes are only countable when running as root
+    return _read_samba_processes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Samba Manager privileged helper")
+    parser.add_argument("--socket", default=HELPER_SOCKET)
+    parser.add_argument(
+        "--uid",
+        action="append",
+        default=[],
+        help="user name or uid allowed to connect (root is always allowed)",
+    )
+    options = parser.parse_args()
+
+    allowed_uids = {0}
+    for user in options.uid:
+        allowed_uids.add(int(user) if user.isdigit() else pwd.getpwnam(user).pw_uid)
+
+    serve(options.socket, allowed_uids)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import os
+import threading
+import time
+from collections import deque
+
+from . import privileged
+from .events import broker
+
+# Seconds between two samples of the smbd and nmbd processes
+PROCESS_SAMPLE_INTERVAL = float(
+    os.environ.get("SAMBA_MANAGER_PROCESS_SAMPLE_INTERVAL", "30")
+)
+
+# Samples kept in the history, one day at the default interval
+PROCESS_HISTORY_SIZE = int(os.environ.get("SAMBA_MANAGER_PROCESS_HISTORY", "2880"))
+
+# Cleared alerts kept for display
+ALERT_HISTORY_SIZE = 100
+
+# RSS growth of a connection process is measured over this many seconds
+RSS_GROWTH_WINDOW = 3600
+
+MB = 1024 * 1024
+
+
+def _threshold(name, default):
+    return float(os.environ.get(f"SAMBA_MANAGER_ALERT_{name}", default))
+
+
+# Alert thresholds; RSS values are configured in MB
+ALERT_THRESHOLDS = {
+    "master_rss": _threshold("MASTER_RSS_MB", 1024) * MB,
+    "child_rss": _threshold("CHILD_RSS_MB", 512) * MB,
+    "child_rss_growth": _threshold("RSS_GROWTH_MB", 128) * MB,
+    "fds": _threshold("FDS", 4096),
+    "children": _threshold("CHILDREN", 2000),
+}
+
+DAEMONS = ("smbd", "nmbd")
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def _format_mb(value):
+    return f"{value / MB:.0f} MB"
+
+
+class ProcessMonitor:
+    """Resource usage of the smbd and nmbd daemons and their children.
+
+    Every sample reads RSS, CPU time, threads and open fds of each smbd and
+    nmbd process from /proc in one walk (through the privileged helper when
+    it runs) and appends a per-daemon summary to a bounded history. The
+    sample is then checked against ALERT_THRESHOLDS. An alert is printed
+    and published as an "alert" event when it fires and again when it
+    clears. Growth alerts compare a connection process's RSS with its
+    oldest RSS within RSS_GROWTH_WINDOW, to catch slow memory creep.
+    """
+
+    def __init__(
+        self, interval=PROCESS_SAMPLE_INTERVAL, history_size=PROCESS_HISTORY_SIZE
+    ):
+        self.interval = interval
+        self.thresholds = dict(ALERT_THRESHOLDS)
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._processes = []
+        self._previous = None
+        self._rss = {}
+        self._alerts = {}
+        self._cleared = deque(maxlen=ALERT_HISTORY_SIZE)
+        self._sampler = None
+
+    def sample(self):
+        processes = privileged.samba_processes()
+        now = time.time()
+        mono = time.monotonic()
+
+        # CPU percent since the previous sample, for processes seen in both
+        cpu = {}
+        if self._previous is not None:
+            then, previous = self._previous
+            elapsed = mono - then
+            for pid, stat in processes.items():
+                before = previous.get(pid)
+                if before is not None and before["start"] == stat["start"]:
+                    ticks = stat["cpu_ticks"] - before["cpu_ticks"]
+                    cpu[pid] = round(100 * ticks / CLOCK_TICKS / elapsed, 1)
+        self._previous = (mono, processes)
+
+        rows = []
+        for pid, stat in processes.items():
+            parent = processes.get(stat["ppid"])
+            rows.append(
+                {
+                    "pid": pid,
+                    "ppid": stat["ppid"],
+                    "name": stat["name"],
+                    "daemon": "nmbd" if stat["name"].startswith("nmbd") else "smbd",
+                    "role": "child" if parent is not None else "master",
+                    "rss": stat["rss"],
+                    "cpu": cpu.get(pid),
+                    "cpu_time": round(stat["cpu_ticks"] / CLOCK_TICKS, 2),
+                    "threads": stat["threads"],
+                    "fds": stat["fds"],
+                    "start": stat["start"],
+                }
+            )
+        rows.sort(key=lambda row: int(row["pid"]))
+
+        summary = {"time": now}
+        for daemon in DAEMONS:
+            masters = [
+                r for r in rows if r["daemon"] == daemon and r["role"] == "master"
+            ]
+            if not masters:
+                summary[daemon] = None
+                continue
+            master = masters[0]
+            children = [r for r in rows if r["ppid"] == master["pid"]]
+            largest = max(children, key=lambda r: r["rss"], default=None)
+            summary[daemon] = {
+                "pid": master["pid"],
+                "rss": master["rss"],
+                "cpu": master["cpu"],
+                "fds": master["fds"],
+                "threads": master["threads"],
+                "children": len(children),
+                "children_rss": sum(r["rss"] for r in children),
+                "children_cpu": round(sum(r["cpu"] or 0 for r in children), 1),
+                "max_child_rss": largest["rss"] if largest else 0,
+                "max_child_pid": largest["pid"] if largest else None,
+            }
+
+        self._track_rss(rows, now)
+        with self._lock:
+            self._processes = rows
+            self._history.append(summary)
+        self._check(rows, summary, now)
+        return summary
+
+    def _track_rss(self, rows, now):
+        """Keep RSS samples of every connection process for growth alerts"""
+        seen = {}
+        for row in rows:
+            if row["role"] != "child":
+                continue
+            key = (row["pid"], row["start"])
+            samples = self._rss.get(key) or deque()
+            samples.append((now, row["rss"]))
+            while samples[0][0] < now - RSS_GROWTH_WINDOW:
+                samples.popleft()
+            seen[key] = samples
+        # Processes that exited are forgotten
+        self._rss = seen
+
+    def _check(self, rows, summary, now):
+        """Compare a sample with the thresholds and fire or clear alerts"""
+        limits = self.thresholds
+        firing = {}
+
+        def fire(key, metric, row, value, threshold, message):
+            firing[key] = {
+                "key": key,
+                "metric": metric,
+                "pid": row["pid"] if row else None,
+                "name": row["name"] if row else None,
+                "value": value,
+                "threshold": threshold,
+                "message": message,
+            }
+
+        for row in rows:
+            pid, name = row["pid"], row["name"]
+            if row["role"] == "master" and row["rss"] > limits["master_rss"]:
+                fire(
+                    f"master_rss:{pid}",
+                    "master_rss",
+                    row,
+                    row["rss"],
+                    limits["master_rss"],
+                    f"{name} ({pid}) uses {_format_mb(row['rss'])} of memory",
+                )
+            if row["role"] == "child" and row["rss"] > limits["child_rss"]:
+                fire(
+                    f"child_rss:{pid}",
+                    "child_rss",
+                    row,
+                    row["rss"],
+                    limits["child_rss"],
+                    f"{name} child {pid} uses {_format_mb(row['rss'])} of memory",
+                )
+            if row["fds"] is not None and row["fds"] > limits["fds"]:
+                fire(
+                    f"fds:{pid}",
+                    "fds",
+                    row,
+                    row["fds"],
+                    limits["fds"],
+                    f"{name} ({pid}) has {row['fds']} open files",
+                )
+            samples = self._rss.get((pid, row["start"]))
+            if samples and len(samples) > 1:
+                growth = samples[-1][1] - samples[0][1]
+                if growth > limits["child_rss_growth"]:
+                    minutes = (samples[-1][0] - samples[0][0]) / 60
+                    fire(
+                        f"child_rss_growth:{pid}",
+                        "child_rss_growth",
+                        row,
+                        growth,
+                        limits["child_rss_growth"],
+                        f"{name} child {pid} grew by {_format_mb(growth)} "
+                        f"in {minutes:.0f} minutes",
+                    )
+
+        smbd = summary["smbd"]
+        if smbd is not None and smbd["children"] > limits["children"]:
+            fire(
+                "children",
+                "children",
+                None,
+                smbd["children"],
+                limits["children"],
+                f"smbd has {smbd['children']} child processes",
+            )
+
+        fired, cleared = [], []
+        with self._lock:
+            for key, alert in firing.items():
+                active = self._alerts.get(key)
+                if active is None:
+                    alert.update(since=now, cleared=None)
+                    self._alerts[key] = alert
+                    fired.append(alert)
+                else:
+                    active.update(value=alert["value"], message=alert["message"])
+            for key in list(self._alerts):
+                if key not in firing:
+                    alert = self._alerts.pop(key)
+                    alert["cleared"] = now
+                    self._cleared.appendleft(alert)
+                    cleared.append(alert)
+
+        for alert in fired:
+            print(f"ALERT: {alert['message']}")
+            broker.publish("alert", alert)
+        for alert in cleared:
+            print(f"Alert cleared: {alert['message']}")
+            broker.publish("alert", alert)
+
+    def alerts(self):
+        """Return the active alerts and the most recently cleared ones"""
+        with self._lock:
+            return {
+                "active": sorted(self._alerts.values(), key=lambda a: a["since"]),
+                "recent": list(self._cleared),
+            }
+
+    def current(self):
+        """The latest summary and per-process table, or None before a sample"""
+        with self._lock:
+            if not self._history:
+                return None
+            return {"summary": self._history[-1], "processes": list(self._processes)}
+
+    def history(self, since=None, limit=None):
+        """Summaries in time order, optionally only those after since"""
+        with self._lock:
+            history = [s for s in self._history if since is None or s["time"] > since]
+        return history[-limit:] if limit else history
+
+    def start(self):
+        """Start sampling in the background, if it is not running yet"""
+        with self._lock:
+            if self._sampler is not None and self._sampler.is_alive():
+                return
+            self._sampler = threading.Thread(
+                target=self._run, name="process-monitor", daemon=True
+            )
+            self._sampler.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error sampling Samba processes: {e}")
+            time.sleep(self.interval)
+
+
+monitor = ProcessMonitor()
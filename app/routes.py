@@ -1,3 +1,4 @@
+import csv
 import datetime
 import grp
 import io
@@ -8,23 +9,37 @@ import re
 import shlex
 import subprocess
 import tempfile
+import time
 
 from flask import (
     Blueprint,
+    Response,
+    current_app,
     flash,
     jsonify,
     redirect,
     render_template,
     request,
     send_file,
+    stream_with_context,
     url_for,
 )
 from flask_login import current_user, login_required
 
+from .connection_history import connection_history
+from .events import broker
+from .identity import identity
+from .jobs import scheduler
+from .locks import history as lock_history
+from .process_monitor import monitor as process_monitor
 from .samba_utils import *
+from .throughput import sampler as throughput_sampler
 
 bp = Blueprint("main", __name__)
 
+# How long form submissions wait for their share changes to be applied
+JOB_WAIT_TIMEOUT = 300
+
 
 def validate_share_name(name):
     """Validate share name for security and Samba compatibility"""
@@ -75,8 +90,12 @@ def validate_username(username):
     return True, "Valid"
 
 
-def validate_share_path(path):
-    """Enhanced path validation for security"""
+def validate_share_path(path, must_exist=True):
+    """Enhanced path validation for security
+
+    With must_exist=False a missing path is accepted, for shares whose
+    directory is created when the share is provisioned.
+    """
     if not path:
         return False, "Path cannot be empty"
 
@@ -89,7 +108,8 @@ def validate_share_path(path):
 
     # Check if path exists and is a directory
     if not os.path.exists(abs_path):
-        return False, "Path does not exist"
+        if must_exist:
+            return False, "Path does not exist"
     elif not os.path.isdir(abs_path):
         return False, "Path must be a directory"
 
@@ -116,6 +136,68 @@ def validate_share_path(path):
     return True, f"Path validated: {abs_path}"
 
 
+def _job_error(job):
+    """Return the first error message of a share job"""
+    if not job.results:
+        return "changes are still being applied"
+    return next((message for ok, message in job.results if not ok), "unknown error")
+
+
+def share_from_json(data, must_exist=True, current=None):
+    """Build a normalized share dictionary from an API request body.
+
+    current is the existing share when updating one; fields missing from
+    the body then keep their current value instead of the defaults, so an
+    update only changes what was sent.
+
+    Returns (share, error); error is None if the share is valid.
+    """
+    if not isinstance(data, dict):
+        return None, "Share must be a JSON object"
+
+    name = str(data.get("name", "")).strip()
+    valid, message = validate_share_name(name)
+    if not valid:
+        return None, f"Invalid share name: {message}"
+
+    if name in ["secure-share", "share"]:
+        return None, f'Cannot modify system share "{name}"'
+
+    current = current or {}
+
+    def value(key, default):
+        return data.get(key, current.get(key, default))
+
+    path = str(value("path", "")).strip()
+    valid, message = validate_share_path(path, must_exist)
+    if not valid:
+        return None, f"Invalid path: {message}"
+
+    def flag(key, default):
+        setting = value(key, default)
+        if isinstance(setting, str):
+            setting = setting.lower() in ("yes", "true", "1")
+        return "yes" if setting else "no"
+
+    # New shares get the same defaults as shares created from the form
+    defaults = NEW_SHARE_DEFAULTS
+    share = {
+        "name": name,
+        "path": path,
+        "comment": str(value("comment", defaults["comment"])),
+        "browseable": flag("browseable", defaults["browseable"]),
+        "read_only": flag("read_only", defaults["read_only"]),
+        "guest_ok": flag("guest_ok", defaults["guest_ok"]),
+        "valid_users": str(value("valid_users", defaults["valid_users"])),
+        "write_list": str(value("write_list", defaults["write_list"])),
+        "create_mask": str(value("create_mask", defaults["create_mask"])),
+        "directory_mask": str(value("directory_mask", defaults["directory_mask"])),
+        "force_group": current.get("force_group", SHARE_DEFAULTS["force_group"]),
+        "max_connections": str(value("max_connections", defaults["max_connections"])),
+    }
+    return share, None
+
+
 @bp.route("/")
 @login_required
 def index():
@@ -129,11 +211,17 @@ def index():
     # Add datetime for the template
     now = datetime.datetime.now()
 
+    # Resource usage and alerts of the Samba daemons, once sampled
+    processes = process_monitor.current()
+    alerts = process_monitor.alerts()["active"]
+
     return render_template(
         "index.html",
         status=status,
         has_sudo=has_sudo,
         installation_status=installation_status,
+        processes=processes["summary"] if processes else None,
+        alerts=alerts,
         now=now,
     )
 
@@ -300,11 +388,11 @@ def add_share():
         "max_connections": request.form.get("max_connections", "10"),
     }
 
-    result = add_or_update_share(share)
-    if result:
-        flash("Share added successfully and Samba service restarted", "success")
+    job = scheduler.submit([("upsert", share)])
+    if job.wait(JOB_WAIT_TIMEOUT):
+        flash("Share added successfully and Samba configuration applied", "success")
     else:
-        flash("Failed to add share", "error")
+        flash(f"Failed to add share: {_job_error(job)}", "error")
 
     return redirect("/shares")
 
@@ -382,15 +470,17 @@ def edit_share():
         "max_connections": request.form.get("max_connections", "10"),
     }
 
-    # If name was changed, delete the old share first
+    # If name was changed, delete the old share in the same batch
+    mutations = [("upsert", share)]
     if original_name != name:
-        delete_share(original_name)
+        mutations.insert(0, ("delete", original_name))
 
-    result = add_or_update_share(share)
-    if result:
-        flash("Share updated successfully and Samba service restarted", "success")
+    # A rename must not delete the old share if the new one cannot be added
+    job = scheduler.submit(mutations, atomic=True)
+    if job.wait(JOB_WAIT_TIMEOUT):
+        flash("Share updated successfully and Samba configuration applied", "success")
     else:
-        flash("Failed to update share", "error")
+        flash(f"Failed to update share: {_job_error(job)}", "error")
 
     return redirect("/shares")
 
@@ -413,11 +503,11 @@ def delete_share_route():
         )
         return redirect("/shares")
 
-    result = delete_share(share_name)
-    if result:
-        flash("Share deleted successfully and Samba service restarted", "success")
+    job = scheduler.submit([("delete", share_name)])
+    if job.wait(JOB_WAIT_TIMEOUT):
+        flash("Share deleted successfully and Samba configuration applied", "success")
     else:
-        flash("Failed to delete share", "error")
+        flash(f"Failed to delete share: {_job_error(job)}", "error")
 
     # Force a page refresh to update the UI
     return redirect("/shares")
@@ -430,17 +520,40 @@ def users():
         flash("Error: Sudo access is required to manage Samba users", "error")
         return redirect("/")
 
-    users = get_samba_users()
-    system_users = list_system_users()
-    system_groups = list_system_groups()
+    # The user table is paged in from /api/users
+    return render_template("users.html", has_sudo=check_sudo_access())
 
-    return render_template(
-        "users.html",
-        users=users,
-        system_users=system_users,
-        groups=system_groups,
-        has_sudo=check_sudo_access(),
-    )
+
+@bp.route("/api/users", methods=["GET"])
+@login_required
+def api_users():
+    """Page through Samba users.
+
+    Query parameters: q (username prefix), status (enabled/disabled), flag
+    (account flag letter), sort (username/uid/status/flags), order
+    (asc/desc), limit and cursor (next_cursor of the previous page).
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view users"}), 403
+
+    status = request.args.get("status")
+    if status not in (None, "", "enabled", "disabled"):
+        return jsonify({"error": f"Invalid status: {status}"}), 400
+
+    try:
+        users, next_cursor, total = get_samba_user_index().query(
+            prefix=request.args.get("q", ""),
+            enabled=None if not status else status == "enabled",
+            flag=request.args.get("flag") or None,
+            sort=request.args.get("sort", "username"),
+            descending=request.args.get("order") == "desc",
+            cursor=request.args.get("cursor") or None,
+            limit=request.args.get("limit", 50),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"users": users, "next_cursor": next_cursor, "total": total})
 
 
 @bp.route("/users/add", methods=["POST"])
@@ -468,6 +581,131 @@ def add_user():
     return redirect("/users")
 
 
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def _import_records(text, fmt):
+    """Yield (line, record) from CSV (with a header row) or NDJSON text"""
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line, raw in enumerate(text.splitlines(), 1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except json.JSONDecodeError as e:
+            yield line, f"Invalid JSON: {e}"
+            continue
+        yield line, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+def parse_user_import(text, fmt, create_system_user=False):
+    """Yield (line, row, error) for every user in a bulk import"""
+    seen = set()
+    for line, record in _import_records(text, fmt):
+        if isinstance(record, str):
+            yield line, None, record
+            continue
+
+        username = str(record.get("username") or "").strip()
+        password = str(record.get("password") or "")
+        groups = record.get("groups") or []
+        if isinstance(groups, str):
+            groups = re.split(r"[\s;]+", groups.strip())
+        groups = [str(group) for group in groups if group]
+        create = record.get("create_system_user", create_system_user)
+        if isinstance(create, str):
+            create = create.strip().lower() in TRUE_VALUES
+
+        valid, message = validate_username(username)
+        if not valid:
+            error = message
+        elif username in seen:
+            error = f"User {username} appears more than once"
+        elif not password:
+            error = "Password is required"
+        elif "\n" in password or "\r" in password:
+            error = "Password cannot contain line breaks"
+        else:
+            invalid = [g for g in groups if not re.match(r"^[a-z][\w-]*$", g)]
+            error = f"Invalid group name: {invalid[0]}" if invalid else None
+
+        seen.add(username)
+        row = {
+            "username": username,
+            "password": password,
+            "groups": groups,
+            "create_system_user": bool(create),
+        }
+        yield line, row, error
+
+
+@bp.route("/api/users/import", methods=["POST"])
+@login_required
+def api_import_users():
+    """Bulk-add Samba users from CSV or NDJSON, streaming NDJSON results.
+
+    CSV needs a header with username and password columns, and optionally
+    groups (separated by spaces or semicolons) and create_system_user. The
+    body can be sent raw or as a "file" upload; ?format=csv|ndjson overrides
+    detection and ?create_system_user=1 sets the default for every row.
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to manage Samba users"}), 403
+
+    upload = request.files.get("file")
+    if upload is not None:
+        text = upload.read().decode("utf-8-sig")
+    else:
+        text = request.get_data(as_text=True)
+    if not text.strip():
+        return jsonify({"error": "No users given"}), 400
+
+    fmt = request.args.get("format")
+    if fmt is None:
+        fmt = "ndjson" if text.lstrip().startswith("{") else "csv"
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": f"Unknown format: {fmt}"}), 400
+    create_system_user = request.args.get("create_system_user", "") in TRUE_VALUES
+
+    def results():
+        lines = {}
+        rows = []
+        failed = 0
+        # Rows that cannot be parsed are reported before anything is changed
+        for line, row, error in parse_user_import(text, fmt, create_system_user):
+            username = row["username"] if row else None
+            if error:
+                failed += 1
+                result = {"line": line, "username": username, "success": False}
+                yield json.dumps(dict(result, message=error)) + "\n"
+            else:
+                lines[username] = line
+                rows.append(row)
+
+        imported = 0
+        for row, success, message in import_samba_users(rows):
+            if success:
+                imported += 1
+            else:
+                failed += 1
+            result = {
+                "line": lines[row["username"]],
+                "username": row["username"],
+                "success": success,
+                "message": message,
+            }
+            yield json.dumps(result) + "\n"
+
+        yield json.dumps({"done": True, "imported": imported, "failed": failed}) + "\n"
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+
 @bp.route("/users/reset-password/<username>", methods=["POST"])
 @login_required
 def reset_samba_password(username):
@@ -541,6 +779,7 @@ def disable_samba_user(username):
             text=True,
             check=False,
         )
+        invalidate_samba_users()
 
         if result.returncode != 0:
             error_msg = result.stderr.strip()
@@ -590,6 +829,7 @@ def enable_samba_user(username):
             text=True,
             check=False,
         )
+        invalidate_samba_users()
 
         if result.returncode != 0:
             flash(f"Failed to enable user: {result.stderr}", "error")
@@ -602,6 +842,20 @@ def enable_samba_user(username):
     return redirect("/users")
 
 
+def remove_references_job(kind, name):
+    """Strip a deleted user or group from every share and flash the outcome"""
+    job = scheduler.submit([("unreference", (kind, name))])
+    job.wait(JOB_WAIT_TIMEOUT)
+    if not job.results:
+        flash(f"Share references to {name} are still being removed", "info")
+    elif job.success:
+        flash(job.results[0][1], "success")
+    else:
+        flash(
+            f"Failed to remove share references to {name}: {_job_error(job)}", "error"
+        )
+
+
 @bp.route("/users/delete/<username>", methods=["POST"])
 @login_required
 def delete_samba_user(username):
@@ -632,11 +886,14 @@ def delete_samba_user(username):
             text=True,
             check=False,
         )
+        invalidate_samba_users()
 
         if result.returncode != 0:
             flash(f"Failed to delete user: {result.stderr}", "error")
         else:
             flash(f"User {username} deleted successfully", "success")
+            if request.form.get("remove_references") == "on":
+                remove_references_job("user", username)
 
     except Exception as e:
         flash(f"Error: {str(e)}", "error")
@@ -687,6 +944,8 @@ def import_conf():
         return redirect("/maintenance")
 
     try:
+        previous = get_samba_config()
+
         # Create a temporary file to store the uploaded content
         with tempfile.NamedTemporaryFile(delete=False) as temp_file:
             file.save(temp_file.name)
@@ -718,6 +977,7 @@ def import_conf():
                 subprocess.run(
                     ["sudo", "cp", temp_file.name, "/etc/samba/smb.conf"], check=False
                 )
+                invalidate_samba_config()
 
                 # Validate the configuration
                 validate_cmd = subprocess.run(
@@ -732,12 +992,11 @@ def import_conf():
                     subprocess.run(
                         ["sudo", "cp", backup_path, "/etc/samba/smb.conf"], check=False
                     )
+                    invalidate_samba_config()
                     flash(f"Invalid configuration file: {validate_cmd.stderr}", "error")
                 else:
-                    # Restart Samba services
-                    subprocess.run(
-                        ["sudo", "systemctl", "restart", "smbd", "nmbd"], check=False
-                    )
+                    # Reload or restart Samba depending on what changed
+                    apply_samba_config(previous)
                     flash("Configuration file imported successfully", "success")
 
             # Clean up the temporary file
@@ -968,6 +1227,8 @@ def edit_config():
     share_file = SHARE_CONF
 
     if request.method == "POST":
+        previous = get_samba_config(config_file, share_file)
+
         if "main_config" in request.form:
             try:
                 # Create a temporary file
@@ -1010,11 +1271,13 @@ def edit_config():
             except Exception as e:
                 flash(f"Error updating share configuration: {str(e)}", "error")
 
-        # Restart Samba service after config changes
-        if restart_samba_service():
-            flash("Samba service restarted successfully", "success")
+        invalidate_samba_config()
+
+        # Apply the changes, reloading instead of restarting where possible
+        if apply_samba_config(previous):
+            flash("Samba configuration applied successfully", "success")
         else:
-            flash("Failed to restart Samba service", "error")
+            flash("Failed to apply Samba configuration", "error")
 
         return redirect("/edit-config")
 
@@ -1023,26 +1286,11 @@ def edit_config():
     share_config = ""
 
     try:
-        if os.path.exists(config_file):
-            result = subprocess.run(
-                ["sudo", "cat", config_file], capture_output=True, text=True, check=True
-            )
-            main_config = result.stdout
-    except subprocess.CalledProcessError as e:
-        flash(f"Error reading main configuration: {e.stderr}", "error")
+        config = get_samba_config(config_file, share_file)
+        main_config = config.main_content
+        share_config = config.shares_content
     except Exception as e:
-        flash(f"Error reading main configuration: {str(e)}", "error")
-
-    try:
-        if os.path.exists(share_file):
-            result = subprocess.run(
-                ["sudo", "cat", share_file], capture_output=True, text=True, check=True
-            )
-            share_config = result.stdout
-    except subprocess.CalledProcessError as e:
-        flash(f"Error reading share configuration: {e.stderr}", "error")
-    except Exception as e:
-        flash(f"Error reading share configuration: {str(e)}", "error")
+        flash(f"Error reading configuration: {str(e)}", "error")
 
     return render_template(
         "edit_config.html",
@@ -1124,31 +1372,11 @@ def service_action(action):
             return jsonify(status)
         elif action == "enable":
             # Enable Samba services (only enable what's available)
-            services_to_enable = []
-            for service in ["smbd", "nmbd"]:
-                # Try systemctl first, then service command
-                try:
-                    check_result = subprocess.run(
-                        ["systemctl", "list-units", "--type=service", f"{service}.service"],
-                        capture_output=True,
-                        text=True,
-                        check=False,
-                    )
-                    if check_result.returncode == 0 and service in check_result.stdout:
-                        services_to_enable.append(service)
-                except Exception:
-                    # Fallback to service command check
-                    try:
-                        check_result = subprocess.run(
-                            ["service", service, "status"],
-                            capture_output=True,
-                            text=True,
-                            check=False,
-                        )
-                        if check_result.returncode == 0:
-                            services_to_enable.append(service)
-                    except Exception:
-                        pass
+            services_to_enable = [
+                service
+                for service in ["smbd", "nmbd"]
+                if current_app.capabilities.has(service)
+            ]
             
             if services_to_enable:
                 # Try systemctl first, then service command
@@ -1170,6 +1398,8 @@ def service_action(action):
         else:
             # Try systemctl first, fallback to service command
             try:
+                if current_app.capabilities.init_system not in ("systemd", None):
+                    raise Exception("systemd is not running")
                 result = subprocess.run(
                     ["systemctl", action, "smbd", "nmbd"],
                     capture_output=True,
@@ -1290,15 +1520,12 @@ def delete_group(group_name):
 
     if result:
         flash(f"Group {group_name} deleted successfully", "success")
+        if request.form.get("remove_references") == "on":
+            remove_references_job("group", group_name)
     else:
         # Check if it's a primary group issue
         try:
-            import pwd
-
-            primary_users = []
-            for user in pwd.getpwall():
-                if user.pw_gid == grp.getgrnam(group_name).gr_gid:
-                    primary_users.append(user.pw_name)
+            primary_users = identity.primary_members(group_name)
 
             if primary_users:
                 flash(
@@ -1349,6 +1576,165 @@ def api_shares():
     return jsonify(shares_json)
 
 
+@bp.route("/api/shares", methods=["POST"])
+@login_required
+def api_save_share():
+    """Queue adding or updating a share, returning the id of the apply job"""
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to modify shares"}), 403
+
+    data = request.get_json(silent=True)
+    name = str(data.get("name", "")).strip() if isinstance(data, dict) else ""
+    current = next((s for s in load_shares() if s["name"] == name), None)
+    share, error = share_from_json(data, current=current)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+
+    job = scheduler.submit([("upsert", share)])
+    return jsonify({"success": True, "job_id": job.id}), 202
+
+
+@bp.route("/api/shares/<name>", methods=["DELETE"])
+@login_required
+def api_delete_share(name):
+    """Queue deleting a share, returning the id of the apply job"""
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to modify shares"}), 403
+
+    if name in ["secure-share", "share"]:
+        return (
+            jsonify(
+                {"success": False, "error": f'Cannot delete system share "{name}"'}
+            ),
+            400,
+        )
+
+    job = scheduler.submit([("delete", name)])
+    return jsonify({"success": True, "job_id": job.id}), 202
+
+
+@bp.route("/api/shares/batch", methods=["POST"])
+@login_required
+def api_share_batch():
+    """Create, update and delete many shares with one write and one reload.
+
+    The body is {"operations": [{"action": "create"|"update"|"delete", ...}]},
+    where create carries the share fields, update only the fields to change
+    and delete only a name. {"shares": [...]} is accepted as a list of
+    creates or updates. Every operation is validated before anything is
+    applied, and the batch is applied all or nothing: if one operation
+    fails, e.g. because its directory cannot be created, none is written
+    and the directories created for the others are removed again.
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to modify shares"}), 403
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "error": "Body must be a JSON object"}), 400
+    operations = data.get("operations")
+    if operations is None:
+        operations = [
+            dict(share, action="upsert") if isinstance(share, dict) else share
+            for share in data.get("shares", [])
+        ]
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"success": False, "error": "No operations given"}), 400
+
+    existing = {share["name"]: share for share in load_shares()}
+    seen = set()
+    mutations = []
+    errors = []
+
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            errors.append({"index": index, "error": "Operation must be an object"})
+            continue
+
+        action = operation.get("action", "upsert")
+        name = str(operation.get("name", "")).strip()
+        error = None
+
+        if name in seen:
+            error = f"Share '{name}' appears more than once"
+        elif action == "delete":
+            if name in ["secure-share", "share"]:
+                error = f'Cannot delete system share "{name}"'
+            elif name not in existing:
+                error = f"Share '{name}' not found"
+            else:
+                mutations.append(("delete", name))
+        elif action in ("create", "update", "upsert"):
+            # Updates of existing shares only change the fields that were sent
+            current = existing.get(name) if action != "create" else None
+            share, error = share_from_json(operation, False, current)
+            if error is None:
+                if action == "create" and name in existing:
+                    error = f'A share with the name "{name}" already exists'
+                elif action == "update" and name not in existing:
+                    error = f"Share '{name}' not found"
+                else:
+                    mutations.append(("upsert", share))
+        else:
+            error = f"Unknown action: {action}"
+
+        seen.add(name)
+        if error:
+            errors.append({"index": index, "name": name, "error": error})
+
+    if errors:
+        return jsonify({"success": False, "errors": errors}), 400
+
+    # Nothing is written if any operation fails, e.g. to provision its path
+    job = scheduler.submit(mutations, atomic=True)
+    if request.args.get("wait") in ("1", "true", "yes"):
+        job.wait(JOB_WAIT_TIMEOUT)
+        return jsonify(job.to_dict()), 200 if job.success else 500
+
+    return jsonify({"success": True, "job_id": job.id}), 202
+
+
+@bp.route("/api/access-matrix", methods=["GET"])
+@login_required
+def api_access_matrix():
+    """Which Samba users can read and write which shares.
+
+    ?user=<name> returns the shares of one user and ?share=<name> the
+    readers and writers of one share. Without either, every share carries
+    read and write masks as hex numbers where bit i stands for users[i].
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view share access"}), 403
+
+    matrix = get_access_matrix()
+
+    username = request.args.get("user")
+    if username:
+        shares = matrix.for_user(username)
+        if shares is None:
+            return jsonify({"error": f"Samba user '{username}' not found"}), 404
+        return jsonify({"user": username, "shares": shares})
+
+    share_name = request.args.get("share")
+    if share_name:
+        share = matrix.for_share(share_name)
+        if share is None:
+            return jsonify({"error": f"Share '{share_name}' not found"}), 404
+        return jsonify(share)
+
+    return jsonify(matrix.to_dict())
+
+
+@bp.route("/api/jobs/<job_id>", methods=["GET"])
+@login_required
+def api_job_status(job_id):
+    """Status and per-mutation results of a share apply job"""
+    job = scheduler.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
 @bp.route("/api/status", methods=["GET"])
 @login_required
 def api_status():
@@ -1368,6 +1754,180 @@ def api_connections():
     return jsonify(connections)
 
 
+@bp.route("/api/locks", methods=["GET"])
+@login_required
+def api_locks():
+    """Open and locked files of the current smbstatus snapshot.
+
+    Filters: share (name or path), path (full path of the file), pid and
+    user are exact matches; q is a substring of the path, user or machine.
+    At most limit records are returned, total counts every match.
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view locked files"}), 403
+    lock_history.start()
+
+    try:
+        limit = max(1, min(int(request.args.get("limit", 500)), 5000))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+
+    index = get_lock_index()
+    locks = index.search(
+        q=request.args.get("q"),
+        share=request.args.get("share"),
+        path=request.args.get("path"),
+        pid=request.args.get("pid"),
+        user=request.args.get("user"),
+    )
+    return jsonify(
+        {"locks": locks[:limit], "total": len(locks), "taken_at": index.taken_at}
+    )
+
+
+@bp.route("/api/locks/hot", methods=["GET"])
+@login_required
+def api_hot_files():
+    """Files ranked by contention over the last window seconds (default 1h).
+
+    sort is opens (most concurrent opens), clients, breaks (inferred oplock
+    breaks) or denied (opens with a deny mode).
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view locked files"}), 403
+    lock_history.start()
+
+    try:
+        window = float(request.args.get("window", 3600))
+        limit = max(1, min(int(request.args.get("limit", 20)), 500))
+        ranking = lock_history.hot_files(
+            window=window, sort=request.args.get("sort", "opens"), limit=limit
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(ranking)
+
+
+@bp.route("/api/connections/history", methods=["GET"])
+@login_required
+def api_connection_history():
+    """Session and connection counts over time.
+
+    Query parameters: dimension (total/share/user/client/protocol/
+    encryption), metric (sessions/connections), resolution (minute/hour/
+    day, chosen from the range by default), since and until (unix times)
+    or range (seconds before until, default one day), and limit (number
+    of values, highest peak first).
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view connections"}), 403
+    connection_history.start()
+
+    try:
+        until = request.args.get("until", type=float)
+        since = request.args.get("since", type=float)
+        if since is None and request.args.get("range"):
+            since = (until or time.time()) - float(request.args["range"])
+        history = connection_history.query(
+            dimension=request.args.get("dimension", "share"),
+            metric=request.args.get("metric", "connections"),
+            resolution=request.args.get("resolution") or None,
+            since=since,
+            until=until,
+            limit=max(1, min(int(request.args.get("limit", 20)), 200)),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(history)
+
+
+@bp.route("/api/connections/top", methods=["GET"])
+@login_required
+def api_top_talkers():
+    """Sessions, clients, users or shares ranked by throughput.
+
+    group is session, client, user or share; sort is disk, disk_read,
+    disk_write, io or cpu. Rates are bytes per second and CPU percent over
+    the last sampling interval; the first request starts the sampler.
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view connections"}), 403
+
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), 500))
+        top = throughput_sampler.top(
+            group=request.args.get("group", "session"),
+            sort=request.args.get("sort", "disk"),
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(top)
+
+
+@bp.route("/api/processes", methods=["GET"])
+@login_required
+def api_processes():
+    """Memory, CPU, open fds, threads and children of smbd and nmbd.
+
+    Returns the latest sample with one row per process, the per-daemon
+    history (since a unix time, if given), the active and recently cleared
+    alerts, and the alert thresholds. RSS values are bytes and CPU is the
+    percent of one CPU over the last sampling interval.
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view processes"}), 403
+
+    process_monitor.start()
+
+    limit = request.args.get("limit", type=int)
+    history = process_monitor.history(
+        since=request.args.get("since", type=float),
+        limit=max(1, limit) if limit else None,
+    )
+    return jsonify(
+        {
+            "current": process_monitor.current(),
+            "history": history,
+            "alerts": process_monitor.alerts(),
+            "thresholds": process_monitor.thresholds,
+            "interval": process_monitor.interval,
+        }
+    )
+
+
+@bp.route("/api/events", methods=["GET"])
+@login_required
+def api_events():
+    """Server-Sent Events stream of connection, service and job changes.
+
+    The first event is a "snapshot" of the current sessions, connections and
+    service state; after that only changes are sent: session_opened,
+    session_closed, connection_opened, connection_closed, service and job.
+    A "sampler_error" event reports that sampling failed; it is retried with
+    backoff.
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to view connections"}), 403
+
+    subscription = broker.subscribe()
+
+    def stream():
+        try:
+            while not subscription.closed:
+                message = subscription.get()
+                # A comment line keeps proxies from closing an idle stream
+                yield message if message is not None else ": keepalive\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @bp.route("/api/disk-usage", methods=["GET"])
 @login_required
 def api_disk_usage():
@@ -1495,6 +2055,41 @@ def connections():
     return render_template("connections.html", has_sudo=check_sudo_access())
 
 
+@bp.route("/api/connections/terminate", methods=["POST"])
+@login_required
+def api_terminate_connections():
+    """Terminate many connections at once.
+
+    JSON body with any of pids, machines (names, addresses or networks such
+    as 10.1.2.0/24), users and shares, each a list. Every connection
+    matching at least one of them is terminated.
+    """
+    if not check_sudo_access():
+        return jsonify({"error": "Sudo access required to terminate connections"}), 403
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        message = "Body must be a JSON object"
+        return jsonify({"success": False, "message": message}), 400
+    selectors = {}
+    for key in ("pids", "machines", "users", "shares"):
+        values = data.get(key) or []
+        if not isinstance(values, list):
+            return jsonify({"success": False, "message": f"{key} must be a list"}), 400
+        selectors[key] = [str(value).strip() for value in values if str(value).strip()]
+
+    invalid = [pid for pid in selectors["pids"] if not pid.isdigit() or int(pid) <= 0]
+    if invalid:
+        message = f"Invalid PIDs: {', '.join(invalid)}"
+        return jsonify({"success": False, "message": message}), 400
+    if not any(selectors.values()):
+        message = "Provide pids, machines, users or shares to terminate"
+        return jsonify({"success": False, "message": message}), 400
+
+    success, report = terminate_connections(**selectors)
+    return jsonify({"success": success, **report})
+
+
 @bp.route("/api/connections/terminate/<pid>", methods=["POST"])
 @login_required
 def api_terminate_connection(pid):
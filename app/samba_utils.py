@@ -3,9 +3,34 @@ import os
 import pwd
 import re
 import shlex
+import shutil
 import subprocess
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from zlib import crc32 as zlib_crc32
+
+from . import privileged, smbstatus
+from .access import (
+    PRINCIPAL_KEYS,
+    AccessMatrix,
+    access_settings,
+    build_reference_index,
+    strip_principal,
+)
+from .capabilities import capabilities
+from .identity import identity
+from .locks import LockIndex
+from .passdb import (
+    PASSDB_TDB,
+    format_smbpasswd,
+    parse_smbpasswd,
+    read_passdb_tdb,
+)
+from .smbconf import ConfigDocument, Section, normalize_key
+from .user_index import UserIndex
 
 # Use local configuration files for development
 DEV_MODE = (
@@ -15,12 +40,26 @@ DEV_MODE = (
 if DEV_MODE:
     SMB_CONF = "./smb.conf"
     SHARE_CONF = "./shares.conf"
+    SHARE_FRAGMENT_DIR = "./shares.d"
     ACTUAL_SMB_CONF = "/etc/samba/smb.conf"  # Actual Samba config file
 else:
     SMB_CONF = "/etc/samba/smb.conf"
     SHARE_CONF = "/etc/samba/shares.conf"
+    SHARE_FRAGMENT_DIR = "/etc/samba/shares.d"
     ACTUAL_SMB_CONF = SMB_CONF
 
+# Where share definitions are stored:
+#   "file"      - all shares in SHARE_CONF (default)
+#   "fragments" - one file per share in SHARE_FRAGMENT_DIR, with SHARE_CONF
+#                 holding the generated list of includes
+#   "registry"  - shares in the Samba registry, managed with "net conf"
+SHARE_BACKEND = os.environ.get("SAMBA_MANAGER_SHARE_BACKEND", "file")
+
+# Samba registry database, only used to detect changes to registry shares
+REGISTRY_TDB = os.environ.get(
+    "SAMBA_MANAGER_REGISTRY_TDB", "/var/lib/samba/registry.tdb"
+)
+
 
 def parse_share_section(content):
     """Parse share sections from a Samba configuration file content"""
@@ -59,30 +98,557 @@ def parse_share_section(content):
 
 def parse_config_content(content):
     """Parse Samba configuration content into sections"""
-    sections = {}
-    current_section = None
+    return ConfigDocument.parse(content).to_dict()
+
+
+# Sections in the main config that are not regular file shares
+SPECIAL_SECTIONS = ["global", "printers", "print$"]
+
+# Map Samba config keys to our normalized share keys
+SHARE_KEY_MAPPING = {
+    "path": "path",
+    "comment": "comment",
+    "browseable": "browseable",
+    "browsable": "browseable",  # Alternative spelling
+    "read only": "read_only",
+    "guest ok": "guest_ok",
+    "valid users": "valid_users",
+    "write list": "write_list",
+    "create mask": "create_mask",
+    "directory mask": "directory_mask",
+    "force group": "force_group",
+    "max connections": "max_connections",
+}
+
+# Default values for normalized share keys missing from the config
+SHARE_DEFAULTS = {
+    "path": "/tmp",
+    "comment": "",
+    "browseable": "yes",
+    "read_only": "no",
+    "guest_ok": "no",
+    "valid_users": "",
+    "write_list": "",
+    "create_mask": "0775",
+    "directory_mask": "0775",
+    "force_group": "smbusers",
+    "max_connections": "0",
+}
+
+# Default values for the global settings shown in the UI
+DEFAULT_GLOBAL_SETTINGS = {
+    "server_string": "Samba Server",
+    "workgroup": "WORKGROUP",
+    "log_level": "1",
+    "server_role": "standalone",
+    "log_file": "/var/log/samba/log.%m",
+    "max_log_size": "1000",
+    "security": "user",
+    "encrypt_passwords": "yes",
+    "guest_account": "nobody",
+    "map_to_guest": "Bad User",
+    "interfaces": "",
+    "bind_interfaces_only": "no",
+    "hosts_allow": "",
+    "hosts_deny": "",
+    "unix_charset": "UTF-8",
+    "dos_charset": "CP850",
+    "deadtime": "15",
+    "keepalive": "300",
+    "max_connections": "0",
+    "socket_options": "TCP_NODELAY IPTOS_LOWDELAY",
+    "dns_proxy": "no",
+    "usershare_allow_guests": "yes",
+}
+
+# Define mappings between our keys and Samba config keys
+GLOBAL_SETTING_PATTERNS = {
+    "server_string": r"server string\s*=\s*(.*)",
+    "workgroup": r"workgroup\s*=\s*(.*)",
+    "log_level": r"log level\s*=\s*(.*)",
+    "server_role": r"server role\s*=\s*(.*)",
+    "log_file": r"log file\s*=\s*(.*)",
+    "max_log_size": r"max log size\s*=\s*(.*)",
+    "security": r"security\s*=\s*(.*)",
+    "encrypt_passwords": r"encrypt passwords\s*=\s*(.*)",
+    "guest_account": r"guest account\s*=\s*(.*)",
+    "map_to_guest": r"map to guest\s*=\s*(.*)",
+    "interfaces": r"interfaces\s*=\s*(.*)",
+    "bind_interfaces_only": r"bind interfaces only\s*=\s*(.*)",
+    "hosts_allow": r"hosts allow\s*=\s*(.*)",
+    "hosts_deny": r"hosts deny\s*=\s*(.*)",
+    "unix_charset": r"unix charset\s*=\s*(.*)",
+    "dos_charset": r"dos charset\s*=\s*(.*)",
+    "deadtime": r"deadtime\s*=\s*(.*)",
+    "keepalive": r"keepalive\s*=\s*(.*)",
+    "max_connections": r"max connections\s*=\s*(.*)",
+    "socket_options": r"socket options\s*=\s*(.*)",
+    "dns_proxy": r"dns proxy\s*=\s*(.*)",
+    "usershare_allow_guests": r"usershare allow guests\s*=\s*(.*)",
+}
+
+
+def _config_file_signature(path):
+    """Return the (inode, mtime, size) of a config file, or None if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
-    for line in content.split("\n"):
-        line = line.strip()
 
-        # Skip empty lines and comments
-        if not line or line.startswith("#") or line.startswith(";"):
+def _read_config_file(path):
+    """Read a config file, falling back to sudo when it is not readable"""
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+    except PermissionError:
+        try:
+            return privileged.read_file(path)
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+            return ""
+
+
+def _normalize_share(name, section, share=None):
+    """Copy the known keys of a config section into a normalized share dictionary"""
+    if share is None:
+        share = {"name": name}
+
+    for samba_key, our_key in SHARE_KEY_MAPPING.items():
+        if samba_key in section:
+            share[our_key] = section[samba_key]
+
+    return share
+
+
+def _build_shares(main_sections, share_sections):
+    """Build the normalized share list from the parsed main and shares configs"""
+    shares = []
+    shares_by_name = {}
+
+    for name, section in main_sections.items():
+        # Skip non-share sections and special shares
+        if name in SPECIAL_SECTIONS:
             continue
 
-        # Check for section headers
-        if line.startswith("[") and line.endswith("]"):
-            section_name = line[1:-1].strip()
-            current_section = {}
-            sections[section_name] = current_section
+        share = _normalize_share(name, section)
+        for key, value in SHARE_DEFAULTS.items():
+            share.setdefault(key, value)
 
-        # Check for parameters
-        elif "=" in line and current_section is not None:
-            parts = line.split("=", 1)
-            param_name = parts[0].strip()
-            param_value = parts[1].strip()
-            current_section[param_name] = param_value
+        shares.append(share)
+        shares_by_name[name] = share
 
-    return sections
+    for name, section in share_sections.items():
+        # Skip non-share sections
+        if name == "global":
+            continue
+
+        # Shares in the shares config override those from the main config
+        existing_share = shares_by_name.get(name)
+        if existing_share:
+            print(
+                f"Share {name} already exists from main config, updating from shares config"
+            )
+            _normalize_share(name, section, existing_share)
+            continue
+
+        share = _normalize_share(name, section)
+        for key, value in SHARE_DEFAULTS.items():
+            share.setdefault(key, value)
+
+        shares.append(share)
+        shares_by_name[name] = share
+
+    for share in shares:
+        _derive_share_lists(share)
+
+    return shares
+
+
+def _derive_share_lists(share):
+    """Add the merged valid_users and the user and group lists shown in the UI"""
+    # Make sure all write_list users are in valid_users
+    if share.get("write_list") and not share.get("valid_users"):
+        share["valid_users"] = share["write_list"]
+    elif share.get("write_list") and share.get("valid_users"):
+        valid_users_set = set(
+            user.strip() for user in share["valid_users"].split(",") if user.strip()
+        )
+        write_list_set = set(
+            user.strip() for user in share["write_list"].split(",") if user.strip()
+        )
+
+        # If there are users in write_list not in valid_users, add them
+        missing_users = write_list_set - valid_users_set
+        if missing_users:
+            share["valid_users"] += "," + ",".join(sorted(missing_users))
+
+    # Parse and store user and group lists separately for UI display
+    if "valid_users" in share:
+        users, groups = parse_user_group_list(share["valid_users"])
+        share["valid_users_list"] = users
+        share["valid_groups_list"] = groups
+
+    if "write_list" in share:
+        users, groups = parse_user_group_list(share["write_list"])
+        share["write_users_list"] = users
+        share["write_groups_list"] = groups
+
+    return share
+
+
+def share_from_section(section):
+    """Return the normalized share that load_shares builds from one section"""
+    share = _normalize_share(section.name, section.to_dict())
+    for key, value in SHARE_DEFAULTS.items():
+        share.setdefault(key, value)
+    return _derive_share_lists(share)
+
+
+def _extract_global_settings(content):
+    """Extract the UI global settings from the main config content"""
+    settings = dict(DEFAULT_GLOBAL_SETTINGS)
+
+    for key, pattern in GLOBAL_SETTING_PATTERNS.items():
+        match = re.search(pattern, content)
+        if match:
+            settings[key] = match.group(1).strip()
+
+    return settings
+
+
+class SambaConfig:
+    """Parsed snapshot of the main Samba config and the shares config.
+
+    Instances are immutable once built; get_samba_config() hands out the
+    same instance until one of the underlying files changes on disk.
+    """
+
+    def __init__(self, main_path, shares_path, signature):
+        self.main_path = main_path
+        self.shares_path = shares_path
+        self.signature = signature
+
+        self.main_content = _read_config_file(main_path) if signature[0] else ""
+        self.shares_content = _read_config_file(shares_path) if signature[1] else ""
+
+        self.main_doc = ConfigDocument.parse(self.main_content)
+        self.shares_doc = ConfigDocument.parse(self.shares_content)
+
+        # Share fragments are included from the shares config
+        self.fragment_sections = {}
+        if signature[2]:
+            sections = list(self.shares_doc.sections)
+            for path, fragment_signature in signature[2]:
+                for section in _load_share_fragment(path, fragment_signature).sections:
+                    self.fragment_sections[section.name] = path
+                    sections.append(section)
+            self.shares_doc = ConfigDocument(self.shares_doc.preamble, sections)
+
+        # Registry shares are listed with "net conf" instead of read from a file
+        self.registry_doc = ConfigDocument()
+        if signature[3]:
+            self.registry_doc = ConfigDocument.parse(_read_registry_config())
+            sections = [s for s in self.registry_doc.sections if s.name != "global"]
+            self.shares_doc = ConfigDocument(
+                self.shares_doc.preamble, self.shares_doc.sections + sections
+            )
+
+        self.main_sections = self.main_doc.to_dict()
+        self.share_sections = self.shares_doc.to_dict()
+
+        self.shares = _build_shares(self.main_sections, self.share_sections)
+        self.global_settings = _extract_global_settings(self.main_content)
+
+        print(
+            f"Parsed Samba configuration ({main_path}, {shares_path}): {len(self.shares)} shares"
+        )
+
+
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+
+
+def get_samba_config(main_path=None, shares_path=None):
+    """Return the parsed Samba configuration.
+
+    The result is cached per pair of files and keyed on the (inode, mtime,
+    size) of both, so the files are only re-read and re-parsed when they
+    change on disk, including edits made outside of Samba Manager.
+    """
+    main_path = main_path or SMB_CONF
+    shares_path = shares_path or SHARE_CONF
+    key = (main_path, shares_path)
+    signature = (
+        _config_file_signature(main_path),
+        _config_file_signature(shares_path),
+        _fragment_signatures() if shares_path == SHARE_CONF else None,
+        _registry_signature() if shares_path == SHARE_CONF else None,
+    )
+
+    with _config_cache_lock:
+        config = _config_cache.get(key)
+        if config is None or config.signature != signature:
+            config = SambaConfig(main_path, shares_path, signature)
+            _config_cache[key] = config
+        return config
+
+
+def invalidate_samba_config():
+    """Drop all cached configuration so the next reader re-parses the files"""
+    with _config_cache_lock:
+        _config_cache.clear()
+
+
+# Parsed share fragments, keyed by path and validated by file signature
+_fragment_cache = {}
+_fragment_index_lock = threading.Lock()
+
+
+def share_fragment_path(name):
+    """Return the fragment file that holds the definition of a share"""
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+    if safe_name != name:
+        # Keep names that only differ in unsafe characters apart
+        safe_name += "-" + format(zlib_crc32(name.encode()), "08x")
+    return os.path.join(SHARE_FRAGMENT_DIR, f"{safe_name}.conf")
+
+
+def _fragment_signatures():
+    """Return ((path, signature), ...) for every share fragment, sorted by path"""
+    if SHARE_BACKEND != "fragments":
+        return None
+
+    signatures = []
+    try:
+        with os.scandir(SHARE_FRAGMENT_DIR) as entries:
+            for entry in entries:
+                if entry.name.endswith(".conf") and entry.is_file():
+                    st = entry.stat()
+                    signatures.append(
+                        (entry.path, (st.st_ino, st.st_mtime_ns, st.st_size))
+                    )
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Error listing share fragments in {SHARE_FRAGMENT_DIR}: {e}")
+
+    return tuple(sorted(signatures))
+
+
+def _load_share_fragment(path, signature):
+    """Return the parsed document of a share fragment, re-reading it only if it changed"""
+    cached = _fragment_cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    document = ConfigDocument.parse(_read_config_file(path))
+    _fragment_cache[path] = (signature, document)
+    return document
+
+
+def _write_fragment_index():
+    """Regenerate the shares config as the list of includes for all fragments"""
+    with _fragment_index_lock:
+        signatures = _fragment_signatures() or ()
+        lines = [
+            "# Samba shares configuration\n",
+            f"# Generated by Samba Manager from {SHARE_FRAGMENT_DIR} - do not edit\n",
+            "\n",
+        ]
+        lines += [f"include = {os.path.abspath(path)}\n" for path, _ in signatures]
+        content = "".join(lines)
+
+        if content != get_samba_config().shares_content:
+            _install_config_file(content, SHARE_CONF)
+
+
+def _ensure_fragment_layout():
+    """Create the fragment directory and move shares out of the shares config"""
+    if not os.path.isdir(SHARE_FRAGMENT_DIR):
+        privileged.make_dir(SHARE_FRAGMENT_DIR, mode=0o755)
+
+    # The fragments are only seen by Samba through the shares config include
+    config = get_samba_config()
+    main_doc = config.main_doc.copy()
+    global_section = main_doc.section("global")
+    if global_section is None:
+        global_section = main_doc.insert_section(0, "global")
+    if ensure_include(global_section, SHARE_CONF):
+        _install_config_file(str(main_doc), SMB_CONF)
+
+    # Shares still defined directly in the shares config are migrated once
+    legacy = ConfigDocument.parse(config.shares_content)
+    legacy_sections = [s for s in legacy.sections if s.name != "global"]
+    if not legacy_sections:
+        return
+
+    print(f"Migrating {len(legacy_sections)} shares to {SHARE_FRAGMENT_DIR}")
+    for section in legacy_sections:
+        _install_config_file(
+            section.text(),
+            share_fragment_path(section.name),
+            backup=False,
+            local_copy=False,
+        )
+    _write_fragment_index()
+
+
+def save_share_fragment(share):
+    """Write a single share to its fragment file without touching other shares"""
+    _ensure_fragment_layout()
+
+    path = share_fragment_path(share["name"])
+    exists = os.path.exists(path)
+    document = ConfigDocument.parse(_read_config_file(path) if exists else "")
+    section = document.section(share["name"])
+    if section is None:
+        section = document.add_section(share["name"])
+
+    patch_share_section(section, share)
+    _install_config_file(str(document), path, backup=False, local_copy=False)
+
+    if not exists:
+        _write_fragment_index()
+    return True
+
+
+def delete_share_fragment(name):
+    """Remove a share from its fragment file and from the main config.
+
+    Shares of the shares config were already moved to fragments by
+    _ensure_fragment_layout, but a share can still be defined in the main
+    config. Returns False if the share is not defined anywhere.
+    """
+    _ensure_fragment_layout()
+
+    removed = False
+    path = share_fragment_path(name)
+    if os.path.exists(path):
+        privileged.remove_files([path])
+        _fragment_cache.pop(path, None)
+        invalidate_samba_config()
+        _write_fragment_index()
+        removed = True
+
+    config = get_samba_config()
+    if name.lower() not in SPECIAL_SECTIONS and config.main_doc.section(name):
+        print(f"Removing share {name} from {SMB_CONF}")
+        main_doc = config.main_doc.copy()
+        main_doc.remove_section(name)
+        _install_config_file(str(main_doc), SMB_CONF)
+        removed = True
+
+    return removed
+
+
+def _registry_signature():
+    """Return a signature of the Samba registry, or None when it is not in use.
+
+    The signature is the (inode, mtime, size) of REGISTRY_TDB, so that
+    get_samba_config() re-reads the registry shares with "net conf" only
+    after the registry database changed.
+    """
+    if SHARE_BACKEND != "registry":
+        return None
+    # The registry is still listed when its database cannot be stat'ed, but
+    # then only changes made through Samba Manager are picked up
+    return ("registry", _config_file_signature(REGISTRY_TDB))
+
+
+def _read_registry_config():
+    """Return the registry configuration in smb.conf format"""
+    result = privileged.run(["net", "conf", "list"])
+    if result.returncode != 0:
+        print(f"Error listing registry configuration: {result.stderr.strip()}")
+        return ""
+    return result.stdout
+
+
+def _run_net_conf(*args):
+    """Run a "net conf" subcommand, raising CalledProcessError on failure"""
+    result = privileged.run(["net", "conf", *args])
+    result.check_returncode()
+    return result
+
+
+def _ensure_registry_layout():
+    """Enable registry shares and move shares out of the config files.
+
+    Shares still defined in the main config or the shares config are
+    imported once. They are removed from the files in the same write,
+    so no share is defined both in a file and in the registry.
+    """
+    config = get_samba_config()
+    main_doc = config.main_doc.copy()
+    global_section = main_doc.section("global")
+    if global_section is None:
+        global_section = main_doc.insert_section(0, "global")
+    enabled = global_section.set("registry shares", "yes", before="include")
+
+    main_shares = list(
+        dict.fromkeys(
+            name for name in main_doc.section_names() if name not in SPECIAL_SECTIONS
+        )
+    )
+    legacy = ConfigDocument.parse(config.shares_content)
+    legacy_sections = [s for s in legacy.sections if s.name != "global"]
+
+    # Imported straight from the root-owned config files, the privileged
+    # helper does not import files the web app wrote. Shares config
+    # sections come last, so they win like they do in load_shares.
+    if main_shares or legacy_sections:
+        count = len(main_shares) + len(legacy_sections)
+        print(f"Importing {count} shares into the registry")
+    for name in main_shares:
+        _run_net_conf("import", os.path.abspath(SMB_CONF), name)
+        main_doc.remove_section(name)
+    for section in legacy_sections:
+        _run_net_conf("import", os.path.abspath(SHARE_CONF), section.name)
+
+    if enabled or main_shares:
+        _install_config_file(str(main_doc), SMB_CONF)
+    if legacy_sections:
+        _install_config_file("# Samba shares configuration\n", SHARE_CONF)
+    if enabled or main_shares or legacy_sections:
+        # Makes smbd look at the registry and drop the shares from the files
+        reload_samba_service()
+
+
+def save_share_registry(share, config=None):
+    """Write the changed parameters of a share to the registry.
+
+    Returns True if anything was written. Registry changes are picked up by
+    smbd without a reload.
+    """
+    config = config or get_samba_config()
+    current = config.registry_doc.section(share["name"])
+    section = current.copy() if current is not None else Section(share["name"])
+    before = {param.norm: param.value for param in section.parameters()}
+
+    if not patch_share_section(section, share) and current is not None:
+        return False
+
+    # "net conf setparm" also creates the share if it does not exist yet
+    for param in section.parameters():
+        if before.get(param.norm) != param.value or current is None:
+            _run_net_conf("setparm", share["name"], param.key, param.value)
+
+    invalidate_samba_config()
+    return True
+
+
+def delete_share_registry(name):
+    """Remove a share from the registry, returning False if it does not exist"""
+    if get_samba_config().registry_doc.section(name) is None:
+        return False
+
+    _run_net_conf("delshare", name)
+    invalidate_samba_config()
+    return True
 
 
 # Function to auto-detect share directories
@@ -104,15 +670,14 @@ def detect_share_directories():
     # Check existing shares in Samba config
     if os.path.exists(ACTUAL_SMB_CONF):
         try:
-            with open(ACTUAL_SMB_CONF, "r") as f:
-                content = f.read()
+            config = get_samba_config(ACTUAL_SMB_CONF)
 
             # Extract share sections and their paths
-            shares = parse_share_section(content)
-            for share in shares:
-                if "name" in share and "path" in share:
-                    if os.path.exists(share["path"]):
-                        share_dirs[share["name"]] = share["path"]
+            for name, section in config.main_sections.items():
+                if name in SPECIAL_SECTIONS:
+                    continue
+                if "path" in section and os.path.exists(section["path"]):
+                    share_dirs[name] = section["path"]
         except Exception as e:
             print(f"Error reading Samba config: {e}")
 
@@ -153,16 +718,20 @@ def check_sudo_access():
     """Check if the application has sudo access to manage Samba"""
     if DEV_MODE:
         return True  # In development mode, we don't need sudo
-    try:
-        result = subprocess.run(["sudo", "-n", "true"], capture_output=True)
-        return result.returncode == 0
-    except Exception:
-        return False
+    # Probed once and cached, see capabilities.CAPABILITY_TTL
+    return capabilities.sudo
 
 
 def run_command(cmd, input_str=None):
     """Run a shell command and return the result"""
     try:
+        # Samba admin tools go through the privileged helper when it runs
+        if cmd[:1] == ["sudo"] and cmd[1] in privileged.ALLOWED_COMMANDS:
+            result = privileged.run(cmd[1:], input=input_str)
+            if result.returncode != 0:
+                return False, result.stderr
+            return True, result.stdout
+
         if input_str:
             result = subprocess.run(
                 cmd,
@@ -183,19 +752,26 @@ def run_command(cmd, input_str=None):
 def restart_samba_service():
     """Restart Samba service with proper error handling"""
     try:
-        # First try systemctl
-        print("Attempting to restart Samba services with systemctl")
-        systemctl_cmd = ["sudo", "systemctl", "restart", "smbd.service", "nmbd.service"]
-        result = subprocess.run(
-            systemctl_cmd, capture_output=True, text=True, check=False
-        )
+        # First try systemctl, unless systemd is known not to be running
+        if capabilities.init_system in ("systemd", None):
+            print("Attempting to restart Samba services with systemctl")
+            systemctl_cmd = [
+                "sudo",
+                "systemctl",
+                "restart",
+                "smbd.service",
+                "nmbd.service",
+            ]
+            result = subprocess.run(
+                systemctl_cmd, capture_output=True, text=True, check=False
+            )
 
-        if result.returncode == 0:
-            print("Successfully restarted Samba services with systemctl")
-            return True
+            if result.returncode == 0:
+                print("Successfully restarted Samba services with systemctl")
+                return True
 
         # If systemctl fails, try service command
-        print("systemctl failed, trying service command")
+        print("systemctl not available or failed, trying service command")
         service_cmd1 = ["sudo", "service", "smbd", "restart"]
         service_cmd2 = ["sudo", "service", "nmbd", "restart"]
 
@@ -229,12 +805,96 @@ def restart_samba_service():
         return False
 
 
+def reload_samba_service():
+    """Make running Samba daemons re-read their configuration.
+
+    Unlike a restart this keeps client connections open. Falls back to a
+    restart if smbd cannot be signalled.
+    """
+    print("Reloading Samba configuration with smbcontrol")
+    result = privileged.run(["smbcontrol", "smbd", "reload-config"])
+    if result.returncode != 0:
+        print(f"smbcontrol failed ({result.stderr.strip()}), restarting instead")
+        return restart_samba_service()
+
+    # nmbd is optional, e.g. with "disable netbios = yes"
+    result = privileged.run(["smbcontrol", "nmbd", "reload-config"])
+    if result.returncode != 0:
+        print(f"Warning: Could not reload nmbd: {result.stderr.strip()}")
+
+    print("Successfully reloaded Samba configuration")
+    return True
+
+
+# Global parameters that running daemons only pick up when they are started
+RESTART_REQUIRED_PARAMETERS = {
+    "interfaces",
+    "bindinterfacesonly",
+    "smbports",
+    "serverrole",
+    "security",
+    "passdbbackend",
+    "disablenetbios",
+    "netbiosname",
+    "netbiosaliases",
+    "workgroup",
+    "realm",
+}
+
+
+def _normalized_sections(config):
+    """Return {section: {key: value}} of a config with Samba-normalized names"""
+    sections = {}
+    for document in (config.main_doc, config.shares_doc):
+        for section in document.sections:
+            params = sections.setdefault(section.name.lower(), {})
+            for param in section.parameters():
+                params[param.norm] = param.value
+    return sections
+
+
+def classify_config_change(previous, current):
+    """Return "none", "reload" or "restart" for a change between two configs"""
+    old_sections = _normalized_sections(previous)
+    new_sections = _normalized_sections(current)
+    if old_sections == new_sections:
+        return "none"
+
+    old_global = old_sections.get("global", {})
+    new_global = new_sections.get("global", {})
+    for key in sorted(RESTART_REQUIRED_PARAMETERS):
+        if old_global.get(key) != new_global.get(key):
+            print(f"Parameter '{key}' changed, Samba needs a restart")
+            return "restart"
+
+    return "reload"
+
+
+def apply_samba_config(previous):
+    """Apply a configuration change with the least disruptive action.
+
+    previous is the SambaConfig from before the change. Share and most
+    global changes are applied with a reload, which keeps clients
+    connected; only parameters in RESTART_REQUIRED_PARAMETERS restart
+    the daemons.
+    """
+    action = classify_config_change(previous, get_samba_config())
+    if action == "none":
+        print("Samba configuration unchanged, nothing to apply")
+        return True
+    if action == "restart":
+        return restart_samba_service()
+    return reload_samba_service()
+
+
 def get_samba_status():
     """Get the status of the Samba service"""
     if DEV_MODE:
         return {"smbd": "active (dev)", "nmbd": "active (dev)"}
     try:
         # Try systemctl first (for systemd systems)
+        if capabilities.init_system not in ("systemd", None):
+            raise RuntimeError("systemd is not running")
         smbd = subprocess.run(
             ["systemctl", "is-active", "smbd"], capture_output=True, text=True
         )
@@ -270,142 +930,38 @@ def get_samba_status():
 
 def read_global_settings():
     try:
-        # Try to read from the system configuration file first
-        system_conf = "/etc/samba/smb.conf"
-        data = ""
-
-        # Check if we can read the system config
-        try:
-            # Try to read the system config with sudo if possible
-            sudo_check = subprocess.run(
-                ["sudo", "-n", "true"], capture_output=True, text=True, check=False
-            )
-
-            if sudo_check.returncode == 0:
-                # We have sudo access, read the system config
-                cat_result = subprocess.run(
-                    ["sudo", "cat", system_conf],
-                    capture_output=True,
-                    text=True,
-                    check=False,
-                )
-
-                if cat_result.returncode == 0:
-                    print("Reading settings from system configuration file")
-                    data = cat_result.stdout
-        except Exception as e:
-            print(f"Error reading system config: {e}")
-
-        # If we couldn't read the system config, fall back to the local config
-        if not data:
-            print("Reading settings from local configuration file")
-            with open(SMB_CONF, "r") as f:
-                data = f.read()
-
-        # Define default values for all settings
-        settings = {
-            "server_string": "Samba Server",
-            "workgroup": "WORKGROUP",
-            "log_level": "1",
-            "server_role": "standalone",
-            "log_file": "/var/log/samba/log.%m",
-            "max_log_size": "1000",
-            "security": "user",
-            "encrypt_passwords": "yes",
-            "guest_account": "nobody",
-            "map_to_guest": "Bad User",
-            "interfaces": "",
-            "bind_interfaces_only": "no",
-            "hosts_allow": "",
-            "hosts_deny": "",
-            "unix_charset": "UTF-8",
-            "dos_charset": "CP850",
-            "deadtime": "15",
-            "keepalive": "300",
-            "max_connections": "0",
-            "socket_options": "TCP_NODELAY IPTOS_LOWDELAY",
-            "dns_proxy": "no",
-            "usershare_allow_guests": "yes",
-        }
-
-        # Define mappings between our keys and Samba config keys
-        mappings = {
-            "server_string": r"server string\s*=\s*(.*)",
-            "workgroup": r"workgroup\s*=\s*(.*)",
-            "log_level": r"log level\s*=\s*(.*)",
-            "server_role": r"server role\s*=\s*(.*)",
-            "log_file": r"log file\s*=\s*(.*)",
-            "max_log_size": r"max log size\s*=\s*(.*)",
-            "security": r"security\s*=\s*(.*)",
-            "encrypt_passwords": r"encrypt passwords\s*=\s*(.*)",
-            "guest_account": r"guest account\s*=\s*(.*)",
-            "map_to_guest": r"map to guest\s*=\s*(.*)",
-            "interfaces": r"interfaces\s*=\s*(.*)",
-            "bind_interfaces_only": r"bind interfaces only\s*=\s*(.*)",
-            "hosts_allow": r"hosts allow\s*=\s*(.*)",
-            "hosts_deny": r"hosts deny\s*=\s*(.*)",
-            "unix_charset": r"unix charset\s*=\s*(.*)",
-            "dos_charset": r"dos charset\s*=\s*(.*)",
-            "deadtime": r"deadtime\s*=\s*(.*)",
-            "keepalive": r"keepalive\s*=\s*(.*)",
-            "max_connections": r"max connections\s*=\s*(.*)",
-            "socket_options": r"socket options\s*=\s*(.*)",
-            "dns_proxy": r"dns proxy\s*=\s*(.*)",
-            "usershare_allow_guests": r"usershare allow guests\s*=\s*(.*)",
-        }
-
-        # Extract values from the config file
-        for key, pattern in mappings.items():
-            match = re.search(pattern, data)
-            if match:
-                settings[key] = match.group(1).strip()
-
-        return settings
+        return dict(get_samba_config().global_settings)
 
     except Exception as e:
         print(f"Error reading global settings: {str(e)}")
-        return {
-            "error": str(e),
-            "server_string": "Samba Server",
-            "workgroup": "WORKGROUP",
-            "log_level": "1",
-            "server_role": "standalone",
-            "log_file": "/var/log/samba/log.%m",
-            "max_log_size": "1000",
-            "security": "user",
-            "encrypt_passwords": "yes",
-            "guest_account": "nobody",
-            "map_to_guest": "Bad User",
-            "interfaces": "",
-            "bind_interfaces_only": "no",
-            "hosts_allow": "",
-            "hosts_deny": "",
-            "unix_charset": "UTF-8",
-            "dos_charset": "CP850",
-            "deadtime": "15",
-            "keepalive": "300",
-            "max_connections": "0",
-            "socket_options": "TCP_NODELAY IPTOS_LOWDELAY",
-            "dns_proxy": "no",
-            "usershare_allow_guests": "yes",
-        }
+        settings = dict(DEFAULT_GLOBAL_SETTINGS)
+        settings["error"] = str(e)
+        return settings
 
 
 def read_samba_config():
     """Read the content of the Samba configuration file"""
     try:
-        with open(SMB_CONF, "r") as f:
-            return f.read()
+        return get_samba_config().main_content
     except Exception as e:
         print(f"Error reading Samba config: {e}")
         return ""
 
 
+def ensure_include(global_section, include_path):
+    """Add an include directive to the global section unless it is already there"""
+    if include_path not in global_section.get_all("include"):
+        global_section.add("include", include_path)
+        return True
+    return False
+
+
 def write_global_settings(settings):
     """Write global settings to the Samba configuration file"""
     try:
         # Get the current configuration
-        config_content = read_samba_config()
+        previous = get_samba_config()
+        config_content = previous.main_content
 
         # Create a backup of the current config
         backup_path = SMB_CONF + ".bak"
@@ -418,44 +974,28 @@ def write_global_settings(settings):
             with open(backup_path, "w") as f:
                 f.write(config_content)
 
-        # Parse the configuration into sections
-        sections = parse_config_content(config_content)
-
-        # Update the global section
-        if "global" in sections:
-            global_section = sections["global"]
-
-            # Update the settings
-            for key, value in settings.items():
-                if value:  # Only update if value is not empty
-                    global_section[key] = value
-                else:
-                    # For empty values, remove the setting from the configuration
-                    if key in global_section:
-                        del global_section[key]
-
-            # Make sure the include statement is present
-            if DEV_MODE:
-                global_section["include"] = "./shares.conf"
+        # Patch the global section in place, keeping comments and layout
+        document = get_samba_config().main_doc.copy()
+        global_section = document.section("global")
+        if global_section is None:
+            global_section = document.insert_section(0, "global")
+
+        # Update the settings
+        for key, value in settings.items():
+            if value:  # Only update if value is not empty
+                # New parameters go before the include so they stay in [global]
+                global_section.set(key, value, before="include")
             else:
-                global_section["include"] = "/etc/samba/shares.conf"
-        else:
-            # Create a new global section if it doesn't exist
-            sections["global"] = settings
+                # For empty values, remove the setting from the configuration
+                global_section.remove(key)
 
-            # Add the include statement
-            if DEV_MODE:
-                sections["global"]["include"] = "./shares.conf"
-            else:
-                sections["global"]["include"] = "/etc/samba/shares.conf"
+        # Make sure the include statement is present
+        if DEV_MODE:
+            ensure_include(global_section, "./shares.conf")
+        else:
+            ensure_include(global_section, "/etc/samba/shares.conf")
 
-        # Convert the sections back to a configuration string
-        new_config = ""
-        for section_name, section_params in sections.items():
-            new_config += f"[{section_name}]\n"
-            for param_name, param_value in section_params.items():
-                new_config += f"    {param_name} = {param_value}\n"
-            new_config += "\n"
+        new_config = str(document)
 
         # Write the configuration to a temporary file
         with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp_file:
@@ -463,6 +1003,7 @@ def write_global_settings(settings):
             temp_path = temp_file.name
 
         success = True
+        system_updated = False
 
         if DEV_MODE:
             # In dev mode, first update the local configuration file
@@ -514,21 +1055,7 @@ def write_global_settings(settings):
 
                         if shares_result.returncode == 0:
                             print("Updated system shares configuration")
-
-                            # Restart the system services
-                            restart_result = subprocess.run(
-                                ["sudo", "systemctl", "restart", "smbd", "nmbd"],
-                                capture_output=True,
-                                text=True,
-                                check=False,
-                            )
-
-                            if restart_result.returncode == 0:
-                                print("Restarted system Samba services")
-                            else:
-                                print(
-                                    f"Failed to restart system services: {restart_result.stderr}"
-                                )
+                            system_updated = True
                     else:
                         print(f"Failed to update system config: {system_result.stderr}")
                 else:
@@ -566,6 +1093,7 @@ def write_global_settings(settings):
 
         # Clean up the temporary file
         os.unlink(temp_path)
+        invalidate_samba_config()
 
         if not success:
             return False
@@ -598,11 +1126,8 @@ def write_global_settings(settings):
             )
             if testparm_check.returncode == 0:
                 # testparm is available, validate the system config
-                validate_cmd = subprocess.run(
-                    ["sudo", "testparm", "-s", "/etc/samba/smb.conf"],
-                    capture_output=True,
-                    text=True,
-                    check=False,
+                validate_cmd = privileged.run(
+                    ["testparm", "-s", "/etc/samba/smb.conf"]
                 )
 
                 if validate_cmd.returncode != 0:
@@ -615,24 +1140,14 @@ def write_global_settings(settings):
             else:
                 print("testparm not available, skipping configuration validation in production mode")
 
-        # Restart Samba services
-        if DEV_MODE:
-            # In development mode, we already tried to restart the system services if we had sudo access
+        # Apply the change to the running Samba services
+        if DEV_MODE and not system_updated:
             print("Development mode: Local configuration updated successfully")
-        else:
-            # In production mode, restart the services
-            restart_cmd = subprocess.run(
-                ["sudo", "systemctl", "restart", "smbd", "nmbd"],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
+            return True
 
-            if restart_cmd.returncode != 0:
-                print(f"Error restarting services: {restart_cmd.stderr}")
-                return False
-            else:
-                print("Restarted system Samba services")
+        if not apply_samba_config(previous):
+            print("Error applying configuration to Samba services")
+            return False
 
         return True
     except Exception as e:
@@ -676,529 +1191,560 @@ def format_user_group_list(users, groups):
 
 def load_shares():
     """Load Samba shares from the configuration files"""
-    shares = []
+    shares = get_samba_config().shares
 
-    # First read from the main configuration file
-    if os.path.exists(SMB_CONF):
-        print(f"Reading shares from main config {SMB_CONF}")
-        try:
-            with open(SMB_CONF, "r") as f:
-                content = f.read()
-
-            # Parse shares from content
-            sections = parse_config_content(content)
-            for name, section in sections.items():
-                # Skip non-share sections and special shares
-                if name in ["global", "printers", "print$"]:
-                    continue
+    # Hand out copies so callers can modify them without touching the cache
+    copies = []
+    for share in shares:
+        share_copy = dict(share)
+        for key, value in share_copy.items():
+            if isinstance(value, list):
+                share_copy[key] = list(value)
+        copies.append(share_copy)
+
+    return copies
+
+
+# Map our normalized keys back to Samba config keys
+REVERSE_SHARE_KEY_MAPPING = {
+    "path": "path",
+    "comment": "comment",
+    "browseable": "browseable",
+    "read_only": "read only",
+    "guest_ok": "guest ok",
+    "valid_users": "valid users",
+    "write_list": "write list",
+    "create_mask": "create mask",
+    "directory_mask": "directory mask",
+    "force_group": "force group",
+    "max_connections": "max connections",
+}
+
+# Samba parameters that are spelled more than one way
+SHARE_KEY_ALIASES = {
+    "browseable": ["browsable"],
+}
+
+# Keys that load_shares derives for the UI and that must not be written back
+DERIVED_SHARE_KEYS = [
+    "name",
+    "valid_users_list",
+    "valid_groups_list",
+    "write_users_list",
+    "write_groups_list",
+]
+
+# These fields should always be written first for new shares, even if empty
+REQUIRED_SHARE_FIELDS = [
+    "path",
+    "valid_users",
+    "write_list",
+    "create_mask",
+    "directory_mask",
+]
+
+
+# Keys holding comma-separated user and group lists, compared as sets
+SHARE_LIST_KEYS = ["valid_users", "write_list"]
+
+
+def _same_share_value(key, value, current):
+    if key in SHARE_LIST_KEYS:
+        items = {item.strip() for item in str(value).split(",") if item.strip()}
+        return items == {item.strip() for item in current.split(",") if item.strip()}
+    return str(value) == current
+
+
+def patch_share_section(section, share):
+    """Apply a normalized share dictionary to a config section in place.
+
+    The share is compared with what load_shares derives from the section
+    as it is, so only the values the caller changed are written. Defaults
+    filled in for missing parameters and the write list merged into valid
+    users are never written back. A new, empty section gets every value.
+    Parameters that Samba Manager does not know about are left untouched.
+    """
+    current = share_from_section(section) if section.parameters() else None
+
+    ordered_keys = [key for key in REQUIRED_SHARE_FIELDS if key in share]
+    ordered_keys += [key for key in share if key not in REQUIRED_SHARE_FIELDS]
+
+    changed = False
+    for our_key in ordered_keys:
+        if our_key in DERIVED_SHARE_KEYS:
+            continue
+        if current is not None and our_key in current:
+            if _same_share_value(our_key, share[our_key], current[our_key]):
+                continue
 
-                # Create share dictionary with normalized keys
-                share = {"name": name}
-
-                # Map Samba config keys to our normalized keys
-                key_mapping = {
-                    "path": "path",
-                    "comment": "comment",
-                    "browseable": "browseable",
-                    "browsable": "browseable",  # Alternative spelling
-                    "read only": "read_only",
-                    "guest ok": "guest_ok",
-                    "valid users": "valid_users",
-                    "write list": "write_list",
-                    "create mask": "create_mask",
-                    "directory mask": "directory_mask",
-                    "force group": "force_group",
-                    "max connections": "max_connections",
-                }
+        samba_key = REVERSE_SHARE_KEY_MAPPING.get(our_key, our_key)
+        if samba_key not in section:
+            # Keep the spelling already used in the file
+            for alias in SHARE_KEY_ALIASES.get(samba_key, []):
+                if alias in section:
+                    samba_key = alias
+                    break
 
-                # Copy values using the mapping
-                for samba_key, our_key in key_mapping.items():
-                    if samba_key in section:
-                        share[our_key] = section[samba_key]
+        if section.set(samba_key, share[our_key]):
+            changed = True
 
-                # Add default values if not present
-                defaults = {
-                    "path": "/tmp",
-                    "comment": "",
-                    "browseable": "yes",
-                    "read_only": "no",
-                    "guest_ok": "no",
-                    "valid_users": "",
-                    "write_list": "",
-                    "create_mask": "0775",
-                    "directory_mask": "0775",
-                    "force_group": "smbusers",
-                    "max_connections": "0",
-                }
-
-                for key, value in defaults.items():
-                    if key not in share:
-                        share[key] = value
+    return changed
 
-                # If valid_users is empty but write_list has values, use write_list for valid_users
-                if not share.get("valid_users") and share.get("write_list"):
-                    share["valid_users"] = share["write_list"]
-                    print(
-                        f"Using write_list as valid_users for share {name}: {share['valid_users']}"
-                    )
 
-                # Debug output for valid_users and write_list
-                print(
-                    f"Share {name} from main config - valid_users: '{share.get('valid_users', '')}', write_list: '{share.get('write_list', '')}'"
-                )
+def render_share_changes(shares, config=None):
+    """Compute the new shares and main config documents for a list of shares.
 
-                shares.append(share)
-        except Exception as e:
-            print(f"Error reading shares from main config: {e}")
+    Returns (shares_doc, main_doc). Sections of shares that did not change
+    keep their original text, so the cost is proportional to the edit.
+    """
+    config = config or get_samba_config()
+    shares_doc = config.shares_doc.copy()
+    main_doc = config.main_doc.copy()
 
-    # Then read from the shares configuration file
-    if os.path.exists(SHARE_CONF):
-        print(f"Reading shares from shares config {SHARE_CONF}")
-        try:
-            with open(SHARE_CONF, "r") as f:
-                content = f.read()
-
-            # Parse shares from content
-            sections = parse_config_content(content)
-            for name, section in sections.items():
-                # Skip non-share sections
-                if name == "global":
-                    continue
+    if not shares_doc.sections and not str(shares_doc).strip():
+        shares_doc.preamble = ["# Samba shares configuration\n", "\n"]
 
-                # Check if this share already exists (from main config)
-                existing_share = next((s for s in shares if s["name"] == name), None)
-                if existing_share:
-                    print(
-                        f"Share {name} already exists from main config, updating from shares config"
-                    )
+    wanted = {share["name"]: share for share in shares}
 
-                    # Map Samba config keys to our normalized keys
-                    key_mapping = {
-                        "path": "path",
-                        "comment": "comment",
-                        "browseable": "browseable",
-                        "browsable": "browseable",  # Alternative spelling
-                        "read only": "read_only",
-                        "guest ok": "guest_ok",
-                        "valid users": "valid_users",
-                        "write list": "write_list",
-                        "create mask": "create_mask",
-                        "directory mask": "directory_mask",
-                        "force group": "force_group",
-                        "max connections": "max_connections",
-                    }
+    # Drop shares that are no longer in the list
+    for name in shares_doc.section_names():
+        if name != "global" and name not in wanted:
+            shares_doc.remove_section(name)
 
-                    # Update values using the mapping
-                    for samba_key, our_key in key_mapping.items():
-                        if samba_key in section:
-                            existing_share[our_key] = section[samba_key]
+    for share in shares:
+        name = share["name"]
+        section = shares_doc.section(name)
+        if section is None:
+            # Move shares defined in the main config over with their comments
+            source = main_doc.section(name)
+            if source is not None and name not in SPECIAL_SECTIONS:
+                section = shares_doc.add_section(name, section=source.copy())
+            else:
+                section = shares_doc.add_section(name)
+        patch_share_section(section, share)
 
-                    # If valid_users is empty but write_list has values, use write_list for valid_users
-                    if not existing_share.get("valid_users") and existing_share.get(
-                        "write_list"
-                    ):
-                        existing_share["valid_users"] = existing_share["write_list"]
-                        print(
-                            f"Using write_list as valid_users for existing share {name}: {existing_share['valid_users']}"
-                        )
+    # Share sections belong in the shares config, not the main config
+    for name in main_doc.section_names():
+        if name not in SPECIAL_SECTIONS:
+            main_doc.remove_section(name)
 
-                    # Debug output for valid_users and write_list
-                    print(
-                        f"Updated share {name} - valid_users: '{existing_share.get('valid_users', '')}', write_list: '{existing_share.get('write_list', '')}'"
-                    )
-                else:
-                    # Create new share dictionary with normalized keys
-                    share = {"name": name}
-
-                    # Map Samba config keys to our normalized keys
-                    key_mapping = {
-                        "path": "path",
-                        "comment": "comment",
-                        "browseable": "browseable",
-                        "browsable": "browseable",  # Alternative spelling
-                        "read only": "read_only",
-                        "guest ok": "guest_ok",
-                        "valid users": "valid_users",
-                        "write list": "write_list",
-                        "create mask": "create_mask",
-                        "directory mask": "directory_mask",
-                        "force group": "force_group",
-                        "max connections": "max_connections",
-                    }
+    global_section = main_doc.section("global")
+    if global_section is None:
+        global_section = main_doc.insert_section(0, "global")
+    ensure_include(global_section, SHARE_CONF)
 
-                    # Copy values using the mapping
-                    for samba_key, our_key in key_mapping.items():
-                        if samba_key in section:
-                            share[our_key] = section[samba_key]
-
-                    # Add default values if not present
-                    defaults = {
-                        "path": "/tmp",
-                        "comment": "",
-                        "browseable": "yes",
-                        "read_only": "no",
-                        "guest_ok": "no",
-                        "valid_users": "",
-                        "write_list": "",
-                        "create_mask": "0775",
-                        "directory_mask": "0775",
-                        "force_group": "smbusers",
-                        "max_connections": "0",
-                    }
+    return shares_doc, main_doc
 
-                    for key, value in defaults.items():
-                        if key not in share:
-                            share[key] = value
 
-                    # If valid_users is empty but write_list has values, use write_list for valid_users
-                    if not share.get("valid_users") and share.get("write_list"):
-                        share["valid_users"] = share["write_list"]
-                        print(
-                            f"Using write_list as valid_users for new share {name}: {share['valid_users']}"
-                        )
+def _install_config_file(content, path, backup=True, local_copy=True):
+    """Back up a config file and replace it with new content as root"""
+    try:
+        privileged.write_file(path, content, mode=0o644, backup=backup)
 
-                    # Debug output for valid_users and write_list
-                    print(
-                        f"Share {name} from shares config - valid_users: '{share.get('valid_users', '')}', write_list: '{share.get('write_list', '')}'"
-                    )
+        # If in production mode, also update the local copy for reference
+        if local_copy and not DEV_MODE:
+            local_path = os.path.join(".", os.path.basename(path))
+            try:
+                with open(local_path, "w") as f:
+                    f.write(content)
+                print(f"Updated local copy at {local_path}")
+            except Exception as e:
+                print(f"Warning: Could not update local copy: {e}")
+    finally:
+        invalidate_samba_config()
 
-                    shares.append(share)
-        except Exception as e:
-            print(f"Error reading shares from shares config: {e}")
 
-    print(f"Total shares loaded: {len(shares)}")
+def _save_share_fragments(shares):
+    """Write one fragment per share, touching only fragments whose content changed"""
+    _ensure_fragment_layout()
+    config = get_samba_config()
+    existing = dict(config.signature[2] or ())
 
-    # Final check for all shares: ensure valid_users includes write_list users
+    wanted = {}
+    writes = {}
     for share in shares:
-        if share.get("write_list") and not share.get("valid_users"):
-            share["valid_users"] = share["write_list"]
+        path = share_fragment_path(share["name"])
+        wanted[path] = share
+
+        if path in existing:
+            old_content = str(_load_share_fragment(path, existing[path]))
+            document = _load_share_fragment(path, existing[path]).copy()
+        else:
+            old_content = None
+            document = ConfigDocument()
+
+        section = document.section(share["name"])
+        if section is None:
+            # Keep comments of shares that are still defined in the main config
+            source = config.main_doc.section(share["name"])
+            if source is not None and share["name"] not in SPECIAL_SECTIONS:
+                section = document.add_section(share["name"], section=source.copy())
+            else:
+                section = document.add_section(share["name"])
+        patch_share_section(section, share)
+
+        content = str(document)
+        if content != old_content:
+            print(f"Writing share fragment {path}")
+            writes[path] = content
+
+    removed = [path for path in existing if path not in wanted]
+    for path in removed:
+        print(f"Removing share fragment {path}")
+        _fragment_cache.pop(path, None)
+
+    # All fragments go to the helper in one round-trip when it is running
+    try:
+        if writes:
+            privileged.write_files(writes, mode=0o644, backup=False)
+        privileged.remove_files(removed)
+    finally:
+        invalidate_samba_config()
+
+    if removed or len(wanted) != len(existing):
+        _write_fragment_index()
+
+
+def _validate_and_apply(previous):
+    """Check the configuration with testparm and apply it to the running Samba"""
+    # Validate configuration before restarting
+    try:
+        validate_result = privileged.run(["testparm", "-s"])
+        if validate_result.returncode != 0:
             print(
-                f"Final check: Using write_list as valid_users for share {share['name']}: {share['valid_users']}"
+                f"Warning: Samba configuration validation failed: {validate_result.stderr}"
             )
-        elif share.get("write_list") and share.get("valid_users"):
-            # Make sure all write_list users are in valid_users
-            valid_users_set = set(
-                user.strip() for user in share["valid_users"].split(",") if user.strip()
-            )
-            write_list_set = set(
-                user.strip() for user in share["write_list"].split(",") if user.strip()
-            )
-
-            # If there are users in write_list not in valid_users, add them
-            missing_users = write_list_set - valid_users_set
-            if missing_users:
-                if share["valid_users"]:
-                    share["valid_users"] += "," + ",".join(missing_users)
-                else:
-                    share["valid_users"] = ",".join(missing_users)
-                print(
-                    f"Added missing write_list users to valid_users for share {share['name']}: {missing_users}"
-                )
+            # Continue anyway as testparm might have warnings but still be valid
+    except Exception as e:
+        print(f"Warning: Could not validate configuration: {e}")
 
-        # Debug output for max_connections
-        print(
-            f"Share {share['name']} - max_connections: '{share.get('max_connections', '0')}'"
-        )
+    result = apply_samba_config(previous)
+    print(f"Applying Samba configuration {'successful' if result else 'failed'}")
+    return result
 
-        # Parse and store user and group lists separately for UI display
-        if "valid_users" in share:
-            users, groups = parse_user_group_list(share["valid_users"])
-            share["valid_users_list"] = users
-            share["valid_groups_list"] = groups
 
-        if "write_list" in share:
-            users, groups = parse_user_group_list(share["write_list"])
-            share["write_users_list"] = users
-            share["write_groups_list"] = groups
+def _save_registry_shares(shares):
+    """Bring the registry in line with a list of shares, one parameter at a time"""
+    _ensure_registry_layout()
+    config = get_samba_config()
 
-    # Print final share information for debugging
-    print(f"Loaded {len(shares)} shares from configuration")
+    changed = False
     for share in shares:
-        print(f"Share: {share['name']} - Path: {share['path']}")
-        print(
-            f"  valid_users: '{share.get('valid_users', '')}', write_list: '{share.get('write_list', '')}'"
-        )
-        print(
-            f"  create_mask: '{share.get('create_mask', '')}', directory_mask: '{share.get('directory_mask', '')}'"
-        )
+        if save_share_registry(share, config):
+            changed = True
 
-    return shares
+    wanted = {share["name"].lower() for share in shares}
+    for name in config.registry_doc.section_names():
+        if name != "global" and name.lower() not in wanted:
+            print(f"Removing share {name} from the registry")
+            _run_net_conf("delshare", name)
+            changed = True
+
+    if changed:
+        invalidate_samba_config()
+    return changed
 
 
 def save_shares(shares):
     try:
-        print(f"Saving {len(shares)} shares to {SHARE_CONF}")
-
-        # Map our normalized keys back to Samba config keys
-        reverse_key_mapping = {
-            "path": "path",
-            "comment": "comment",
-            "browseable": "browseable",
-            "read_only": "read only",
-            "guest_ok": "guest ok",
-            "valid_users": "valid users",
-            "write_list": "write list",
-            "create_mask": "create mask",
-            "directory_mask": "directory mask",
-            "force_group": "force group",
-            "max_connections": "max connections",
-        }
+        previous = get_samba_config()
 
-        # These fields should always be included in the config, even if empty
-        required_fields = [
-            "path",
-            "valid_users",
-            "write_list",
-            "create_mask",
-            "directory_mask",
-        ]
+        if SHARE_BACKEND == "registry":
+            print(f"Saving {len(shares)} shares to the Samba registry")
+            try:
+                _save_registry_shares(shares)
+            except subprocess.CalledProcessError as e:
+                print(f"Error writing registry shares: {e.stderr}")
+                return False
+            # smbd reads registry shares directly, no reload is needed
+            return True
 
-        # Create temporary file with new configuration
-        import tempfile
+        if SHARE_BACKEND == "fragments":
+            print(f"Saving {len(shares)} shares to {SHARE_FRAGMENT_DIR}")
+            try:
+                _save_share_fragments(shares)
+            except Exception as e:
+                print(f"Error writing share fragments: {e}")
+                return False
+        else:
+            print(f"Saving {len(shares)} shares to {SHARE_CONF}")
 
-        with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp_file:
-            temp_file.write("# Samba shares configuration\n\n")
-            for s in shares:
-                temp_file.write(f"[{s['name']}]\n")
-
-                # First write required fields
-                for our_key in required_fields:
-                    if our_key in s:
-                        samba_key = reverse_key_mapping.get(our_key, our_key)
-                        temp_file.write(f"   {samba_key} = {s[our_key]}\n")
-
-                # Then write the rest of the fields
-                for our_key, value in s.items():
-                    if (
-                        our_key != "name" and our_key not in required_fields
-                    ):  # Skip the name and required fields
-                        if our_key in reverse_key_mapping:
-                            samba_key = reverse_key_mapping[our_key]
-                            temp_file.write(f"   {samba_key} = {value}\n")
-                        else:
-                            # For any keys not in our mapping, write them as-is
-                            temp_file.write(f"   {our_key} = {value}\n")
-
-                temp_file.write("\n")
-            temp_path = temp_file.name
-            print(f"Created temporary file at {temp_path}")
+        config = get_samba_config()
+        shares_doc, main_doc = render_share_changes(shares, config)
 
-        # Backup original shares file if it exists
-        if os.path.exists(SHARE_CONF):
+        new_shares_content = str(shares_doc)
+        if SHARE_BACKEND == "fragments":
+            # The fragments written above are already reflected in shares_doc
+            pass
+        elif new_shares_content != config.shares_content:
             try:
-                subprocess.run(
-                    ["sudo", "cp", SHARE_CONF, f"{SHARE_CONF}.bak"], check=True
-                )
-                print(f"Backed up {SHARE_CONF} to {SHARE_CONF}.bak")
+                print(f"Writing shares configuration to {SHARE_CONF}")
+                _install_config_file(new_shares_content, SHARE_CONF)
+                print(f"Successfully copied configuration to {SHARE_CONF}")
             except Exception as e:
-                print(f"Warning: Could not backup shares file: {e}")
+                print(f"Error copying shares file: {e}")
+                return False
+        else:
+            print(f"No changes to {SHARE_CONF}")
 
-        # Use sudo to copy the temporary file to the correct location
-        try:
-            print(f"Copying temporary file to {SHARE_CONF}")
-            subprocess.run(["sudo", "cp", temp_path, SHARE_CONF], check=True)
-            # Set proper permissions
-            subprocess.run(["sudo", "chmod", "644", SHARE_CONF], check=True)
+        # Remove share sections from the main config and make sure it
+        # includes the shares config
+        new_main_content = str(main_doc)
+        if new_main_content != config.main_content:
+            try:
+                print(f"Updating main config {SMB_CONF}")
+                _install_config_file(new_main_content, SMB_CONF)
+            except Exception as e:
+                print(f"Warning: Could not check/update main config: {e}")
 
-            # If in production mode, also update the local copy for reference
-            if not DEV_MODE:
-                try:
-                    local_path = "./shares.conf"
-                    subprocess.run(["cp", temp_path, local_path], check=True)
-                    print(f"Updated local copy at {local_path}")
-                except Exception as e:
-                    print(f"Warning: Could not update local copy: {e}")
+        return _validate_and_apply(previous)
+    except Exception as e:
+        print(f"Error saving shares: {e}")
+        return False
 
-            os.unlink(temp_path)  # Remove the temp file
-            print(f"Successfully copied configuration to {SHARE_CONF}")
-        except Exception as e:
-            print(f"Error copying shares file: {e}")
-            return False
 
-        # Check if there are any shares defined directly in the main config
-        try:
-            if os.path.exists(SMB_CONF):
-                print(f"Checking for shares in main config {SMB_CONF}")
+# Values used for share settings that are missing or empty
+NEW_SHARE_DEFAULTS = {
+    "comment": "",
+    "browseable": "yes",
+    "read_only": "no",
+    "guest_ok": "no",
+    "valid_users": "",
+    "write_list": "",
+    "create_mask": "0775",
+    "directory_mask": "0775",
+    "max_connections": "0",
+}
+
+
+def apply_share_defaults(share):
+    """Fill in default values for missing share settings, in place"""
+    for key, value in NEW_SHARE_DEFAULTS.items():
+        if key not in share or not share[key]:
+            share[key] = value
+            print(f"Using default value for {key}: {value}")
+    return share
+
+
+# Share directories provisioned concurrently by a batch
+PROVISION_WORKERS = 8
+
+
+def provision_share_directories(paths):
+    """Create and set up several share directories in parallel.
+
+    Each directory costs a few helper round-trips, or sudo calls without
+    the helper, so they are run from a thread pool instead of one after
+    another. Returns {path: success}.
+    """
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return {}
+
+    workers = min(PROVISION_WORKERS, len(paths))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda path: create_share_directory(None, path), paths)
+        return dict(zip(paths, results))
+
+
+def _missing_directories(path):
+    """Return path and its ancestors that do not exist yet, deepest first"""
+    missing = []
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and path != os.path.dirname(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    return missing
+
+
+def _remove_created_directories(directories):
+    """Remove share directories created for changes that were rolled back.
+
+    Directories are only removed while empty, deepest first, so nothing
+    placed in them since is lost.
+    """
+    directories = sorted(set(directories), key=lambda d: d.count("/"), reverse=True)
+    if not directories:
+        return
+    print(f"Removing {len(directories)} directories of rolled back share changes")
+    if DEV_MODE:
+        for directory in directories:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        return
+    try:
+        privileged.remove_dirs(directories)
+    except Exception as e:
+        print(f"Warning: Could not remove directories: {e}")
 
-                # In production mode, we need to read from the system config
-                if not DEV_MODE:
-                    system_conf = "/etc/samba/smb.conf"
-                    result = subprocess.run(
-                        ["sudo", "cat", system_conf],
-                        capture_output=True,
-                        text=True,
-                        check=True,
-                    )
-                    content = result.stdout
-                else:
-                    with open(SMB_CONF, "r") as f:
-                        content = f.read()
-
-                # Parse the main config
-                sections = parse_config_content(content)
-                share_sections = [
-                    name
-                    for name in sections.keys()
-                    if name not in ["global", "printers", "print$"]
-                ]
 
-                if share_sections:
-                    print(
-                        f"Found {len(share_sections)} shares in main config: {', '.join(share_sections)}"
+def _written_user_lists(config, name):
+    """Return the valid users and write list of a share as written in the config"""
+    keys = {
+        normalize_key(REVERSE_SHARE_KEY_MAPPING[key]): key for key in PRINCIPAL_KEYS
+    }
+    lists = {}
+    for section in (config.main_sections, config.share_sections):
+        for key, value in section.get(name, {}).items():
+            our_key = keys.get(normalize_key(key))
+            if our_key is not None:
+                lists[our_key] = value
+    return lists
+
+
+def _unreference_shares(shares, principal, loaded):
+    """Strip a principal from the shares dict in place.
+
+    Shares still as loaded are checked against their valid users and write
+    list as written in the config, not the merged lists load_shares hands
+    out, and only a list that names the principal is replaced. Saving then
+    rewrites just that parameter line of the section.
+
+    Returns (success, message, changed).
+    """
+    kind, name = principal
+    config = get_samba_config()
+    lists = {}
+    for share_name, share in shares.items():
+        if share is loaded.get(share_name):
+            lists[share_name] = _written_user_lists(config, share_name)
+        else:
+            lists[share_name] = {key: share.get(key, "") for key in PRINCIPAL_KEYS}
+        lists[share_name]["name"] = share_name
+
+    referencing = build_reference_index(lists.values()).get(principal, set())
+    if not referencing:
+        return True, f"No shares reference {kind} '{name}'", False
+
+    kept = []
+    for share_name in sorted(referencing):
+        stripped = dict(lists[share_name])
+        if strip_principal(stripped, principal):
+            kept.append(share_name)
+        share = dict(shares[share_name])
+        for key in PRINCIPAL_KEYS:
+            if stripped.get(key) != lists[share_name].get(key):
+                share[key] = stripped[key]
+        shares[share_name] = share
+
+    message = f"Removed {kind} '{name}' from {len(referencing)} share(s)"
+    if kept:
+        message += (
+            f"; kept as the only valid user of {', '.join(kept)} so the"
+            " share does not become open to everyone"
+        )
+    return True, message, True
+
+
+def commit_share_changes(mutations, transactions=()):
+    """Apply a batch of share mutations with one write and one reload.
+
+    mutations is a list of ("upsert", share), ("delete", name) and
+    ("unreference", (kind, name)) tuples, applied in order. The last one
+    removes a deleted "user" or "group" from the user lists of every share.
+    A mutation that fails (missing share, directory that cannot be created)
+    is skipped without affecting the others. Directories of all upserted
+    shares are provisioned in parallel before the write.
+
+    transactions lists (start, stop) ranges of mutations that are applied
+    all or nothing: if one of them fails, the others of the range are
+    rolled back before anything is written and reported as failed too.
+    Directories this call created for the rolled back mutations are
+    removed again, as long as they are still empty.
+
+    Returns (success, results) with one (success, message) per mutation.
+    """
+    current = {share["name"]: share for share in load_shares()}
+    loaded = dict(current)
+    results = []
+    # Whether each mutation changed the shares, for the write decision
+    changes = []
+
+    paths = [payload["path"] for action, payload in mutations if action == "upsert"]
+    created = {path: _missing_directories(path) for path in paths}
+    provisioned = provision_share_directories(paths)
+    rolled_back = []
+
+    starts = {start: stop for start, stop in transactions}
+    transaction = None
+    for index, (action, payload) in enumerate(mutations):
+        if index in starts:
+            # Shares are replaced, never modified, so a shallow copy restores
+            transaction = (index, starts[index], dict(current))
+
+        if action == "unreference":
+            success, message, referenced = _unreference_shares(current, payload, loaded)
+            results.append((success, message))
+            # Cleaning up references nobody holds needs no write
+            changes.append(referenced)
+        elif action == "delete":
+            if current.pop(payload, None) is None:
+                results.append((False, f"Share '{payload}' not found"))
+                changes.append(False)
+            else:
+                results.append((True, f"Share '{payload}' deleted"))
+                changes.append(True)
+        else:
+            share = apply_share_defaults(dict(payload))
+            if not provisioned.get(share["path"]):
+                results.append(
+                    (
+                        False,
+                        f"Failed to create or set permissions on share directory: {share['path']}",
                     )
-
-                    # Create a new main config without the share sections
-                    with tempfile.NamedTemporaryFile(
-                        mode="w", delete=False
-                    ) as temp_file:
-                        # First write the global section
-                        if "global" in sections:
-                            temp_file.write("[global]\n")
-                            for key, value in sections["global"].items():
-                                temp_file.write(f"   {key} = {value}\n")
-                            temp_file.write("\n")
-
-                        # Then write any other special sections
-                        for section_name in ["printers", "print$"]:
-                            if section_name in sections:
-                                temp_file.write(f"[{section_name}]\n")
-                                for key, value in sections[section_name].items():
-                                    temp_file.write(f"   {key} = {value}\n")
-                                temp_file.write("\n")
-
-                        temp_path = temp_file.name
-                        print(f"Created temporary main config at {temp_path}")
-
-                    # Backup original main config
-                    try:
-                        if not DEV_MODE:
-                            system_conf = "/etc/samba/smb.conf"
-                            subprocess.run(
-                                ["sudo", "cp", system_conf, f"{system_conf}.bak"],
-                                check=True,
-                            )
-                            print(f"Backed up {system_conf} to {system_conf}.bak")
-                        else:
-                            subprocess.run(
-                                ["sudo", "cp", SMB_CONF, f"{SMB_CONF}.bak"], check=True
-                            )
-                            print(f"Backed up {SMB_CONF} to {SMB_CONF}.bak")
-                    except Exception as e:
-                        print(f"Warning: Could not backup main config: {e}")
-
-                    # Use sudo to copy the temporary file to the correct location
-                    if not DEV_MODE:
-                        system_conf = "/etc/samba/smb.conf"
-                        subprocess.run(
-                            ["sudo", "cp", temp_path, system_conf], check=True
-                        )
-                        # Also update local copy
-                        try:
-                            subprocess.run(["cp", temp_path, "./smb.conf"], check=True)
-                            print(f"Updated local copy of main config")
-                        except Exception as e:
-                            print(
-                                f"Warning: Could not update local copy of main config: {e}"
-                            )
-                    else:
-                        subprocess.run(["sudo", "cp", temp_path, SMB_CONF], check=True)
-
-                    # Set proper permissions
-                    if not DEV_MODE:
-                        subprocess.run(
-                            ["sudo", "chmod", "644", system_conf], check=True
-                        )
-                    else:
-                        subprocess.run(["sudo", "chmod", "644", SMB_CONF], check=True)
-
-                    os.unlink(temp_path)  # Remove the temp file
-                    print(f"Successfully removed shares from main config")
-        except Exception as e:
-            print(f"Warning: Could not check/update main config: {e}")
-
-        # Ensure the include directive exists in the main config
-        try:
-            # In production mode, we need to read from the system config
-            if not DEV_MODE:
-                system_conf = "/etc/samba/smb.conf"
-                result = subprocess.run(
-                    ["sudo", "cat", system_conf],
-                    capture_output=True,
-                    text=True,
-                    check=True,
                 )
-                content = result.stdout
-                include_path = "/etc/samba/shares.conf"
+                changes.append(False)
             else:
-                with open(SMB_CONF, "r") as f:
-                    content = f.read()
-                include_path = SHARE_CONF
-
-            if f"include = {include_path}" not in content:
-                print(f"Adding include directive to main config")
-                # Create a temporary file with updated content
-                with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp_file:
-                    if "[global]" in content:
-                        new_content = content.replace(
-                            "[global]", f"[global]\n   include = {include_path}"
-                        )
-                    else:
-                        new_content = (
-                            f"[global]\n   include = {include_path}\n\n{content}"
-                        )
-                    temp_file.write(new_content)
-                    temp_path = temp_file.name
-
-                # Use sudo to copy the temporary file to the correct location
-                if not DEV_MODE:
-                    system_conf = "/etc/samba/smb.conf"
-                    subprocess.run(["sudo", "cp", temp_path, system_conf], check=True)
-                    # Also update local copy
-                    try:
-                        subprocess.run(["cp", temp_path, "./smb.conf"], check=True)
-                        print(
-                            f"Updated local copy of main config with include directive"
-                        )
-                    except Exception as e:
-                        print(
-                            f"Warning: Could not update local copy of main config: {e}"
+                verb = "updated" if share["name"] in current else "added"
+                current[share["name"]] = share
+                results.append((True, f"Share '{share['name']}' {verb}"))
+                changes.append(True)
+
+        if transaction is not None and index + 1 == transaction[1]:
+            start, stop, snapshot = transaction
+            transaction = None
+            if not all(success for success, _ in results[start:stop]):
+                print(f"Rolling back {stop - start} share changes of a failed batch")
+                current = snapshot
+                rolled_back += [
+                    payload["path"]
+                    for action, payload in mutations[start:stop]
+                    if action == "upsert"
+                ]
+                for position in range(start, stop):
+                    success, message = results[position]
+                    if success:
+                        results[position] = (
+                            False,
+                            f"Rolled back, another change of the batch failed: {message}",
                         )
-                else:
-                    subprocess.run(["sudo", "cp", temp_path, SMB_CONF], check=True)
-
-                # Set proper permissions
-                if not DEV_MODE:
-                    subprocess.run(["sudo", "chmod", "644", system_conf], check=True)
-                else:
-                    subprocess.run(["sudo", "chmod", "644", SMB_CONF], check=True)
+                    changes[position] = False
+
+    if rolled_back:
+        kept = {share["path"] for share in current.values()}
+        _remove_created_directories(
+            directory
+            for path in rolled_back
+            if provisioned.get(path) and path not in kept
+            for directory in created[path]
+        )
 
-                os.unlink(temp_path)  # Remove the temp file
-                print(f"Added include directive to main config")
-        except Exception as e:
-            print(f"Warning: Could not update include directive: {e}")
+    if not any(success for success, _ in results):
+        return False, results
+    if not any(changes):
+        return True, results
 
-        # Validate configuration before restarting
-        try:
-            validate_cmd = ["sudo", "testparm", "-s"]
-            validate_result = subprocess.run(
-                validate_cmd, capture_output=True, text=True, check=False
-            )
-            if validate_result.returncode != 0:
-                print(
-                    f"Warning: Samba configuration validation failed: {validate_result.stderr}"
-                )
-                # Continue anyway as testparm might have warnings but still be valid
-        except Exception as e:
-            print(f"Warning: Could not validate configuration: {e}")
+    print(f"Committing {len(mutations)} share changes")
+    if not save_shares(list(current.values())):
+        results = [
+            (False, "Failed to save configuration") if success else (success, message)
+            for success, message in results
+        ]
+        return False, results
 
-        # Restart Samba service
-        print("Restarting Samba service")
-        result = restart_samba_service()
-        print(f"Samba service restart {'successful' if result else 'failed'}")
-        return result
-    except Exception as e:
-        print(f"Error saving shares: {e}")
-        return False
+    return True, results
 
 
 def add_or_update_share(new_share):
@@ -1206,38 +1752,7 @@ def add_or_update_share(new_share):
     try:
         print(f"Adding or updating share: {new_share['name']}")
 
-        # Ensure we have all required keys with normalized names
-        required_keys = [
-            "name",
-            "path",
-            "browseable",
-            "read_only",
-            "guest_ok",
-            "valid_users",
-            "write_list",
-            "create_mask",
-            "directory_mask",
-            "max_connections",
-        ]
-
-        # Add default values for missing keys
-        defaults = {
-            "comment": "",
-            "browseable": "yes",
-            "read_only": "no",
-            "guest_ok": "no",
-            "valid_users": "",
-            "write_list": "",
-            "create_mask": "0775",
-            "directory_mask": "0775",
-            "max_connections": "0",
-        }
-
-        for key, value in defaults.items():
-            if key not in new_share or not new_share[key]:
-                new_share[key] = value
-                print(f"Using default value for {key}: {value}")
-
+        apply_share_defaults(new_share)
         print(f"Processing share with path: {new_share['path']}")
 
         # Ensure the share directory exists with proper permissions
@@ -1247,6 +1762,28 @@ def add_or_update_share(new_share):
             )
             return False
 
+        # Registry shares are updated per parameter and apply without a reload
+        if SHARE_BACKEND == "registry":
+            try:
+                _ensure_registry_layout()
+                save_share_registry(new_share)
+            except subprocess.CalledProcessError as e:
+                print(f"Failed to save share to the registry: {e.stderr}")
+                return False
+            print(f"Successfully saved share: {new_share['name']}")
+            return True
+
+        # With one file per share only the fragment of this share is rewritten
+        if SHARE_BACKEND == "fragments":
+            previous = get_samba_config()
+            try:
+                save_share_fragment(new_share)
+            except Exception as e:
+                print(f"Failed to save share fragment: {e}")
+                return False
+            print(f"Successfully saved share: {new_share['name']}")
+            return _validate_and_apply(previous)
+
         # Load existing shares
         shares = load_shares()
 
@@ -1278,6 +1815,27 @@ def delete_share(name):
     """Delete a Samba share by name and restart the service"""
     try:
         print(f"Deleting share: {name}")
+
+        if SHARE_BACKEND == "registry":
+            try:
+                _ensure_registry_layout()
+                if not delete_share_registry(name):
+                    print(f"Warning: Share '{name}' not found in configuration")
+                    return False
+            except subprocess.CalledProcessError as e:
+                print(f"Error deleting share from the registry: {e.stderr}")
+                return False
+            print(f"Removed share '{name}' from the registry")
+            return True
+
+        if SHARE_BACKEND == "fragments":
+            previous = get_samba_config()
+            if not delete_share_fragment(name):
+                print(f"Warning: Share '{name}' not found in configuration")
+                return False
+            print(f"Removed share '{name}' from configuration")
+            return _validate_and_apply(previous)
+
         shares = load_shares()
         original_count = len(shares)
 
@@ -1305,24 +1863,14 @@ def delete_share(name):
 
 def list_system_users():
     try:
-        output = subprocess.check_output(["getent", "passwd"]).decode()
-        return [
-            line.split(":")[0]
-            for line in output.strip().split("\n")
-            if int(line.split(":")[2]) >= 1000
-        ]
+        return identity.users()
     except Exception:
         return []
 
 
 def list_system_groups():
     try:
-        output = subprocess.check_output(["getent", "group"]).decode()
-        return [
-            line.split(":")[0]
-            for line in output.strip().split("\n")
-            if int(line.split(":")[2]) >= 1000
-        ]
+        return identity.groups()
     except Exception:
         return []
 
@@ -1342,8 +1890,6 @@ def validate_share_path(path):
 
                 # Check if the user exists
                 try:
-                    import pwd
-
                     pwd.getpwnam(username)
                     print(f"User {username} exists")
 
@@ -1351,43 +1897,13 @@ def validate_share_path(path):
                     if not os.path.exists(path):
                         print(f"Creating directory in user's home: {path}")
                         # Create the directory with the user as owner
-                        mkdir_result = subprocess.run(
-                            ["sudo", "mkdir", "-p", path],
-                            capture_output=True,
-                            text=True,
-                            check=False,
-                        )
-                        if mkdir_result.returncode != 0:
-                            error_msg = (
-                                f"Could not create directory: {mkdir_result.stderr}"
-                            )
+                        try:
+                            privileged.make_share_dir(path, owner=username)
+                        except Exception as e:
+                            error_msg = f"Could not create directory: {_stderr(e)}"
                             print(error_msg)
                             return False, error_msg
 
-                        # Set ownership to the user
-                        chown_result = subprocess.run(
-                            ["sudo", "chown", "-R", f"{username}:{username}", path],
-                            capture_output=True,
-                            text=True,
-                            check=False,
-                        )
-                        if chown_result.returncode != 0:
-                            print(
-                                f"Warning: Could not set ownership to {username}: {chown_result.stderr}"
-                            )
-
-                        # Set permissions
-                        chmod_result = subprocess.run(
-                            ["sudo", "chmod", "-R", "0755", path],
-                            capture_output=True,
-                            text=True,
-                            check=False,
-                        )
-                        if chmod_result.returncode != 0:
-                            print(
-                                f"Warning: Could not set permissions: {chmod_result.stderr}"
-                            )
-
                         print(f"Successfully created directory in user's home: {path}")
                         return (
                             True,
@@ -1401,47 +1917,6 @@ def validate_share_path(path):
         if not os.path.exists(path):
             print(f"Path {path} does not exist, attempting to create it")
 
-            # Create parent directories first if they don't exist
-            parent_dir = os.path.dirname(path)
-            if parent_dir and not os.path.exists(parent_dir):
-                print(
-                    f"Parent directory {parent_dir} does not exist, creating it first"
-                )
-                parent_result = subprocess.run(
-                    ["sudo", "mkdir", "-p", parent_dir],
-                    capture_output=True,
-                    text=True,
-                    check=False,
-                )
-                if parent_result.returncode != 0:
-                    error_msg = (
-                        f"Could not create parent directory: {parent_result.stderr}"
-                    )
-                    print(error_msg)
-                    return False, error_msg
-
-            # Try to create the directory with sudo
-            result = subprocess.run(
-                ["sudo", "mkdir", "-p", path],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if result.returncode != 0:
-                error_msg = (
-                    f"Path does not exist and could not be created: {result.stderr}"
-                )
-                print(error_msg)
-                return False, error_msg
-
-            # Verify the directory was created
-            if not os.path.exists(path):
-                error_msg = f"Directory creation command completed but path still doesn't exist: {path}"
-                print(error_msg)
-                return False, "Path could not be created"
-
-            print(f"Successfully created directory: {path}")
-
             # Create smbusers group if it doesn't exist
             try:
                 grp.getgrnam("smbusers")
@@ -1456,73 +1931,45 @@ def validate_share_path(path):
                 )
                 if group_result.returncode != 0:
                     print(
-                        f"Warning: Could not create smbusers group: {group_result.stderr}"
-                    )
-
-            # Set proper permissions on the new directory
-            print(f"Setting ownership for {path}")
-            chown_result = subprocess.run(
-                ["sudo", "chown", "-R", "root:smbusers", path],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if chown_result.returncode != 0:
-                print(f"Warning: Could not set ownership: {chown_result.stderr}")
-
-            print(f"Setting permissions for {path}")
-            chmod_result = subprocess.run(
-                ["sudo", "chmod", "-R", "2775", path],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if chmod_result.returncode != 0:
-                print(f"Warning: Could not set permissions: {chmod_result.stderr}")
-        else:
-            print(f"Path {path} already exists")
+                        f"Warning: Could not create smbusers group: {group_result.stderr}"
+                    )
 
-        # Check if path is readable
-        try:
-            # Use sudo to check if the path is readable
-            read_result = subprocess.run(
-                ["sudo", "test", "-r", path],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if read_result.returncode != 0:
-                error_msg = f"Path is not readable: {path}"
+            # Create the directory, owned by root:smbusers with mode 2775
+            try:
+                privileged.make_share_dir(path)
+            except Exception as e:
+                error_msg = (
+                    f"Path does not exist and could not be created: {_stderr(e)}"
+                )
                 print(error_msg)
-                return False, "Path is not readable"
-        except Exception as e:
-            print(f"Error checking read access: {e}")
-            # Fall back to direct check if sudo test fails
-            if not os.access(path, os.R_OK):
-                error_msg = f"Path is not readable (direct check): {path}"
+                return False, error_msg
+
+            # Verify the directory was created
+            if not os.path.exists(path):
+                error_msg = f"Directory creation command completed but path still doesn't exist: {path}"
                 print(error_msg)
-                return False, "Path is not readable"
+                return False, "Path could not be created"
+
+            print(f"Successfully created directory: {path}")
+        else:
+            print(f"Path {path} already exists")
 
-        # Check if path is writable
+        # Check if path is readable and writable, as root
         try:
-            # Use sudo to check if the path is writable
-            write_result = subprocess.run(
-                ["sudo", "test", "-w", path],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if write_result.returncode != 0:
-                error_msg = f"Path is not writable: {path}"
-                print(error_msg)
-                return False, "Path is not writable"
+            access = privileged.stat_path(path)
         except Exception as e:
-            print(f"Error checking write access: {e}")
-            # Fall back to direct check if sudo test fails
-            if not os.access(path, os.W_OK):
-                error_msg = f"Path is not writable (direct check): {path}"
-                print(error_msg)
-                return False, "Path is not writable"
+            print(f"Error checking access: {e}")
+            # Fall back to direct checks if sudo test fails
+            access = {
+                "readable": os.access(path, os.R_OK),
+                "writable": os.access(path, os.W_OK),
+            }
+        if not access["readable"]:
+            print(f"Path is not readable: {path}")
+            return False, "Path is not readable"
+        if not access["writable"]:
+            print(f"Path is not writable: {path}")
+            return False, "Path is not writable"
 
         print(f"Path validation successful for {path}")
         return True, "Path is valid and accessible"
@@ -1532,18 +1979,23 @@ def validate_share_path(path):
         return False, f"Error validating path: {str(e)}"
 
 
+def _stderr(error):
+    """The stderr of a failed sudo command, or the error itself"""
+    return getattr(error, "stderr", None) or error
+
+
 def export_config():
     """Export the complete Samba configuration as a single file"""
     try:
-        # Read the main config
-        with open(SMB_CONF, "r") as f:
-            main_config = f.read()
+        config = get_samba_config()
+        if config.signature[0] is None:
+            raise FileNotFoundError(f"{SMB_CONF} does not exist")
 
-        # Read the shares config
-        shares_config = ""
-        if os.path.exists(SHARE_CONF):
-            with open(SHARE_CONF, "r") as f:
-                shares_config = f.read()
+        main_config = config.main_content
+        shares_config = config.shares_content
+        if config.fragment_sections or config.registry_doc.sections:
+            # Export the shares Samba actually sees, not the shares config
+            shares_config = "".join(s.text() for s in config.shares_doc.sections)
 
         # Combine them into a single valid configuration
         # Remove any include statements from main config and append shares
@@ -1565,6 +2017,8 @@ def export_config():
 def import_config(data):
     """Import a complete Samba configuration file"""
     try:
+        previous = get_samba_config()
+
         # Parse the configuration to separate global and shares
         lines = data.split('\n')
         global_section = []
@@ -1599,6 +2053,15 @@ def import_config(data):
                 with open(SHARE_CONF, "r") as f_orig:
                     f_bak.write(f_orig.read())
 
+        # The imported shares replace all existing share fragments
+        if SHARE_BACKEND == "fragments":
+            privileged.remove_files(path for path, _ in _fragment_signatures() or ())
+            _fragment_cache.clear()
+        elif SHARE_BACKEND == "registry":
+            for name in get_samba_config().registry_doc.section_names():
+                if name != "global":
+                    _run_net_conf("delshare", name)
+
         # Write the global section
         with open(SMB_CONF, "w") as f:
             f.write('\n'.join(global_section))
@@ -1607,8 +2070,9 @@ def import_config(data):
         with open(SHARE_CONF, "w") as f:
             f.write('\n'.join(shares_section))
 
-        # Restart Samba service
-        return restart_samba_service()
+        invalidate_samba_config()
+
+        return apply_samba_config(previous)
     except Exception as e:
         print(f"Error importing configuration: {e}")
         return False
@@ -1617,107 +2081,151 @@ def import_config(data):
 # User Management Functions
 
 
-def get_samba_users():
-    """Get list of Samba users with their status"""
-    if DEV_MODE:
-        # Try to get real users even in dev mode if possible
-        try:
-            # Try pdbedit first
-            success, output = run_command(["pdbedit", "-L"])
-            if success and output.strip():
-                users = []
-                for line in output.strip().split("\n"):
-                    if line.strip():
-                        parts = line.split(":")
-                        if len(parts) >= 1:
-                            username = parts[0].strip()
-                            users.append(
-                                {
-                                    "username": username,
-                                    "enabled": True,  # Assume enabled by default
-                                    "flags": "U",
-                                }
-                            )
-                return users
-
-            # Try smbpasswd -s command
-            success, output = run_command(["cat", "/etc/samba/smbpasswd"])
-            if success and output.strip():
-                users = []
-                for line in output.strip().split("\n"):
-                    if line.strip() and not line.startswith("#"):
-                        parts = line.split(":")
-                        if len(parts) >= 1:
-                            username = parts[0].strip()
-                            users.append(
-                                {"username": username, "enabled": True, "flags": "U"}
-                            )
-                return users
+# Samba users change rarely compared to how often they are listed
+SAMBA_USERS_TTL = float(os.environ.get("SAMBA_MANAGER_USERS_TTL", "60"))
+
+_samba_users_cache = {"users": None, "time": 0}
+_samba_users_lock = threading.Lock()
+
+
+def invalidate_samba_users():
+    """Forget the cached Samba user list after adding, changing or removing users"""
+    with _samba_users_lock:
+        _samba_users_cache["users"] = None
+
+
+def _list_samba_users():
+    """Enumerate Samba users with a single passdb read"""
+    users = None
+    try:
+        users = read_passdb_tdb()
+    except Exception as e:
+        print(f"Error reading {PASSDB_TDB}, falling back to pdbedit: {e}")
+    if users is not None:
+        return users
+
+    # One pdbedit call in smbpasswd format carries the account flags of
+    # every user, instead of one "pdbedit -v -u" per user
+    cmd = ["pdbedit", "-L", "-w"] if DEV_MODE else ["sudo", "pdbedit", "-L", "-w"]
+    success, output = run_command(cmd)
+    if success and output.strip():
+        return list(parse_smbpasswd(output.splitlines()))
+
+    # If pdbedit fails, try reading smbpasswd file directly
+    cmd = ["cat", "/etc/samba/smbpasswd"]
+    success, output = run_command(cmd if DEV_MODE else ["sudo", *cmd])
+    if success and output.strip():
+        return list(parse_smbpasswd(output.splitlines()))
+
+    return None
+
+
+def _cached_samba_users():
+    """Return the shared cached user list; callers must not modify it"""
+    with _samba_users_lock:
+        users = _samba_users_cache["users"]
+        age = time.monotonic() - _samba_users_cache["time"]
+        if users is not None and age < SAMBA_USERS_TTL:
+            return users
 
+    try:
+        users = _list_samba_users()
+    except Exception as e:
+        print(f"Error getting Samba users: {e}")
+        users = None
+
+    if users is None:
+        if DEV_MODE:
             # Return mock data if all else fails
             return [
                 {"username": "user1", "enabled": True, "flags": "U"},
                 {"username": "user2", "enabled": False, "flags": "UD"},
             ]
-        except Exception:
-            # Return mock data if there's an error
-            return [
-                {"username": "user1", "enabled": True, "flags": "U"},
-                {"username": "user2", "enabled": False, "flags": "UD"},
-            ]
+        # System users are not necessarily Samba users
+        return []
 
-    try:
-        # First try pdbedit with sudo
-        success, output = run_command(["sudo", "pdbedit", "-L"])
-        if success and output.strip():
-            users = []
-            for line in output.strip().split("\n"):
-                if line.strip():
-                    parts = line.split(":")
-                    if len(parts) >= 1:
-                        username = parts[0].strip()
-                        # Get detailed info for this user
-                        detail_success, detail_output = run_command(
-                            ["sudo", "pdbedit", "-v", "-u", username]
-                        )
-                        enabled = True
-                        flags = "U"
-                        if detail_success:
-                            for detail_line in detail_output.split("\n"):
-                                if "Account Flags:" in detail_line:
-                                    flags = detail_line.split(":", 1)[1].strip()
-                                    enabled = "D" not in flags
-                        users.append(
-                            {"username": username, "enabled": enabled, "flags": flags}
-                        )
-            return users
+    with _samba_users_lock:
+        _samba_users_cache["users"] = users
+        _samba_users_cache["time"] = time.monotonic()
+    return users
 
-        # If pdbedit fails, try reading smbpasswd file directly
-        success, output = run_command(["sudo", "cat", "/etc/samba/smbpasswd"])
-        if success and output.strip():
-            users = []
-            for line in output.strip().split("\n"):
-                if line.strip() and not line.startswith("#"):
-                    parts = line.split(":")
-                    if len(parts) >= 1:
-                        username = parts[0].strip()
-                        # Check if user is disabled (has 'D' flag)
-                        disabled = len(parts) > 4 and "D" in parts[4]
-                        users.append(
-                            {
-                                "username": username,
-                                "enabled": not disabled,
-                                "flags": parts[4] if len(parts) > 4 else "U",
-                            }
-                        )
-            return users
 
-        # If all else fails, return empty list instead of system users
-        # System users are not necessarily Samba users
-        return []
-    except Exception as e:
-        print(f"Error getting Samba users: {e}")
-        return []
+def get_samba_users():
+    """Get list of Samba users with their status"""
+    return [dict(user) for user in _cached_samba_users()]
+
+
+_samba_user_index = None
+
+
+def get_samba_user_index():
+    """Return a UserIndex over the cached Samba users, rebuilt when they change"""
+    global _samba_user_index
+    users = _cached_samba_users()
+    index = _samba_user_index
+    if index is None or index.source is not users:
+        index = UserIndex(users)
+        _samba_user_index = index
+    return index
+
+
+_access_matrix = {"key": None, "matrix": None}
+
+
+def get_access_matrix():
+    """Return the effective share access of every Samba user.
+
+    The matrix is rebuilt only when the config, the Samba users or the
+    system users and groups have changed since it was last computed.
+    """
+    config = get_samba_config()
+    users = _cached_samba_users()
+    key = (config, users, identity.snapshot())
+    cached = _access_matrix
+    if cached["matrix"] is not None and all(
+        a is b for a, b in zip(cached["key"], key)
+    ):
+        return cached["matrix"]
+
+    # Use the values as written: config.shares merges write list into valid
+    # users and fills in UI defaults, which would change who has access
+    defaults = config.main_sections.get("global", {})
+    shares = [
+        (
+            share["name"],
+            access_settings(
+                defaults,
+                config.main_sections.get(share["name"], {}),
+                config.share_sections.get(share["name"], {}),
+            ),
+        )
+        for share in config.shares
+    ]
+    matrix = AccessMatrix([user["username"] for user in users], shares, identity)
+    _access_matrix["key"] = key
+    _access_matrix["matrix"] = matrix
+    return matrix
+
+
+_lock_index = {"key": None, "index": None}
+
+
+def get_lock_index():
+    """Return the open files of the current smbstatus snapshot, indexed.
+
+    The index is rebuilt when a new snapshot is taken or the config changes.
+    """
+    snapshot = smbstatus.collector.snapshot()
+    config = get_samba_config()
+    key = (snapshot, config, identity.snapshot())
+    cached = _lock_index
+    if cached["index"] is not None and all(a is b for a, b in zip(cached["key"], key)):
+        return cached["index"]
+
+    index = LockIndex(snapshot, config.shares, identity)
+    _lock_index["key"] = key
+    _lock_index["index"] = index
+    return index
 
 
 def add_samba_user(username, password, create_system_user=False):
@@ -1728,10 +2236,7 @@ def add_samba_user(username, password, create_system_user=False):
 
     try:
         # Check if system user exists
-        check_user = subprocess.run(
-            ["id", username], capture_output=True, text=True, check=False
-        )
-        user_exists = check_user.returncode == 0
+        user_exists = identity.user(username) is not None
 
         # Create system user if requested and doesn't exist
         if not user_exists and create_system_user:
@@ -1760,10 +2265,7 @@ def add_samba_user(username, password, create_system_user=False):
                 return False
 
         # Create smbusers group if it doesn't exist
-        check_group = subprocess.run(
-            ["getent", "group", "smbusers"], capture_output=True, text=True, check=False
-        )
-        if check_group.returncode != 0:
+        if identity.group("smbusers") is None:
             print("Creating smbusers group")
             create_group = subprocess.run(
                 ["sudo", "groupadd", "smbusers"],
@@ -1819,9 +2321,206 @@ def add_samba_user(username, password, create_system_user=False):
     except Exception as e:
         print(f"Error adding Samba user: {e}")
         return False
+    finally:
+        invalidate_samba_users()
+
+
+# Users provisioned per round of batched commands by import_samba_users()
+USER_IMPORT_BATCH_SIZE = 500
+
+
+def _create_system_users(rows):
+    """Create system accounts for rows, returning {username: error}.
+
+    newusers creates every account and sets its password in one call. When it
+    is missing or rejects the batch, accounts are created with useradd and
+    their passwords set with a single chpasswd.
+    """
+    errors = {}
+    remaining = list(rows)
+
+    # newusers reads colon separated fields, so passwords with a colon are
+    # left to chpasswd, which only splits on the first one
+    batch = [row for row in remaining if ":" not in row["password"]]
+    if batch and shutil.which("newusers"):
+        lines = "".join(
+            f"{row['username']}:{row['password']}::::/home/{row['username']}:/bin/bash\n"
+            for row in batch
+        )
+        result = subprocess.run(
+            ["sudo", "newusers"], input=lines, capture_output=True, text=True, check=False
+        )
+        if result.returncode == 0:
+            print(f"Created {len(batch)} system users with newusers")
+            created = {row["username"] for row in batch}
+            remaining = [row for row in remaining if row["username"] not in created]
+        else:
+            print(f"newusers failed, creating users one by one: {result.stderr}")
+
+    created = []
+    for row in remaining:
+        result = subprocess.run(
+            ["sudo", "useradd", "-m", "-s", "/bin/bash", row["username"]],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if result.returncode != 0:
+            errors[row["username"]] = (
+                f"Failed to create system user: {result.stderr.strip()}"
+            )
+        else:
+            created.append(row)
+
+    if created:
+        set_pass = subprocess.run(
+            ["sudo", "chpasswd"],
+            input="".join(f"{row['username']}:{row['password']}\n" for row in created),
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if set_pass.returncode != 0:
+            print(f"Failed to set system passwords: {set_pass.stderr}")
+            for row in created:
+                errors[row["username"]] = (
+                    f"Failed to set system password: {set_pass.stderr.strip()}"
+                )
+    return errors
+
+
+def _set_group_members(memberships):
+    """Add users to groups with one gpasswd -M per group, returning {username: [warnings]}"""
+    warnings = {}
+    for group, usernames in memberships.items():
+        if identity.group(group) is None:
+            if not create_system_group(group):
+                for username in usernames:
+                    warnings.setdefault(username, []).append(
+                        f"could not create group {group}"
+                    )
+                continue
+        members = identity.members_of(group, primary=False)
+
+        if usernames <= members:
+            continue
+        result = subprocess.run(
+            ["sudo", "gpasswd", "-M", ",".join(sorted(members | usernames)), group],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if result.returncode != 0:
+            print(f"Failed to set members of group {group}: {result.stderr}")
+            for username in usernames:
+                warnings.setdefault(username, []).append(f"not added to group {group}")
+    return warnings
+
+
+def _import_samba_accounts(rows):
+    """Add Samba accounts with one pdbedit import, returning {username: error}"""
+    errors = {}
+    entries = []
+    for row in rows:
+        uid = identity.uid(row["username"])
+        if uid is None:
+            errors[row["username"]] = "System user does not exist"
+        else:
+            entries.append(format_smbpasswd(row["username"], uid, row["password"]))
+    if not entries:
+        return errors
+
+    # The file holds password hashes, mkstemp creates it readable by us only
+    fd, path = tempfile.mkstemp(prefix="samba-import-", suffix=".smbpasswd")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(entries) + "\n")
+        result = privileged.run(["pdbedit", "-i", f"smbpasswd:{path}"])
+    finally:
+        os.unlink(path)
+        invalidate_samba_users()
+
+    # pdbedit carries on past entries it cannot add, so check each user
+    imported = {user["username"] for user in _cached_samba_users()}
+    for row in rows:
+        username = row["username"]
+        if username not in errors and username not in imported:
+            errors[username] = (
+                f"Failed to create Samba user: {result.stderr.strip() or 'not imported'}"
+            )
+    return errors
+
+
+def _import_user_batch(rows):
+    if DEV_MODE:
+        print(f"[DEV MODE] Would import {len(rows)} Samba users")
+        return [(row, True, "User imported") for row in rows]
+
+    existing = {user["username"] for user in _cached_samba_users()}
+    errors = {
+        row["username"]: "Samba user already exists"
+        for row in rows
+        if row["username"] in existing
+    }
+    pending = [row for row in rows if row["username"] not in errors]
+
+    new_accounts = [
+        row
+        for row in pending
+        if row.get("create_system_user") and identity.uid(row["username"]) is None
+    ]
+    if new_accounts:
+        errors.update(_create_system_users(new_accounts))
+    pending = [row for row in pending if row["username"] not in errors]
 
+    memberships = {}
+    for row in pending:
+        if identity.uid(row["username"]) is None:
+            continue
+        for group in ["smbusers", *row.get("groups", [])]:
+            memberships.setdefault(group, set()).add(row["username"])
+    warnings = _set_group_members(memberships)
+
+    errors.update(_import_samba_accounts(pending))
+
+    results = []
+    for row in rows:
+        username = row["username"]
+        if username in errors:
+            results.append((row, False, errors[username]))
+        elif username in warnings:
+            results.append(
+                (row, True, "User imported, but " + ", ".join(warnings[username]))
+            )
+        else:
+            results.append((row, True, "User imported"))
+    return results
+
+
+def import_samba_users(rows, batch_size=USER_IMPORT_BATCH_SIZE):
+    """Add many Samba users with a handful of commands per batch.
+
+    rows are dicts with username, password, groups and create_system_user.
+    Yields (row, success, message) for every row as each batch completes.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield from _import_user_batch(batch)
+            batch = []
+    if batch:
+        yield from _import_user_batch(batch)
+
+
+def remove_share_references(kind, name):
+    """Remove a "user" or "group" from all shares with one write and one reload"""
+    success, results = commit_share_changes([("unreference", (kind, name))])
+    print(results[0][1])
+    return success
 
-def remove_samba_user(username, delete_system_user=False):
+
+def remove_samba_user(username, delete_system_user=False, remove_references=False):
     """Remove a Samba user"""
     if DEV_MODE:
         print(f"[DEV MODE] Would remove Samba user: {username}")
@@ -1831,10 +2530,15 @@ def remove_samba_user(username, delete_system_user=False):
         # Delete Samba user
         success, _ = run_command(["sudo", "smbpasswd", "-x", username])
 
+        invalidate_samba_users()
+
         # Delete system user if requested
         if delete_system_user:
             run_command(["sudo", "userdel", "-r", username])
 
+        if success and remove_references:
+            success = remove_share_references("user", username)
+
         return success
     except Exception as e:
         print(f"Error removing Samba user: {e}")
@@ -1849,6 +2553,7 @@ def enable_samba_user(username):
 
     try:
         success, _ = run_command(["sudo", "smbpasswd", "-e", username])
+        invalidate_samba_users()
         return success
     except Exception as e:
         print(f"Error enabling Samba user: {e}")
@@ -1863,6 +2568,7 @@ def disable_samba_user(username):
 
     try:
         success, _ = run_command(["sudo", "smbpasswd", "-d", username])
+        invalidate_samba_users()
         return success
     except Exception as e:
         print(f"Error disabling Samba user: {e}")
@@ -1895,8 +2601,7 @@ def ensure_samba_installed():
 
     try:
         # Check if smbd is installed
-        success, _ = run_command(["which", "smbd"])
-        if success:
+        if capabilities.samba_installed:
             return True
 
         # Install Samba
@@ -1907,6 +2612,8 @@ def ensure_samba_installed():
         success, _ = run_command(
             ["sudo", "apt-get", "install", "-y", "samba", "samba-common-bin"]
         )
+        # The installed binaries and services change what is available
+        capabilities.refresh()
         return success
     except Exception as e:
         print(f"Error installing Samba: {e}")
@@ -2073,10 +2780,9 @@ def get_samba_installation_status():
 
     try:
         # Check if Samba is installed
-        success, _ = run_command(["which", "smbd"])
-        status["installed"] = success
+        status["installed"] = capabilities.samba_installed
 
-        if not success:
+        if not status["installed"]:
             return status
 
         # Check if Samba is running
@@ -2142,7 +2848,7 @@ def create_system_group(group_name):
         return False
 
 
-def delete_system_group(group_name):
+def delete_system_group(group_name, remove_references=False):
     """Delete a system group"""
     if DEV_MODE:
         print(f"[DEV MODE] Would delete system group: {group_name}")
@@ -2150,19 +2856,12 @@ def delete_system_group(group_name):
 
     try:
         # Check if the group exists
-        try:
-            grp.getgrnam(group_name)
-        except KeyError:
+        if identity.group(group_name) is None:
             print(f"Group {group_name} does not exist")
             return False
 
         # Check if the group is a primary group for any user
-        import pwd
-
-        primary_users = []
-        for user in pwd.getpwall():
-            if user.pw_gid == grp.getgrnam(group_name).gr_gid:
-                primary_users.append(user.pw_name)
+        primary_users = identity.primary_members(group_name)
 
         if primary_users:
             print(
@@ -2173,7 +2872,8 @@ def delete_system_group(group_name):
             try:
                 # Try to use 'users' group if it exists
                 alt_group = "users"
-                grp.getgrnam(alt_group)
+                if identity.group(alt_group) is None:
+                    raise KeyError(alt_group)
 
                 # Change primary group for each user
                 for username in primary_users:
@@ -2237,44 +2937,154 @@ def delete_system_group(group_name):
             return False
 
         print(f"Successfully deleted group: {group_name}")
+        if remove_references:
+            return remove_share_references("group", group_name)
         return True
     except Exception as e:
         print(f"Error deleting system group: {e}")
         return False
 
 
-def get_disk_usage(share_path):
-    """Get disk usage information for a share path"""
-    try:
-        # Use subprocess to run df command
-        result = subprocess.run(
-            ["df", "-h", share_path], capture_output=True, text=True, check=True
-        )
+# Disk usage is cached briefly, the page and the API poll it
+DISK_USAGE_TTL = float(os.environ.get("SAMBA_MANAGER_DISK_USAGE_TTL", "30"))
 
-        # Parse the output
-        lines = result.stdout.strip().split("\n")
-        if len(lines) < 2:
-            return None
-
-        # Get headers and values
-        headers = lines[0].split()
-        values = lines[1].split()
-
-        # Create a dictionary with the disk usage information
-        usage_info = {
-            "filesystem": values[0],
-            "size": values[1],
-            "used": values[2],
-            "available": values[3],
-            "use_percent": values[4],
-            "mounted_on": values[5] if len(values) > 5 else "",
-        }
+_disk_usage_cache = {"stats": None, "config": None, "time": 0}
+_disk_usage_lock = threading.Lock()
 
-        return usage_info
-    except Exception as e:
+
+def _unescape_mount_field(value):
+    # mountinfo writes space, tab, newline and backslash as octal escapes
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), value)
+
+
+def read_mounts(mountinfo="/proc/self/mountinfo"):
+    """Return the mounted filesystems by mount point.
+
+    A later mount on the same mount point hides the earlier one, so it
+    replaces it. device is the major:minor of the filesystem, shared by
+    bind mounts of it.
+    """
+    mounts = {}
+    with open(mountinfo) as f:
+        for line in f:
+            fields = line.split()
+            # Optional fields end with "-", then fstype and source follow
+            separator = fields.index("-", 6)
+            mount_point = _unescape_mount_field(fields[4])
+            mounts[mount_point] = {
+                "device": fields[2],
+                "mount_point": mount_point,
+                "fstype": fields[separator + 1],
+                "source": _unescape_mount_field(fields[separator + 2]),
+            }
+    return mounts
+
+
+def _mount_of(path, mounts):
+    """Return the mount holding an absolute path, its longest mount point"""
+    while True:
+        mount = mounts.get(path)
+        if mount is not None or path == "/":
+            return mount
+        path = os.path.dirname(path)
+
+
+def _percent(part, total):
+    return round(100 * part / total, 1) if total else 0
+
+
+def get_disk_usage(share_path):
+    """Byte and inode counts of the filesystem holding a path, from statvfs"""
+    try:
+        st = os.statvfs(share_path)
+    except OSError as e:
         print(f"Error getting disk usage for {share_path}: {str(e)}")
         return None
 
+    size = st.f_blocks * st.f_frsize
+    free = st.f_bfree * st.f_frsize
+    available = st.f_bavail * st.f_frsize
+    used = size - free
+    inodes_used = st.f_files - st.f_ffree
+    return {
+        "size": size,
+        "used": used,
+        "free": free,
+        "available": available,
+        # Like df, relative to the space available to unprivileged users
+        "use_percent": _percent(used, used + available),
+        "inodes": st.f_files,
+        "inodes_used": inodes_used,
+        "inodes_available": st.f_favail,
+        "inodes_percent": _percent(inodes_used, inodes_used + st.f_favail),
+    }
+
+
+# Seconds connection processes get to exit after SIGTERM before SIGKILL
+TERMINATE_GRACE = float(os.environ.get("SAMBA_MANAGER_TERMINATE_GRACE", "2"))
+
+
+def _wait_for_exit(pids, timeout):
+    """Poll /proc until the processes are gone; return those still running"""
+    deadline = time.monotonic() + timeout
+    remaining = set(pids)
+    while remaining:
+        remaining = {pid for pid in remaining if privileged.process_name(pid)}
+        if not remaining or time.monotonic() >= deadline:
+            break
+        time.sleep(0.05)
+    return remaining
+
+
+def terminate_connections(pids=(), machines=(), users=(), shares=(), grace=None):
+    """Terminate every connection matching any of the selectors.
+
+    The selectors are resolved against one fresh smbstatus snapshot, each
+    target is checked to be an smbd connection process (never the main
+    smbd) through /proc, and all of them get SIGTERM in one pass. Whatever
+    is still running when the grace period ends gets SIGKILL, again in one
+    pass. Returns (success, report).
+    """
+    grace = TERMINATE_GRACE if grace is None else grace
+    snapshot = smbstatus.collector.snapshot(max_age=0)
+    targets, unmatched = snapshot.resolve(pids, machines, users, shares)
+
+    sessions = {session.pid: session for session in snapshot.sessions}
+    report = {"terminated": [], "failed": [], "skipped": [], "unmatched": unmatched}
+    selected = []
+    for pid in sorted(targets, key=int):
+        error = privileged.connection_process_error(pid)
+        if error:
+            report["skipped"].append({"pid": pid, "reason": error})
+        else:
+            selected.append(pid)
+
+    if selected:
+        print(f"Terminating {len(selected)} Samba connections")
+        privileged.kill_many(selected, "TERM")
+        running = _wait_for_exit(selected, grace)
+        if running:
+            print(f"{len(running)} connections still running, sending SIGKILL")
+            privileged.kill_many(sorted(running, key=int), "KILL")
+            running = _wait_for_exit(running, 1)
+        smbstatus.collector.invalidate()
+
+        for pid in selected:
+            session = sessions.get(pid)
+            entry = {
+                "pid": pid,
+                "username": session.username if session else "",
+                "machine": session.machine if session else "",
+                "matched": targets[pid],
+            }
+            if pid in running:
+                report["failed"].append(entry)
+            else:
+                report["terminated"].append(entry)
+
+    success = bool(report["terminated"]) and not report["failed"]
+    return success, report
+
 
 def terminate_connection(pid):
     """Terminate a Samba connection by PID"""
@@ -2287,156 +3097,34 @@ def terminate_connection(pid):
         except ValueError:
             return False, f"Invalid PID: {pid} - not a number"
 
-        # Use the numeric PID for all operations
-        pid = str(pid_num)
-
-        # Verify that the PID belongs to a Samba process
-        result = subprocess.run(
-            ["sudo", "ps", "-p", pid, "-o", "comm="],
-            capture_output=True,
-            text=True,
-            check=False,
-        )
-
-        # Check if this is a smbd process
-        process_name = result.stdout.strip()
-        if not process_name or "smbd" not in process_name:
-            return False, f"Process {pid} is not a Samba connection or doesn't exist"
-
-        # First try to get the machine name associated with this PID
-        machine_name = None
-        try:
-            # Get smbstatus output
-            status_result = subprocess.run(
-                ["sudo", "smbstatus"], capture_output=True, text=True, check=False
-            )
-
-            if status_result.returncode == 0:
-                # Parse output to find the machine associated with this PID
-                lines = status_result.stdout.strip().split("\n")
-                for line in lines:
-                    if pid in line and ("Service" not in line and "PID" not in line):
-                        parts = line.split()
-                        if len(parts) > 2:
-                            # Extract machine name (typically the 3rd column)
-                            machine_name = parts[2]
-                            break
-        except Exception as e:
-            print(f"Error getting machine name for PID {pid}: {str(e)}")
-
-        # Try to kill the process with SIGTERM first
-        kill_result = subprocess.run(
-            ["sudo", "kill", "-TERM", pid], capture_output=True, text=True, check=False
-        )
-
-        # Check if the process is still running
-        check_result = subprocess.run(
-            ["sudo", "ps", "-p", pid], capture_output=True, text=True, check=False
-        )
-
-        # If process still exists, try SIGKILL
-        if check_result.returncode == 0:
-            print(f"Process {pid} still running after SIGTERM, trying SIGKILL")
-            kill_result = subprocess.run(
-                ["sudo", "kill", "-KILL", pid],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-
-        # If we have a machine name, also try to disconnect using smbcontrol
-        if machine_name:
-            try:
-                print(f"Attempting to force disconnect machine: {machine_name}")
-                # Use smbcontrol to force disconnect the client
-                smbcontrol_result = subprocess.run(
-                    ["sudo", "smbcontrol", "smbd", "close-share", machine_name],
-                    capture_output=True,
-                    text=True,
-                    check=False,
-                )
-                if smbcontrol_result.returncode != 0:
-                    print(f"smbcontrol error: {smbcontrol_result.stderr}")
-            except Exception as e:
-                print(f"Error using smbcontrol: {str(e)}")
-
-        # Final check if the process is still running
-        final_check = subprocess.run(
-            ["sudo", "ps", "-p", pid], capture_output=True, text=True, check=False
-        )
-
-        if final_check.returncode == 0:
+        success, report = terminate_connections(pids=[str(pid_num)])
+        if report["skipped"]:
+            return False, report["skipped"][0]["reason"]
+        if not success:
             return (
                 False,
-                f"Failed to terminate connection {pid} - process still running",
+                f"Failed to terminate connection {pid_num} - process still running",
             )
-
-        return True, f"Connection {pid} terminated successfully"
+        return True, f"Connection {pid_num} terminated successfully"
     except Exception as e:
         print(f"Error terminating connection: {str(e)}")
         return False, f"Error terminating connection: {str(e)}"
 
 
 def terminate_connection_by_machine(machine):
-    """Terminate a Samba connection by machine name/IP"""
+    """Terminate all Samba connections from a machine name or IP"""
     try:
         if not machine:
             return False, "No machine name provided"
 
-        # Try to use smbcontrol to force disconnect the client
-        try:
-            print(f"Attempting to force disconnect machine: {machine}")
-            # Use smbcontrol to force disconnect the client
-            smbcontrol_result = subprocess.run(
-                ["sudo", "smbcontrol", "smbd", "close-share", machine],
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if smbcontrol_result.returncode != 0:
-                print(f"smbcontrol error: {smbcontrol_result.stderr}")
-                return (
-                    False,
-                    f"Failed to disconnect {machine}: {smbcontrol_result.stderr}",
-                )
-        except Exception as e:
-            print(f"Error using smbcontrol: {str(e)}")
-            return False, f"Error disconnecting {machine}: {str(e)}"
-
-        # Also try to find and kill the associated PID
-        try:
-            # Get smbstatus output
-            status_result = subprocess.run(
-                ["sudo", "smbstatus"], capture_output=True, text=True, check=False
-            )
-
-            if status_result.returncode == 0:
-                # Parse output to find PIDs associated with this machine
-                lines = status_result.stdout.strip().split("\n")
-                pids_to_kill = []
-
-                for line in lines:
-                    if machine in line and (
-                        "Service" not in line and "PID" not in line
-                    ):
-                        parts = line.split()
-                        if len(parts) > 2:
-                            # Extract PID (typically the 2nd column in connection list)
-                            for part in parts:
-                                try:
-                                    pid = int(part)
-                                    pids_to_kill.append(str(pid))
-                                    break
-                                except ValueError:
-                                    continue
-
-                # Kill all PIDs associated with this machine
-                for pid in pids_to_kill:
-                    print(f"Killing PID {pid} associated with machine {machine}")
-                    subprocess.run(["sudo", "kill", "-KILL", pid], check=False)
-        except Exception as e:
-            print(f"Error killing PIDs for machine {machine}: {str(e)}")
-
+        success, report = terminate_connections(machines=[machine])
+        if report["unmatched"]:
+            return False, f"No active connections from {machine}"
+        if report["failed"]:
+            count = len(report["failed"])
+            return False, f"Failed to terminate {count} connections from {machine}"
+        if not success:
+            return False, f"No Samba connections from {machine} could be terminated"
         return True, f"Connection from {machine} terminated successfully"
     except Exception as e:
         print(f"Error terminating connection for machine {machine}: {str(e)}")
@@ -2444,186 +3132,70 @@ def terminate_connection_by_machine(machine):
 
 
 def get_active_connections():
-    """Get active Samba connections"""
-    try:
-        # Use smbstatus to get active connections
-        result = subprocess.run(
-            ["sudo", "smbstatus"], capture_output=True, text=True, check=True
-        )
-
-        output = result.stdout.strip()
-
-        # Process the version information (first line)
-        lines = output.split("\n")
-        samba_version = lines[0].strip() if lines else "Unknown Samba version"
-
-        # Parse the process list section (first table with PIDs, Username, etc.)
-        processes = []
-        in_process_section = False
-        process_headers_found = False
+    """Get active Samba connections from the shared smbstatus snapshot"""
+    return smbstatus.collector.snapshot().to_dict()
 
-        # Parse the connection information (second table with Service, PID, etc.)
-        connections = []
-        in_connections_section = False
-        connections_headers_found = False
 
-        # Process each line to extract both tables
-        for i, line in enumerate(lines):
-            # Skip empty lines
-            if not line.strip():
-                continue
-
-            # Look for the process list section headers
-            if (
-                "PID" in line
-                and "Username" in line
-                and "Group" in line
-                and not process_headers_found
-            ):
-                in_process_section = True
-                process_headers_found = True
-                continue
-
-            # Skip separator lines after headers
-            if (
-                in_process_section
-                and not processes
-                and ("----------" in line or "-------" in line)
-            ):
-                continue
-
-            # Look for the connection section headers
-            if (
-                "Service" in line
-                and "pid" in line
-                and "Machine" in line
-                and not connections_headers_found
-            ):
-                in_process_section = False
-                in_connections_section = True
-                connections_headers_found = True
-                continue
-
-            # Skip separator lines after headers
-            if (
-                in_connections_section
-                and not connections
-                and ("----------" in line or "-------" in line)
-            ):
-                continue
+def get_share_usage_stats():
+    """Disk usage of every share, grouped by the filesystem holding it.
+
+    Share paths are mapped to their mount through /proc/self/mountinfo, so
+    statvfs runs once per filesystem instead of once per share. Returns
+    {"filesystems": [...], "shares": [...]} with byte and inode counts; the
+    result is shared and cached for DISK_USAGE_TTL seconds or until the
+    configuration changes, callers must not modify it.
+    """
+    config = get_samba_config()
+    with _disk_usage_lock:
+        cached = _disk_usage_cache
+        age = time.monotonic() - cached["time"]
+        if cached["config"] is config and age < DISK_USAGE_TTL:
+            return cached["stats"]
 
-            # End of connection section when we hit "Locked files:" or another section
-            if "Locked files:" in line:
-                in_connections_section = False
+        try:
+            mounts = read_mounts()
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Error reading mounts, using statvfs per share: {e}")
+            mounts = {}
+
+        filesystems = {}
+        shares = []
+        for share in config.shares:
+            path = share.get("path", "")
+            if not path or not os.path.exists(path):
                 continue
+            real = os.path.realpath(path)
+            mount = _mount_of(real, mounts) or {
+                "device": real,
+                "mount_point": real,
+                "fstype": "",
+                "source": "",
+            }
 
-            # Parse process list entries
-            if in_process_section and line.strip():
-                # Parse process details
-                parts = line.split()
-                if len(parts) >= 3:
-                    # Validate that PID is numeric
-                    pid = parts[0]
-                    try:
-                        pid_num = int(pid)
-                    except ValueError:
-                        pid = None
-
-                    # Extract machine name and IP if available
-                    machine = parts[3] if len(parts) > 3 else ""
-                    machine_ip = ""
-
-                    # Extract IP address if it's in the format machine (ipv4:x.x.x.x)
-                    if machine and "(" in machine and "ipv4:" in machine:
-                        try:
-                            ip_part = (
-                                machine.split("(ipv4:")[1].split(")")[0].split(":")[0]
-                            )
-                            if ip_part:
-                                machine_ip = ip_part
-                        except:
-                            pass
-
-                    process = {
-                        "pid": pid,
-                        "username": parts[1] if len(parts) > 1 else "",
-                        "group": parts[2] if len(parts) > 2 else "",
-                        "machine": machine,
-                        "machine_ip": machine_ip,
-                        "protocol": parts[4] if len(parts) > 4 else "",
-                        "version": parts[5] if len(parts) > 5 else "",
-                        "encryption": parts[6] if len(parts) > 6 else "",
-                        "signing": parts[7] if len(parts) > 7 else "",
-                    }
-                    processes.append(process)
-
-            # Parse connection entries
-            if in_connections_section and line.strip():
-                # Parse connection details - typically 4 columns: Service, pid, Machine, Connected at
-                parts = line.split(
-                    None, 3
-                )  # Split at most 3 times to keep the timestamp as one field
-                if len(parts) >= 3:
-                    # Validate that PID is numeric
-                    pid = parts[1]
-                    try:
-                        pid_num = int(pid)
-                    except ValueError:
-                        pid = None
-
-                    # Extract machine name and IP if available
-                    machine = parts[2] if len(parts) > 2 else ""
-                    machine_ip = ""
-
-                    # Extract IP address if it's in the format machine (ipv4:x.x.x.x)
-                    if machine and "(" in machine and "ipv4:" in machine:
-                        try:
-                            ip_part = (
-                                machine.split("(ipv4:")[1].split(")")[0].split(":")[0]
-                            )
-                            if ip_part:
-                                machine_ip = ip_part
-                        except:
-                            pass
-
-                    connection = {
-                        "service": parts[0],
-                        "pid": pid,
-                        "machine": machine,
-                        "machine_ip": machine_ip,
-                        "connected_at": parts[3] if len(parts) > 3 else "",
-                    }
-                    connections.append(connection)
-
-        return {
-            "version": samba_version,
-            "processes": processes,
-            "connections": connections,
-        }
-    except Exception as e:
-        print(f"Error getting active connections: {str(e)}")
-        return {
-            "version": "Error retrieving Samba information",
-            "processes": [],
-            "connections": [],
-        }
-
-
-def get_share_usage_stats():
-    """Get usage statistics for all shares"""
-    shares = load_shares()
-    stats = []
-
-    for share in shares:
-        path = share.get("path", "")
-        if path and os.path.exists(path):
-            usage = get_disk_usage(path)
-            if usage:
-                stats.append(
-                    {"name": share.get("name", ""), "path": path, "usage": usage}
-                )
+            filesystem = filesystems.get(mount["device"])
+            if filesystem is None:
+                usage = get_disk_usage(real)
+                if usage is None:
+                    continue
+                filesystem = filesystems[mount["device"]] = {
+                    **mount,
+                    "usage": usage,
+                    "shares": [],
+                }
+            filesystem["shares"].append(share["name"])
+            shares.append(
+                {
+                    "name": share["name"],
+                    "path": path,
+                    "device": mount["device"],
+                    "mount_point": filesystem["mount_point"],
+                    "usage": filesystem["usage"],
+                }
+            )
 
-    return stats
+        stats = {"filesystems": list(filesystems.values()), "shares": shares}
+        cached.update(stats=stats, config=config, time=time.monotonic())
+        return stats
 
 
 def list_backups():
@@ -0,0 +1,290 @@
+import re
+
+# A physical line including its line terminator (the last line may lack one)
+LINE_RE = re.compile(r"[^\n]*\n|[^\n]+$")
+
+DEFAULT_INDENT = "   "
+
+
+def normalize_key(key):
+    """Normalize a parameter name the way Samba compares them"""
+    return "".join(key.split()).lower()
+
+
+def _is_comment(stripped):
+    return stripped.startswith("#") or stripped.startswith(";")
+
+
+def _is_continued(line):
+    return line.rstrip("\r\n").endswith("\\")
+
+
+class Parameter:
+    """A "key = value" entry, possibly continued over several physical lines"""
+
+    __slots__ = ("key", "value", "raw")
+
+    def __init__(self, key, value, raw=None, indent=DEFAULT_INDENT):
+        self.key = key
+        self.value = value
+        self.raw = raw if raw is not None else f"{indent}{key} = {value}\n"
+
+    @property
+    def norm(self):
+        return normalize_key(self.key)
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Build a parameter from its physical lines, joining continuations"""
+        parts = []
+        for line in lines:
+            part = line.rstrip("\r\n")
+            if part.endswith("\\"):
+                part = part[:-1]
+            parts.append(part.strip())
+
+        key, value = " ".join(p for p in parts if p).split("=", 1)
+        return cls(key.strip(), value.strip(), "".join(lines))
+
+    def indent(self):
+        return self.raw[: len(self.raw) - len(self.raw.lstrip(" \t"))]
+
+    def line_ending(self):
+        return "\r\n" if self.raw.endswith("\r\n") else "\n"
+
+
+class Section:
+    """A [section] header followed by its parameters, comments and blank lines.
+
+    Entries are either Parameter objects or raw strings for everything that
+    is not a parameter. The serialized text is cached and only rebuilt after
+    the section is modified, so untouched sections are emitted byte for byte.
+    """
+
+    def __init__(self, name, header=None, entries=None):
+        self.name = name
+        self.header = header if header is not None else f"[{name}]\n"
+        self.entries = entries if entries is not None else []
+        self._text = None
+
+    def copy(self):
+        section = Section(self.name, self.header, list(self.entries))
+        section._text = self._text
+        return section
+
+    def text(self):
+        if self._text is None:
+            self._text = self.header + "".join(
+                entry.raw if isinstance(entry, Parameter) else entry
+                for entry in self.entries
+            )
+        return self._text
+
+    def parameters(self):
+        return [entry for entry in self.entries if isinstance(entry, Parameter)]
+
+    def _find(self, key):
+        norm = normalize_key(key)
+        return [
+            index
+            for index, entry in enumerate(self.entries)
+            if isinstance(entry, Parameter) and entry.norm == norm
+        ]
+
+    def __contains__(self, key):
+        return bool(self._find(key))
+
+    def get(self, key, default=None):
+        """Return the effective (last) value of a parameter"""
+        found = self._find(key)
+        return self.entries[found[-1]].value if found else default
+
+    def get_all(self, key):
+        return [self.entries[index].value for index in self._find(key)]
+
+    def set(self, key, value, before=None):
+        """Set a parameter, rewriting only the line that holds its effective value"""
+        value = str(value)
+        found = self._find(key)
+
+        if found:
+            entry = self.entries[found[-1]]
+            if entry.value == value:
+                return False
+            self.entries[found[-1]] = Parameter(
+                entry.key,
+                value,
+                f"{entry.indent()}{entry.key} = {value}{entry.line_ending()}",
+            )
+        else:
+            self.add(key, value, before=before)
+
+        self._text = None
+        return True
+
+    def add(self, key, value, before=None):
+        """Append a parameter after the last existing one in the section.
+
+        If before names a parameter present in the section, the new one is
+        inserted ahead of its first occurrence instead.
+        """
+        params = self.parameters()
+        indent = params[-1].indent() if params else DEFAULT_INDENT
+        entry = Parameter(key, str(value), indent=indent)
+
+        anchors = self._find(before) if before else []
+        if anchors:
+            self.entries.insert(anchors[0], entry)
+            self._text = None
+            return entry
+
+        position = 0
+        for index, existing in enumerate(self.entries):
+            if isinstance(existing, Parameter):
+                position = index + 1
+
+        # Make sure the previous line is terminated before appending after it
+        if position > 0:
+            previous = self.entries[position - 1]
+            raw = previous.raw if isinstance(previous, Parameter) else previous
+            if not raw.endswith("\n"):
+                if isinstance(previous, Parameter):
+                    # Parameters may be shared with copies of the document
+                    self.entries[position - 1] = Parameter(
+                        previous.key, previous.value, previous.raw + "\n"
+                    )
+                else:
+                    self.entries[position - 1] = previous + "\n"
+        elif not self.header.endswith("\n"):
+            self.header += "\n"
+
+        self.entries.insert(position, entry)
+        self._text = None
+        return entry
+
+    def remove(self, key):
+        """Remove every occurrence of a parameter, returning how many were removed"""
+        found = self._find(key)
+        for index in reversed(found):
+            del self.entries[index]
+        if found:
+            self._text = None
+        return len(found)
+
+    def to_dict(self):
+        return {entry.key: entry.value for entry in self.parameters()}
+
+
+class ConfigDocument:
+    """Lossless syntax tree of an smb.conf style file.
+
+    str(document) reproduces the parsed text exactly; edits only rewrite the
+    sections (and within them, the lines) they touch.
+    """
+
+    def __init__(self, preamble=None, sections=None):
+        self.preamble = preamble if preamble is not None else []
+        self.sections = sections if sections is not None else []
+
+    @classmethod
+    def parse(cls, text):
+        document = cls()
+        target = document.preamble
+        section = None
+        pending = []
+
+        for line in LINE_RE.findall(text or ""):
+            if pending:
+                pending.append(line)
+                if not _is_continued(line):
+                    target.append(Parameter.from_lines(pending))
+                    pending = []
+                continue
+
+            stripped = line.strip()
+            if stripped.startswith("[") and "]" in stripped:
+                section = Section(stripped[1 : stripped.index("]")].strip(), line)
+                document.sections.append(section)
+                target = section.entries
+            elif section is not None and "=" in stripped and not _is_comment(stripped):
+                if _is_continued(line):
+                    pending = [line]
+                else:
+                    target.append(Parameter.from_lines([line]))
+            else:
+                target.append(line)
+
+        # A continuation at the very end of the file has nothing to join
+        if pending:
+            target.append(Parameter.from_lines(pending))
+
+        return document
+
+    def __str__(self):
+        return "".join(self.preamble) + "".join(
+            section.text() for section in self.sections
+        )
+
+    def copy(self):
+        """Copy the document so it can be edited without touching the original"""
+        return ConfigDocument(
+            list(self.preamble), [section.copy() for section in self.sections]
+        )
+
+    def section(self, name):
+        """Return the first section with the given name (case-insensitive)"""
+        name = name.lower()
+        for section in self.sections:
+            if section.name.lower() == name:
+                return section
+        return None
+
+    def section_names(self):
+        return [section.name for section in self.sections]
+
+    def add_section(self, name, parameters=None, section=None):
+        """Append a new section (or a copy of an existing one) to the document"""
+        if section is None:
+            section = Section(name)
+            for key, value in parameters or []:
+                section.add(key, value)
+
+        # Separate the new section from the previous content by a blank line
+        text = self.sections[-1].text() if self.sections else "".join(self.preamble)
+        if text and not text.endswith("\n"):
+            self._append_to_tail("\n")
+            text += "\n"
+        if text.strip() and not text.endswith("\n\n"):
+            self._append_to_tail("\n")
+
+        self.sections.append(section)
+        return section
+
+    def insert_section(self, index, name):
+        """Insert an empty section at the given position"""
+        section = Section(name, entries=["\n"])
+        self.sections.insert(index, section)
+        return section
+
+    def _append_to_tail(self, text):
+        if self.sections:
+            tail = self.sections[-1]
+            tail.entries.append(text)
+            tail._text = None
+        else:
+            self.preamble.append(text)
+
+    def remove_section(self, name):
+        """Remove every section with the given name, returning how many were removed"""
+        name = name.lower()
+        remaining = [s for s in self.sections if s.name.lower() != name]
+        removed = len(self.sections) - len(remaining)
+        self.sections = remaining
+        return removed
+
+    def to_dict(self):
+        """Return {section: {key: value}}, merging repeated sections like Samba does"""
+        sections = {}
+        for section in self.sections:
+            sections.setdefault(section.name, {}).update(section.to_dict())
+        return sections
@@ -0,0 +1,440 @@
+import ipaddress
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+from . import privileged
+
+# How long one smbstatus run is shared by all requests
+SMBSTATUS_TTL = float(os.environ.get("SAMBA_MANAGER_SMBSTATUS_TTL", "5"))
+
+
+@dataclass
+class Session:
+    """An smbd process serving one client session"""
+
+    pid: str
+    username: str = ""
+    group: str = ""
+    machine: str = ""
+    machine_ip: str = ""
+    protocol: str = ""
+    version: str = ""
+    encryption: str = ""
+    signing: str = ""
+
+
+@dataclass
+class ShareConnection:
+    """A tree connect to a share"""
+
+    service: str
+    pid: str
+    machine: str = ""
+    machine_ip: str = ""
+    connected_at: str = ""
+    encryption: str = ""
+    signing: str = ""
+
+
+@dataclass
+class LockedFile:
+    """An open file, as listed under "Locked files" """
+
+    pid: str
+    uid: str = ""
+    deny_mode: str = ""
+    access: str = ""
+    rw: str = ""
+    oplock: str = ""
+    share_path: str = ""
+    name: str = ""
+    time: str = ""
+
+
+@dataclass
+class StatusSnapshot:
+    version: str
+    sessions: list = field(default_factory=list)
+    connections: list = field(default_factory=list)
+    locks: list = field(default_factory=list)
+    source: str = "text"
+    taken_at: float = field(default_factory=time.time)
+    error: str = None
+    _index: dict = field(default=None, init=False, repr=False, compare=False)
+
+    def index(self):
+        """Session and connection pids by pid, machine, address, user and share"""
+        if self._index is None:
+            index = {"pid": {}, "machine": {}, "address": {}, "user": {}, "share": {}}
+
+            def add(kind, key, pid):
+                if key:
+                    index[kind].setdefault(key, set()).add(pid)
+
+            for entry in self.sessions + self.connections:
+                add("pid", entry.pid, entry.pid)
+                # "host (ipv4:10.0.0.5:51234)" can be selected by host or address
+                add("machine", entry.machine, entry.pid)
+                add("machine", entry.machine.split(" (")[0], entry.pid)
+                add("address", entry.machine_ip, entry.pid)
+            for session in self.sessions:
+                add("user", session.username, session.pid)
+            for connection in self.connections:
+                add("share", connection.service, connection.pid)
+            self._index = index
+        return self._index
+
+    def resolve(self, pids=(), machines=(), users=(), shares=()):
+        """Return ({pid: [selectors]}, [unmatched selectors]).
+
+        Machines match a name, an address or a network such as 10.1.2.0/24.
+        Listed pids are returned even if this snapshot does not know them,
+        so callers must check that they are connection processes.
+        """
+        index = self.index()
+        targets = {}
+        unmatched = []
+
+        def select(selector, matched):
+            if not matched:
+                unmatched.append(selector)
+            for pid in matched:
+                targets.setdefault(pid, []).append(selector)
+
+        for pid in pids:
+            select(f"pid:{pid}", {str(pid)})
+        for machine in machines:
+            matched = index["machine"].get(machine, set())
+            matched = matched | index["address"].get(machine, set())
+            if "/" in machine:
+                try:
+                    network = ipaddress.ip_network(machine, strict=False)
+                except ValueError:
+                    network = None
+                for address, address_pids in index["address"].items():
+                    try:
+                        if network and ipaddress.ip_address(address) in network:
+                            matched = matched | address_pids
+                    except ValueError:
+                        continue
+            select(f"machine:{machine}", matched)
+        for user in users:
+            select(f"user:{user}", index["user"].get(user, set()))
+        for share in shares:
+            select(f"share:{share}", index["share"].get(share, set()))
+        return targets, unmatched
+
+    def to_dict(self):
+        """The shape get_active_connections() has always returned, plus locks"""
+        return {
+            "version": self.version,
+            "processes": [asdict(session) for session in self.sessions],
+            "connections": [asdict(connection) for connection in self.connections],
+            "locked_files": [asdict(lock) for lock in self.locks],
+            "source": self.source,
+            "taken_at": self.taken_at,
+        }
+
+
+def machine_ip(value):
+    """Extract the address from "host (ipv4:10.0.0.5:51234)" or "ipv6:[::1]:445" """
+    match = re.search(r"ipv4:([\d.]+)", value)
+    if match:
+        return match.group(1)
+    match = re.search(r"ipv6:\[?([0-9a-fA-F:]+?)\]?(?::\d+)?(?:\)|$)", value)
+    if match:
+        return match.group(1)
+    match = re.fullmatch(r"[\d.]+|[0-9a-fA-F:]*:[0-9a-fA-F:]*", value.strip())
+    return match.group(0) if match else ""
+
+
+def _crypto(value):
+    """Format an encryption/signing object like the text output does"""
+    if not isinstance(value, dict):
+        return ""
+    degree = value.get("degree", "")
+    cipher = value.get("cipher", "")
+    if not degree or degree == "none":
+        return "-"
+    return f"{degree}({cipher})" if cipher else degree
+
+
+def _rw_mode(access_mask):
+    """RDONLY, WRONLY or RDWR from a FILE_READ_DATA/FILE_WRITE_DATA mask"""
+    read = access_mask & 0x1
+    write = access_mask & 0x2
+    if read and write:
+        return "RDWR"
+    return "WRONLY" if write else "RDONLY"
+
+
+def parse_json(text):
+    """Build a snapshot from "smbstatus --json" (Samba 4.16 and later)"""
+    data = json.loads(text)
+    version = data.get("version", "")
+    snapshot = StatusSnapshot(
+        version=f"Samba version {version}" if version else "Unknown Samba version",
+        source="json",
+    )
+
+    for session in (data.get("sessions") or {}).values():
+        remote = session.get("remote_machine", "")
+        hostname = session.get("hostname", "")
+        snapshot.sessions.append(
+            Session(
+                pid=str(session.get("server_id", {}).get("pid", "")),
+                username=session.get("username", ""),
+                group=session.get("groupname", ""),
+                machine=f"{remote} ({hostname})" if hostname else remote,
+                machine_ip=machine_ip(hostname) or remote,
+                protocol=session.get("session_dialect", ""),
+                encryption=_crypto(session.get("encryption")),
+                signing=_crypto(session.get("signing")),
+            )
+        )
+
+    for tcon in (data.get("tcons") or {}).values():
+        machine = tcon.get("machine", "")
+        snapshot.connections.append(
+            ShareConnection(
+                service=tcon.get("service", ""),
+                pid=str(tcon.get("server_id", {}).get("pid", "")),
+                machine=machine,
+                machine_ip=machine_ip(machine),
+                connected_at=tcon.get("connected_at", ""),
+                encryption=_crypto(tcon.get("encryption")),
+                signing=_crypto(tcon.get("signing")),
+            )
+        )
+
+    for open_file in (data.get("open_files") or {}).values():
+        for entry in (open_file.get("opens") or {}).values():
+            access = entry.get("access_mask", {})
+            mask = int(access.get("hex", "0x0"), 16)
+            snapshot.locks.append(
+                LockedFile(
+                    pid=str(entry.get("server_id", {}).get("pid", "")),
+                    uid=str(entry.get("uid", "")),
+                    deny_mode=entry.get("sharemode", {}).get("text", ""),
+                    access=access.get("hex", ""),
+                    rw=_rw_mode(mask),
+                    oplock=entry.get("oplock", {}).get("text", "")
+                    or entry.get("lease", {}).get("text", ""),
+                    share_path=open_file.get("service_path", ""),
+                    name=open_file.get("filename", ""),
+                    time=entry.get("opened_at", ""),
+                )
+            )
+
+    return snapshot
+
+
+# Rows of the three tables in the plain text output
+_SESSION_ROW = re.compile(
+    r"^(?P<pid>\d+)\s+(?P<username>\S+)\s+(?P<group>\S+)\s+"
+    r"(?P<machine>\S+(?:\s+\([^)]*\))?)\s*(?P<rest>.*)$"
+)
+_CONNECTION_ROW = re.compile(
+    r"^(?P<service>.+?)\s+(?P<pid>\d+)\s+(?P<machine>\S+)\s+(?P<rest>.*)$"
+)
+_LOCK_ROW = re.compile(
+    r"^(?P<pid>\d+)\s+(?P<uid>\d+)\s+(?P<deny_mode>\S+)\s+(?P<access>0x[0-9a-fA-F]+)\s+"
+    r"(?P<rw>\S+)\s+(?P<oplock>\S+)\s+(?P<rest>.*)$"
+)
+_LOCK_TIME = re.compile(r"\s+(\w{3}\s+\w{3}\s+\d+\s+[\d:]+\s+\d{4})\s*$")
+
+
+def parse_text(text):
+    """Build a snapshot from the plain smbstatus output.
+
+    Rows are matched by shape rather than by column position, so machine
+    names with the "(ipv4:...)" suffix and multi-word dates are kept whole.
+    """
+    lines = text.splitlines()
+    version = next((line.strip() for line in lines if line.strip()), "")
+    snapshot = StatusSnapshot(version=version or "Unknown Samba version")
+
+    section = None
+    crypto_columns = False
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or set(stripped) == {"-"}:
+            continue
+
+        words = stripped.split()
+        if words[:3] == ["PID", "Username", "Group"]:
+            section = "sessions"
+            continue
+        if words[:3] == ["Service", "pid", "Machine"]:
+            section = "connections"
+            crypto_columns = "Encryption" in words
+            continue
+        if stripped.startswith("Locked files"):
+            section = "locks_header"
+            continue
+        if section == "locks_header" and words[:1] == ["Pid"]:
+            section = "locks"
+            continue
+        if stripped.startswith(
+            ("Samba version", "No locked files", "Byte range locks")
+        ):
+            section = None
+            continue
+
+        if section == "sessions":
+            match = _SESSION_ROW.match(stripped)
+            if match:
+                rest = match.group("rest").split()
+                snapshot.sessions.append(
+                    Session(
+                        pid=match.group("pid"),
+                        username=match.group("username"),
+                        group=match.group("group"),
+                        machine=match.group("machine"),
+                        machine_ip=machine_ip(match.group("machine")),
+                        protocol=rest[0] if rest else "",
+                        encryption=rest[1] if len(rest) > 1 else "",
+                        signing=rest[2] if len(rest) > 2 else "",
+                    )
+                )
+        elif section == "connections":
+            match = _CONNECTION_ROW.match(stripped)
+            if match:
+                rest = match.group("rest")
+                encryption = signing = ""
+                if crypto_columns:
+                    parts = rest.rsplit(None, 2)
+                    if len(parts) == 3:
+                        rest, encryption, signing = parts
+                snapshot.connections.append(
+                    ShareConnection(
+                        service=match.group("service"),
+                        pid=match.group("pid"),
+                        machine=match.group("machine"),
+                        machine_ip=machine_ip(match.group("machine")),
+                        connected_at=rest.strip(),
+                        encryption=encryption,
+                        signing=signing,
+                    )
+                )
+        elif section == "locks":
+            match = _LOCK_ROW.match(stripped)
+            if match:
+                rest = match.group("rest")
+                opened = ""
+                time_match = _LOCK_TIME.search(rest)
+                if time_match:
+                    opened = time_match.group(1)
+                    rest = rest[: time_match.start()]
+                # SharePath and Name are separated by a run of padding
+                paths = re.split(r"\s{2,}", rest.strip(), maxsplit=1)
+                snapshot.locks.append(
+                    LockedFile(
+                        pid=match.group("pid"),
+                        uid=match.group("uid"),
+                        deny_mode=match.group("deny_mode"),
+                        access=match.group("access"),
+                        rw=match.group("rw"),
+                        oplock=match.group("oplock"),
+                        share_path=paths[0],
+                        name=paths[1] if len(paths) > 1 else "",
+                        time=opened,
+                    )
+                )
+
+    return snapshot
+
+
+# Output of a smbstatus that does not know --json: popt's unknown option
+# error followed by the usage, or a build without the JSON library
+_JSON_UNSUPPORTED = re.compile(
+    r"unknown option|unrecognized option|invalid option|usage:"
+    r"|json support not available",
+    re.IGNORECASE,
+)
+
+
+def _json_unsupported(result):
+    """Whether a failed "smbstatus --json" run says the option is not supported"""
+    return bool(_JSON_UNSUPPORTED.search(f"{result.stderr}\n{result.stdout}"))
+
+
+class StatusCollector:
+    """Runs smbstatus at most once per TTL and shares the result.
+
+    "smbstatus --json" is tried first; when this Samba does not support it
+    the collector remembers that and parses the text output from then on.
+    Any other failure of the JSON run only falls back to the text output
+    for that run, and JSON is tried again the next time.
+    Concurrent callers of an expired snapshot wait for a single run.
+    """
+
+    def __init__(self, ttl=SMBSTATUS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot = None
+        self._json_supported = None
+
+    def collect(self):
+        """Run smbstatus now and return a new snapshot"""
+        if self._json_supported is not False:
+            result = privileged.run(["smbstatus", "--json"])
+            if result.returncode == 0:
+                try:
+                    snapshot = parse_json(result.stdout)
+                    self._json_supported = True
+                    return snapshot
+                except ValueError as e:
+                    print(f"Could not parse smbstatus --json output: {e}")
+            elif _json_unsupported(result):
+                print("smbstatus --json is not available, using the text output")
+                self._json_supported = False
+            else:
+                print(f"smbstatus --json failed: {result.stderr.strip()}")
+
+        result = privileged.run(["smbstatus"])
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "smbstatus failed")
+        return parse_text(result.stdout)
+
+    def refresh(self):
+        try:
+            snapshot = self.collect()
+        except Exception as e:
+            print(f"Error getting active connections: {e}")
+            # Failures are cached too, so a broken smbstatus is not re-run per request
+            snapshot = StatusSnapshot(
+                version="Error retrieving Samba information", error=str(e)
+            )
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def _fresh(self, max_age):
+        with self._lock:
+            return (
+                self._snapshot is not None
+                and time.time() - self._snapshot.taken_at < max_age
+            )
+
+    def snapshot(self, max_age=None):
+        """Return a snapshot no older than max_age seconds (default: the TTL)"""
+        max_age = self.ttl if max_age is None else max_age
+        if not self._fresh(max_age):
+            with self._refresh_lock:
+                if not self._fresh(max_age):
+                    return self.refresh()
+        with self._lock:
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+collector = StatusCollector()
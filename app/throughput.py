@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+
+from . import privileged, smbstatus
+from .events import broker
+
+# Seconds between two samples of the smbd processes
+THROUGHPUT_INTERVAL = float(os.environ.get("SAMBA_MANAGER_THROUGHPUT_INTERVAL", "2"))
+
+# Sampling stops when nobody asked for throughput for this many seconds and
+# no live event stream is open
+THROUGHPUT_IDLE = 60
+
+# Rows sent in each "throughput" event of the live stream
+THROUGHPUT_EVENT_ROWS = 20
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+# Rates per process, in bytes per second or percent of one CPU:
+# disk_* from read_bytes/write_bytes (storage), io_* from rchar/wchar
+# (everything read or written, including the client socket)
+_IO_COUNTERS = {
+    "disk_read": "read_bytes",
+    "disk_write": "write_bytes",
+    "io_read": "rchar",
+    "io_write": "wchar",
+}
+RATE_KEYS = ("disk_read", "disk_write", "io_read", "io_write", "cpu")
+
+SORT_KEYS = {
+    "disk": lambda row: row["disk_read"] + row["disk_write"],
+    "disk_read": lambda row: row["disk_read"],
+    "disk_write": lambda row: row["disk_write"],
+    "io": lambda row: row["io_read"] + row["io_write"],
+    "cpu": lambda row: row["cpu"],
+}
+GROUPS = ("session", "client", "user", "share")
+
+
+class ThroughputSampler:
+    """Read, write and CPU rates of every smbd connection process.
+
+    Each sample is one walk over /proc (through the privileged helper when
+    it runs), compared with the previous one; a pid whose start time
+    changed is a new process and gets no rate until its next sample. Rates
+    are joined with the sessions and share connections of the cached
+    smbstatus snapshot when they are read.
+    """
+
+    def __init__(self, interval=THROUGHPUT_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._previous = None
+        self._rates = {}
+        self._io_available = False
+        self._taken_at = None
+        self._last_used = 0
+        self._sampler = None
+
+    def sample(self):
+        processes = privileged.smbd_processes()
+        now = time.monotonic()
+
+        rates = {}
+        if self._previous is not None:
+            then, previous = self._previous
+            elapsed = now - then
+            for pid, current in processes.items():
+                before = previous.get(pid)
+                if before is None or before["start"] != current["start"]:
+                    continue
+                ticks = current["cpu_ticks"] - before["cpu_ticks"]
+                rate = {"cpu": round(100 * ticks / CLOCK_TICKS / elapsed, 1)}
+                for key, counter in _IO_COUNTERS.items():
+                    if current["io"] and before["io"]:
+                        delta = current["io"][counter] - before["io"][counter]
+                        rate[key] = int(max(delta, 0) / elapsed)
+                    else:
+                        rate[key] = 0
+                rates[pid] = rate
+
+        with self._lock:
+            self._previous = (now, processes)
+            self._rates = rates
+            self._io_available = any(p["io"] for p in processes.values())
+            self._taken_at = time.time()
+        return rates
+
+    def _report(self, group="session", sort="disk", limit=20):
+        if group not in GROUPS:
+            raise ValueError(f"Invalid group: {group}")
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Invalid sort: {sort}")
+
+        with self._lock:
+            rates = self._rates
+            io_available = self._io_available
+            taken_at = self._taken_at
+
+        snapshot = smbstatus.collector.snapshot()
+        sessions = {session.pid: session for session in snapshot.sessions}
+        shares = {}
+        for connection in snapshot.connections:
+            shares.setdefault(connection.pid, []).append(connection.service)
+
+        rows = {}
+        totals = dict.fromkeys(RATE_KEYS, 0)
+        for pid, rate in rates.items():
+            session = sessions.get(pid)
+            username = session.username if session else ""
+            machine = session.machine if session else ""
+            address = session.machine_ip if session else ""
+            pid_shares = sorted(set(shares.get(pid, ())))
+            for key in RATE_KEYS:
+                totals[key] += rate[key]
+
+            if group == "session":
+                keys = [pid]
+            elif group == "client":
+                keys = [address or machine or "unknown"]
+            elif group == "user":
+                keys = [username or "unknown"]
+            else:
+                # A process serving several shares counts fully for each of them
+                keys = pid_shares or ["unknown"]
+
+            for key in keys:
+                row = rows.get(key)
+                if row is None:
+                    row = rows[key] = {group: key, "pids": []}
+                    row.update(dict.fromkeys(RATE_KEYS, 0))
+                    if group == "session":
+                        row.update(
+                            username=username,
+                            machine=machine,
+                            machine_ip=address,
+                            shares=pid_shares,
+                        )
+                row["pids"].append(pid)
+                for rate_key in RATE_KEYS:
+                    row[rate_key] += rate[rate_key]
+
+        ranked = sorted(rows.values(), key=SORT_KEYS[sort], reverse=True)
+        for row in ranked:
+            row["cpu"] = round(row["cpu"], 1)
+        totals["cpu"] = round(totals["cpu"], 1)
+        return {
+            "group": group,
+            "sort": sort,
+            "interval": self.interval,
+            "taken_at": taken_at,
+            "io_available": io_available,
+            "rows": ranked[:limit],
+            "totals": totals,
+        }
+
+    def top(self, group="session", sort="disk", limit=20):
+        """Rank sessions, clients, users or shares by a rate, highest first"""
+        self._last_used = time.monotonic()
+        self.start()
+        return self._report(group, sort, limit)
+
+    def start(self):
+        """Start sampling in the background, if it is not running yet"""
+        with self._lock:
+            if self._sampler is not None:
+                return
+            self._sampler = threading.Thread(
+                target=self._run, name="throughput", daemon=True
+            )
+            self._sampler.start()
+
+    def _wanted(self):
+        idle = time.monotonic() - self._last_used
+        return idle < THROUGHPUT_IDLE or broker.has_subscribers()
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+                if broker.has_subscribers():
+                    report = self._report(limit=THROUGHPUT_EVENT_ROWS)
+                    broker.publish("throughput", report)
+            except Exception as e:
+                print(f"Error sampling smbd throughput: {e}")
+            time.sleep(self.interval)
+
+            with self._lock:
+                if not self._wanted():
+                    # Stop sampling, the next request starts a new sampler
+                    self._sampler = None
+                    self._previous = None
+                    self._rates = {}
+                    return
+
+
+sampler = ThroughputSampler()
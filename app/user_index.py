@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+from bisect import bisect_left
+
+# Sort orders supported by UserIndex.query(), mapped to their sort keys.
+# Every key ends with the lower-cased username so keys are unique.
+SORT_KEYS = {
+    "username": lambda user: (user["username"].lower(),),
+    "uid": lambda user: (
+        user.get("uid") if user.get("uid") is not None else -1,
+        user["username"].lower(),
+    ),
+    "status": lambda user: (int(bool(user["enabled"])), user["username"].lower()),
+    "flags": lambda user: (user.get("flags", ""), user["username"].lower()),
+}
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the sort key stored in a cursor, raising ValueError if it is invalid"""
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}") from None
+
+
+class UserIndex:
+    """Sorted views over a list of Samba users for paging and prefix search.
+
+    Views are built lazily per sort order. A page is located with a binary
+    search on the cursor, so the cost of a request depends on the page size
+    rather than on the number of users.
+    """
+
+    def __init__(self, users):
+        self.source = users
+        self._views = {}
+
+    def _view(self, sort):
+        """Return (users, keys) sorted ascending by the given sort order"""
+        view = self._views.get(sort)
+        if view is None:
+            key = SORT_KEYS[sort]
+            users = sorted(self.source, key=key)
+            view = (users, [key(user) for user in users])
+            self._views[sort] = view
+        return view
+
+    def _prefix_range(self, prefix):
+        """Return the [lo, hi) slice of the username view matching a prefix"""
+        _, keys = self._view("username")
+        lo = bisect_left(keys, (prefix,))
+        hi = bisect_left(keys, (prefix + "\uffff",))
+        return lo, hi
+
+    def query(
+        self,
+        prefix="",
+        enabled=None,
+        flag=None,
+        sort="username",
+        descending=False,
+        cursor=None,
+        limit=50,
+    ):
+        """Return (users, next_cursor, total) for one page of matching users"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort order: {sort}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        prefix = prefix.lower()
+
+        users, keys = self._view(sort)
+        lo, hi = 0, len(users)
+        if prefix and sort == "username":
+            # The matching users are a contiguous slice of the username view
+            lo, hi = self._prefix_range(prefix)
+
+        def matches(user):
+            if prefix and not user["username"].lower().startswith(prefix):
+                return False
+            if enabled is not None and bool(user["enabled"]) != enabled:
+                return False
+            if flag and flag not in user.get("flags", ""):
+                return False
+            return True
+
+        start = hi if descending else lo
+        if cursor is not None:
+            key = decode_cursor(cursor)
+            try:
+                start = bisect_left(keys, key, lo, hi)
+            except TypeError:
+                raise ValueError("Cursor does not match the sort order") from None
+            if not descending and start < hi and keys[start] == key:
+                start += 1
+
+        if descending:
+            positions = range(start - 1, lo - 1, -1)
+        else:
+            positions = range(start, hi)
+
+        page = []
+        next_cursor = None
+        for position in positions:
+            user = users[position]
+            if not matches(user):
+                continue
+            if len(page) == limit:
+                next_cursor = encode_cursor(keys[page_last])
+                break
+            page.append(user)
+            page_last = position
+
+        if enabled is None and not flag and (not prefix or sort == "username"):
+            total = hi - lo
+        else:
+            total = sum(1 for user in users[lo:hi] if matches(user))
+
+        return [dict(user) for user in page], next_cursor, total
@@ -0,0 +1,60 @@
+import grp
+import pwd
+
+from app.access import AccessMatrix, access_settings
+from app.identity import _Snapshot
+
+USERS = ["alice", "bob", "carol", "dave"]
+
+
+class FakeIdentity:
+    def __init__(self, groups):
+        users = [
+            pwd.struct_passwd((name, "x", 1000 + i, 1000 + i, "", "/", "/bin/sh"))
+            for i, name in enumerate(USERS)
+        ]
+        groups = [
+            grp.struct_group((name, "x", 2000 + i, members))
+            for i, (name, members) in enumerate(groups.items())
+        ]
+        self._snapshot = _Snapshot(users, groups)
+
+    def snapshot(self):
+        return self._snapshot
+
+
+def matrix(*sections, groups=None):
+    settings = access_settings(*sections)
+    return AccessMatrix(USERS, [("docs", settings)], FakeIdentity(groups or {}))
+
+
+def test_write_list_alone_leaves_the_share_readable_by_everyone():
+    result = matrix({"read only": "yes", "write list": "alice"}).for_share("docs")
+
+    assert result["readers"] == USERS
+    assert result["writers"] == ["alice"]
+
+
+def test_read_list_invalid_users_and_valid_users():
+    result = matrix(
+        {
+            "valid users": "@staff, dave",
+            "invalid users": "carol",
+            "read list": "bob, dave",
+            "write list": "dave",
+            "writeable": "yes",
+        },
+        groups={"staff": ["alice", "bob", "carol"]},
+    ).for_share("docs")
+
+    assert result["readers"] == ["alice", "bob", "dave"]
+    assert result["writers"] == ["alice", "dave"]
+
+
+def test_share_values_override_global_defaults():
+    result = matrix(
+        {"read only": "no", "guest ok": "yes"}, {"Read Only": "yes"}
+    ).for_share("docs")
+
+    assert result["writers"] == []
+    assert result["guest"] == "read"
@@ -0,0 +1,66 @@
+import json
+from types import SimpleNamespace
+
+from app import events, smbstatus
+
+SESSION = {"pid": "101", "username": "alice", "machine": "10.0.0.5"}
+
+
+def status(*sessions):
+    data = {"version": "4.19", "processes": list(sessions), "connections": []}
+    return SimpleNamespace(error=None, to_dict=lambda: data)
+
+
+def decode(message):
+    lines = dict(line.split(": ", 1) for line in message.strip().splitlines())
+    return lines["event"], json.loads(lines["data"])
+
+
+def test_failed_sample_is_reported_and_retried(monkeypatch):
+    replies = [RuntimeError("smbstatus timed out"), status(SESSION)]
+
+    def snapshot(max_age=None):
+        reply = replies.pop(0) if replies else status(SESSION)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(smbstatus.collector, "snapshot", snapshot)
+    monkeypatch.setattr(events, "get_samba_status", lambda: {"smbd": "running"})
+    broker = events.EventBroker(sample_interval=0.01)
+
+    subscription = broker.subscribe()
+    try:
+        event, data = decode(subscription.get(timeout=1))
+        assert event == "snapshot"
+        assert data["error"] == "smbstatus timed out"
+        assert data["processes"] == []
+
+        event, data = decode(subscription.get(timeout=1))
+        assert event == "session_opened"
+        assert data["username"] == "alice"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def test_sampler_failure_is_sent_as_sampler_error(monkeypatch):
+    replies = [status(), RuntimeError("smbstatus timed out")]
+
+    def snapshot(max_age=None):
+        reply = replies.pop(0) if replies else status()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(smbstatus.collector, "snapshot", snapshot)
+    monkeypatch.setattr(events, "get_samba_status", lambda: {"smbd": "running"})
+    broker = events.EventBroker(sample_interval=0.01)
+
+    subscription = broker.subscribe()
+    try:
+        assert decode(subscription.get(timeout=1))[0] == "snapshot"
+        event, data = decode(subscription.get(timeout=1))
+        assert event == "sampler_error"
+        assert data["message"] == "smbstatus timed out"
+    finally:
+        broker.unsubscribe(subscription)
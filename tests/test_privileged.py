@@ -0,0 +1,87 @@
+import pytest
+
+from app import privileged
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["net", "conf", "list"],
+        ["net", "conf", "setparm", "docs", "valid users", "alice,@staff"],
+        ["net", "conf", "setparm", "docs", "comment", ""],
+        ["net", "conf", "delshare", "team docs"],
+        ["smbcontrol", "smbd", "reload-config"],
+        ["smbstatus", "--json"],
+        ["testparm", "-s"],
+        ["pdbedit", "-L", "-w"],
+        ["pdbedit", "-i", "smbpasswd:/tmp/samba-import-x1y2.smbpasswd"],
+        ["smbpasswd", "-s", "-a", "alice"],
+    ],
+)
+def test_commands_used_by_the_app_are_allowed(args):
+    assert privileged._command_error(args) is None
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["net", "ads", "join", "-U", "administrator"],
+        ["net", "conf", "setparm", "docs", "root preexec", "/bin/sh"],
+        ["net", "conf", "import", "/home/mallory/evil.conf", "docs"],
+        ["net", "conf", "delshare", "--configfile=/tmp/x"],
+        ["pdbedit", "-x", "alice"],
+        ["pdbedit", "-i", "smbpasswd:/home/mallory/samba-import-x"],
+        ["smbpasswd", "-x", "-c/tmp/smb.conf"],
+        ["smbcontrol", "all", "shutdown"],
+        ["testparm", "-s", "/tmp/other.conf"],
+        ["sh", "-c", "id"],
+        [],
+    ],
+)
+def test_other_commands_are_refused(args):
+    assert privileged._command_error(args) is not None
+
+
+def test_write_files_leaves_originals_when_one_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(privileged, "ALLOWED_PATH_PREFIXES", (f"{tmp_path}/",))
+    first = tmp_path / "first.conf"
+    first.write_text("old\n")
+
+    with pytest.raises(OSError):
+        privileged.op_write_files(
+            {str(first): "new\n", str(tmp_path / "missing" / "x.conf"): "new\n"}
+        )
+
+    assert first.read_text() == "old\n"
+    assert [p.name for p in tmp_path.iterdir()] == ["first.conf"]
+
+
+@pytest.mark.parametrize(
+    "path", ["/", "/etc/samba/x", "/usr/local/share", "/root/docs", "relative/dir"]
+)
+def test_share_directories_are_refused_in_system_paths(path):
+    with pytest.raises(privileged.HelperError):
+        privileged.op_make_share_dir(path)
+
+
+def test_share_directory_in_a_home_must_belong_to_the_owner():
+    with pytest.raises(privileged.HelperError):
+        privileged.op_make_share_dir("/home/alice/docs", owner="root")
+
+
+def test_refused_writes_and_removals_fall_back_to_sudo(monkeypatch):
+    def refuse(ops):
+        return [{"ok": False, "error": "Path not allowed"} for _ in ops]
+
+    sudo = []
+    monkeypatch.setattr(privileged, "_use_helper", lambda: True)
+    monkeypatch.setattr(privileged.client, "batch", refuse)
+    monkeypatch.setattr(privileged, "write_file", lambda path, *a, **kw: True)
+    monkeypatch.setattr(privileged, "_sudo", lambda args, **kw: sudo.append(args))
+
+    assert privileged.write_files({"/srv/a.conf": "a"})
+    assert privileged.remove_files(["/srv/b.conf"])
+    assert sudo == [
+        ["mv", "-f", "/srv/a.conf.samba-manager-new", "/srv/a.conf"],
+        ["rm", "-f", "/srv/b.conf"],
+    ]
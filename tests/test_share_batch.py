@@ -0,0 +1,123 @@
+import os
+
+import pytest
+from flask import Flask
+
+from app import routes, samba_utils
+from app.routes import share_from_json
+
+SHARES = [
+    {"name": "docs", "path": "/srv/docs", "comment": "Documents"},
+    {"name": "media", "path": "/srv/media", "comment": "Media"},
+]
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """Commit against SHARES, recording what would be written"""
+    writes = []
+    monkeypatch.setattr(
+        samba_utils, "load_shares", lambda: [dict(share) for share in SHARES]
+    )
+    monkeypatch.setattr(
+        samba_utils,
+        "provision_share_directories",
+        lambda paths: {path: path != "/srv/broken" for path in paths},
+    )
+    monkeypatch.setattr(
+        samba_utils, "save_shares", lambda shares: writes.append(shares) or True
+    )
+    return writes
+
+
+def test_failed_operation_rolls_back_the_transaction(saved):
+    mutations = [
+        ("delete", "docs"),
+        ("upsert", {"name": "new", "path": "/srv/new"}),
+        ("upsert", {"name": "broken", "path": "/srv/broken"}),
+    ]
+    success, results = samba_utils.commit_share_changes(mutations, [(0, 3)])
+
+    assert not success
+    assert [ok for ok, _ in results] == [False, False, False]
+    assert saved == []
+
+
+def test_transactions_do_not_affect_other_mutations(saved):
+    mutations = [
+        ("delete", "docs"),
+        ("upsert", {"name": "broken", "path": "/srv/broken"}),
+        ("delete", "media"),
+    ]
+    success, results = samba_utils.commit_share_changes(mutations, [(0, 2)])
+
+    assert success
+    assert [ok for ok, _ in results] == [False, False, True]
+    assert [share["name"] for share in saved[0]] == ["docs"]
+
+
+def test_rollback_removes_directories_it_created(tmp_path, monkeypatch):
+    def provision(paths):
+        results = {}
+        for path in paths:
+            results[path] = "broken" not in path
+            if results[path]:
+                os.makedirs(path, exist_ok=True)
+        return results
+
+    monkeypatch.setattr(samba_utils, "DEV_MODE", True)
+    monkeypatch.setattr(samba_utils, "load_shares", lambda: [])
+    monkeypatch.setattr(samba_utils, "provision_share_directories", provision)
+    existing = tmp_path / "existing"
+    existing.mkdir()
+    mutations = [
+        ("upsert", {"name": "new", "path": str(tmp_path / "team" / "new")}),
+        ("upsert", {"name": "old", "path": str(existing)}),
+        ("upsert", {"name": "broken", "path": str(tmp_path / "broken")}),
+    ]
+
+    success, _ = samba_utils.commit_share_changes(mutations, [(0, 3)])
+
+    assert not success
+    assert [p.name for p in tmp_path.iterdir()] == ["existing"]
+
+
+def test_update_keeps_fields_that_were_not_sent():
+    current = {
+        "name": "docs",
+        "path": "/srv/docs",
+        "comment": "Documents",
+        "valid_users": "alice,@staff",
+        "write_list": "alice",
+        "create_mask": "0770",
+        "force_group": "staff",
+    }
+    share, error = share_from_json(
+        {"name": "docs", "read_only": True}, must_exist=False, current=current
+    )
+
+    assert error is None
+    assert share["read_only"] == "yes"
+    for key in ("path", "comment", "valid_users", "write_list", "create_mask"):
+        assert share[key] == current[key]
+    assert share["force_group"] == "staff"
+
+
+def test_created_share_gets_the_form_defaults():
+    share, error = share_from_json(
+        {"name": "new", "path": "/srv/new"}, must_exist=False
+    )
+
+    assert error is None
+    for key, value in samba_utils.NEW_SHARE_DEFAULTS.items():
+        assert share[key] == value
+
+
+@pytest.mark.parametrize("body", [[{"name": "docs"}], "docs", 3])
+def test_batch_rejects_a_body_that_is_not_an_object(monkeypatch, body):
+    monkeypatch.setattr(routes, "check_sudo_access", lambda: True)
+    with Flask(__name__).test_request_context(json=body):
+        response, status = routes.api_share_batch.__wrapped__()
+
+    assert status == 400
+    assert response.get_json()["success"] is False
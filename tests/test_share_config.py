@@ -0,0 +1,155 @@
+import os
+
+import pytest
+
+from app import samba_utils
+
+MAIN_CONF = """[global]
+   workgroup = WORKGROUP
+   include = {shares}
+"""
+
+SHARES_CONF = """# Samba shares configuration
+
+[projects]
+   # managed by hand
+   path = /srv/projects
+   valid users = alice
+   write list = bob
+   browsable = yes
+
+[scratch]
+\tpath = /srv/scratch
+\tguest ok = yes
+\tvfs objects = recycle \\
+\t    full_audit
+"""
+
+
+@pytest.fixture
+def config_files(tmp_path, monkeypatch):
+    shares_path = tmp_path / "shares.conf"
+    main_path = tmp_path / "smb.conf"
+    shares_path.write_text(SHARES_CONF)
+    main_path.write_text(MAIN_CONF.format(shares=shares_path))
+    monkeypatch.setattr(samba_utils, "SMB_CONF", str(main_path))
+    monkeypatch.setattr(samba_utils, "SHARE_CONF", str(shares_path))
+    samba_utils.invalidate_samba_config()
+    yield main_path, shares_path
+    samba_utils.invalidate_samba_config()
+
+
+def render(shares):
+    shares_doc, main_doc = samba_utils.render_share_changes(shares)
+    return str(shares_doc), str(main_doc)
+
+
+def test_load_then_save_is_byte_identical(config_files):
+    main_path, shares_path = config_files
+    shares_text, main_text = render(samba_utils.load_shares())
+    assert shares_text == shares_path.read_text()
+    assert main_text == main_path.read_text()
+
+
+def test_merged_valid_users_are_not_written_back(config_files):
+    shares = samba_utils.load_shares()
+    projects = next(share for share in shares if share["name"] == "projects")
+    # The write list user is shown as a valid user, but is not one in the file
+    assert projects["valid_users"] == "alice,bob"
+
+    projects["comment"] = "Team projects"
+    shares_text, _ = render(shares)
+    assert "   valid users = alice\n" in shares_text
+    assert "force group" not in shares_text
+    assert shares_text.replace("   comment = Team projects\n", "") == SHARES_CONF
+
+
+def test_only_changed_parameter_is_rewritten(config_files):
+    shares = samba_utils.load_shares()
+    scratch = next(share for share in shares if share["name"] == "scratch")
+    scratch["guest_ok"] = "no"
+    shares_text, _ = render(shares)
+    assert shares_text == SHARES_CONF.replace("guest ok = yes", "guest ok = no")
+
+
+@pytest.mark.parametrize(
+    "principal, changed",
+    [
+        (("user", "bob"), "   write list = \n"),
+        (("user", "alice"), None),
+    ],
+)
+def test_unreference_edits_only_the_list_naming_the_principal(
+    config_files, monkeypatch, principal, changed
+):
+    _, shares_path = config_files
+    saved = []
+    monkeypatch.setattr(
+        samba_utils, "save_shares", lambda shares: saved.append(render(shares)) or True
+    )
+
+    success, results = samba_utils.commit_share_changes([("unreference", principal)])
+
+    assert success
+    expected = SHARES_CONF
+    if changed is not None:
+        expected = expected.replace("   write list = bob\n", changed)
+    assert saved[0][0] == expected
+
+
+def install(content, path, **kwargs):
+    with open(path, "w") as f:
+        f.write(content)
+    samba_utils.invalidate_samba_config()
+
+
+def test_registry_migration_removes_shares_from_the_files(config_files, monkeypatch):
+    main_path, shares_path = config_files
+    main_path.write_text(main_path.read_text() + "\n[legacy]\n   path = /srv/legacy\n")
+    imported = []
+    monkeypatch.setattr(
+        samba_utils,
+        "_run_net_conf",
+        lambda *args: (
+            imported.append((args[1], args[2])) if args[0] == "import" else ""
+        ),
+    )
+    monkeypatch.setattr(samba_utils, "_read_registry_config", lambda: "")
+    monkeypatch.setattr(samba_utils, "reload_samba_service", lambda: True)
+    monkeypatch.setattr(samba_utils, "_install_config_file", install)
+
+    samba_utils._ensure_registry_layout()
+
+    assert imported == [
+        (str(main_path), "legacy"),
+        (str(shares_path), "projects"),
+        (str(shares_path), "scratch"),
+    ]
+    assert "[legacy]" not in main_path.read_text()
+    assert "registry shares = yes" in main_path.read_text()
+    assert "[projects]" not in shares_path.read_text()
+
+
+def test_fragment_delete_removes_shares_of_the_main_config(
+    config_files, tmp_path, monkeypatch
+):
+    main_path, shares_path = config_files
+    main_path.write_text(main_path.read_text() + "\n[legacy]\n   path = /srv/legacy\n")
+    fragments = tmp_path / "shares.d"
+    fragments.mkdir()
+    monkeypatch.setattr(samba_utils, "SHARE_BACKEND", "fragments")
+    monkeypatch.setattr(samba_utils, "SHARE_FRAGMENT_DIR", str(fragments))
+    monkeypatch.setattr(samba_utils, "_install_config_file", install)
+    monkeypatch.setattr(
+        samba_utils.privileged,
+        "remove_files",
+        lambda paths: [os.unlink(p) for p in paths],
+    )
+
+    assert samba_utils.delete_share_fragment("legacy")
+    assert samba_utils.delete_share_fragment("projects")
+    assert not samba_utils.delete_share_fragment("missing")
+
+    assert "[legacy]" not in main_path.read_text()
+    names = [share["name"] for share in samba_utils.load_shares()]
+    assert names == ["scratch"]
@@ -0,0 +1,47 @@
+import subprocess
+
+import pytest
+
+from app import privileged, smbstatus
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Answer smbstatus --json with the queued results, recording every call"""
+    calls = []
+    replies = []
+
+    def run(args):
+        calls.append(args)
+        if "--json" in args:
+            return replies.pop(0)
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+    monkeypatch.setattr(privileged, "run", run)
+    return calls, replies
+
+
+def failed(stderr, returncode=1):
+    return subprocess.CompletedProcess(["smbstatus", "--json"], returncode, "", stderr)
+
+
+def test_transient_json_failure_is_retried(runs):
+    calls, replies = runs
+    replies += [failed("Failed to open connections.tdb"), failed("timeout")]
+    collector = smbstatus.StatusCollector()
+
+    collector.collect()
+    collector.collect()
+
+    assert calls.count(["smbstatus", "--json"]) == 2
+
+
+def test_unknown_option_disables_json(runs):
+    calls, replies = runs
+    replies.append(failed("--json: unknown option\nUsage: smbstatus [OPTION...]"))
+    collector = smbstatus.StatusCollector()
+
+    collector.collect()
+    collector.collect()
+
+    assert calls == [["smbstatus", "--json"], ["smbstatus"], ["smbstatus"]]